@@ -0,0 +1,99 @@
+import os
+import time
+import argparse
+
+import numpy as np
+import faiss
+
+from services.reference_index import (
+    build_index, apply_search_params, build_metadata, search_parameters, ensure_current_version,
+    version_directory, EMBEDDINGS_DIR, EMBEDDINGS_FILE
+)
+from services.reference_filters import ReferenceFilters
+
+'''
+Compares approximate reference indexes (ivfpq / hnsw) against exact flat search.
+Reports recall@k (overlap with the flat top-k) and mean per-query latency
+for a sweep of nprobe / efSearch values.
+
+python -m batch.benchmark_index                     # vectors from reference_embeddings.npy
+python -m batch.benchmark_index --synthetic 200000  # random unit vectors, to size a bigger pool
+'''
+
+parser = argparse.ArgumentParser(description="Benchmark ANN reference indexes against flat search")
+parser.add_argument("--synthetic", type=int, default=0, help="use N random unit vectors instead of the saved pool")
+parser.add_argument("--dim", type=int, default=512, help="dimension for --synthetic")
+parser.add_argument("--queries", type=int, default=200)
+parser.add_argument("--k", type=int, default=10)
+parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+parser.add_argument("--categories", type=int, default=20, help="random categories for the filtered-search timing")
+args = parser.parse_args()
+
+
+def normalized(x: np.ndarray) -> np.ndarray:
+    x = np.ascontiguousarray(x, dtype="float32")
+    faiss.normalize_L2(x)
+    return x
+
+
+# 1. Load or generate the pool
+rng = np.random.default_rng(0)
+if args.synthetic:
+    base = normalized(rng.standard_normal((args.synthetic, args.dim)))
+else:
+    directory = version_directory(EMBEDDINGS_DIR, ensure_current_version(EMBEDDINGS_DIR))
+    base = normalized(np.load(os.path.join(directory, EMBEDDINGS_FILE)))
+
+# queries: pool vectors with noise, closer to real "generated image vs reference" lookups than random points
+picked = base[rng.integers(0, len(base), args.queries)]
+queries = normalized(picked + 0.05 * rng.standard_normal(picked.shape).astype("float32"))
+k = min(args.k, len(base))
+print(f"pool={len(base)} dim={base.shape[1]} queries={len(queries)} k={k}")
+
+
+def run(index, label: str, truth: np.ndarray | None = None) -> np.ndarray:
+    t0 = time.perf_counter()
+    _, I = index.search(queries, k)
+    ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    if truth is None:
+        print(f"{label:<22} {ms:8.3f} ms/query")
+    else:
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(I, truth)])
+        print(f"{label:<22} {ms:8.3f} ms/query  recall@{k}={recall:.3f}")
+    return I
+
+
+# 2. Ground truth
+faiss.omp_set_num_threads(1)  # per-query latency as seen by a single request
+truth = run(build_index(base, "flat"), "flat")
+
+# 3. Candidates
+for index_type, param, values in (("ivfpq", "nprobe", args.nprobe), ("hnsw", "efSearch", args.ef_search)):
+    try:
+        t0 = time.perf_counter()
+        index = build_index(base, index_type)
+        print(f"-- {index_type}: built in {time.perf_counter() - t0:.1f}s")
+    except ValueError as e:
+        print(f"-- {index_type}: skipped ({e})")
+        continue
+    for value in values:
+        if param == "nprobe":
+            apply_search_params(index, nprobe=value)
+        else:
+            apply_search_params(index, ef_search=value)
+        run(index, f"{index_type} {param}={value}", truth)
+
+# 4. Filtered flat search: filter evaluation + IDSelector search, for 1 and half of the categories
+flat = build_index(base, "flat")
+rows = [{"category": f"c{c}", "created_at": "2025-01-01T00:00:00"}
+        for c in rng.integers(0, args.categories, len(base))]
+filters = ReferenceFilters(build_metadata(rows, columns=("category", "created_at")), np.arange(len(base)))
+for wanted in (["c0"], [f"c{c}" for c in range(args.categories // 2)]):
+    t0 = time.perf_counter()
+    selector, count = filters.selector({"category": wanted})
+    select_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    flat.search(queries, k, params=search_parameters(flat, selector))
+    search_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    print(f"filtered flat ({count}/{len(base)} rows) filter {select_ms:.3f} ms + {search_ms:.3f} ms/query")
@@ -0,0 +1,78 @@
+import os
+import time
+import asyncio
+import argparse
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from transformers import AutoImageProcessor
+
+from services.clip_encoder import CLIP_MODEL_ID, load_encoder
+from services.image_fetcher import fetch_images, close_http_client
+from services.reference_index import (
+    EMBEDDINGS_DIR, EMBEDDINGS_FILE, METADATA_FILE, ensure_current_version, version_directory
+)
+
+'''
+Parity check for a CLIP encoder backend before switching CLIP_BACKEND / CLIP_QUANTIZE.
+Embeds a sample of reference images with the candidate backend and compares:
+- against the torch fp32 vision tower on the same pixels (backend error only)
+- against the stored reference vectors of the current index version
+  (end to end, includes any preprocessing differences of the batch job)
+and whether each sample still retrieves itself as the top-1 reference.
+Exits non-zero if the backend cosine falls below --min-cosine.
+
+python -m batch.clip_parity --backend onnx --quantize --samples 64
+'''
+
+parser = argparse.ArgumentParser(description="Compare a CLIP backend with the fp32 reference embeddings")
+parser.add_argument("--backend", choices=("torch", "onnx"), default="onnx")
+parser.add_argument("--quantize", action="store_true")
+parser.add_argument("--samples", type=int, default=32)
+parser.add_argument("--min-cosine", type=float, default=0.99)
+args = parser.parse_args()
+
+# 1. Sample reference rows of the current version
+directory = version_directory(EMBEDDINGS_DIR, ensure_current_version(EMBEDDINGS_DIR))
+metadata = np.load(os.path.join(directory, METADATA_FILE))
+stored = np.load(os.path.join(directory, EMBEDDINGS_FILE))
+rows = np.random.default_rng(0).choice(len(metadata), size=min(args.samples, len(metadata)), replace=False)
+urls = [metadata[i]["url"].decode("utf-8") for i in rows]
+
+
+async def download():
+    try:
+        return await fetch_images(urls)
+    finally:
+        await close_http_client()
+
+images = [Image.open(BytesIO(data)).convert("RGB") for data in asyncio.run(download())]
+processor = AutoImageProcessor.from_pretrained(CLIP_MODEL_ID, use_fast=False)
+pixel_values = processor(images=images, return_tensors="np")["pixel_values"]
+
+
+def timed(encoder) -> tuple:
+    encoder.encode(pixel_values[:1])  # first call initializes kernels
+    t0 = time.perf_counter()
+    vectors = encoder.encode(pixel_values)
+    return vectors, (time.perf_counter() - t0) * 1000 / len(pixel_values)
+
+# 2. Embed with baseline and candidate
+baseline, baseline_ms = timed(load_encoder("torch", False))
+candidate, candidate_ms = timed(load_encoder(args.backend, args.quantize))
+
+# 3. Compare
+backend_cos = np.sum(baseline * candidate, axis=1)
+stored_cos = np.sum(stored[rows] * candidate, axis=1)
+self_top1 = np.mean(np.argmax(candidate @ stored.T, axis=1) == rows)
+
+label = f"{args.backend}{'-int8' if args.quantize else ''}"
+print(f"samples={len(rows)} backend={label}")
+print(f"latency/image     torch-fp32 {baseline_ms:.1f} ms, {label} {candidate_ms:.1f} ms")
+print(f"cos vs torch-fp32 min {backend_cos.min():.4f} mean {backend_cos.mean():.4f}")
+print(f"cos vs stored     min {stored_cos.min():.4f} mean {stored_cos.mean():.4f}")
+print(f"self top-1 retrieval {self_top1:.3f}")
+if backend_cos.min() < args.min_cosine:
+    raise SystemExit(f"parity failed: min cosine {backend_cos.min():.4f} < {args.min_cosine}")
+print("OK")
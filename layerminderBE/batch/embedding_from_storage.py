@@ -1,103 +1,310 @@
-import os
-import requests 
-from PIL import Image
 import numpy as np
 import torch
 from transformers import CLIPProcessor, CLIPModel
 from supabase import create_client
-import faiss
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-import uuid
-import io
-import csv
+import asyncio
+import os
+import json
+import time
+import argparse
 
 from core.config import settings
+from services.image_fetcher import fetch_image, close_http_client
+from services.clip_preprocess import decode_resized
+from services.reference_index import (
+    build_index, build_metadata, metadata_rows, read_build_state, publish_reference_index,
+    index_type_of, stable_id, reference_uuid, EMBEDDINGS_DIR, METADATA_FILE, INDEX_TYPES
+)
 
 '''
-This script fetches images from a Supabase storage bucket, 
-processes them using a CLIP model to generate embeddings, 
-and saves these embeddings along with their metadata in a Faiss index and a CSV file.
+This script fetches images from a Supabase storage bucket,
+processes them using a CLIP model to generate embeddings,
+and saves these embeddings along with their metadata in a Faiss inner-product index
+and a memory-mappable .npy sidecar (see services/reference_index.py).
+
+By default the run is incremental: files are keyed by storage path and content
+hash (the storage eTag), only new or changed files are downloaded and embedded,
+and deleted files are dropped from the index. Index labels and
+reference_image_id are derived from the path, so they stay stable across runs
+and reference_image_pool is upserted instead of growing duplicate rows
+(rows carried over from the converted legacy index keep their original id).
+Use --full to re-embed everything.
+
+Downloads, decoding and CLIP run as a streaming pipeline (see embed_files);
+an interrupted run resumes from embed_checkpoint.npz.
 '''
 
-# env setting 
+# env setting
 REFERENCE_URL = settings.REFERENCE_URL
 SUPABASE_KEY = settings.SUPABASE_SERVICE_ROLE
 REFERENCE_STORAGE_BUCKET = settings.REFERENCE_STORAGE_BUCKET
 FOLDER = 'reference/'
-csv_path = "batch/embeddings/image_embeddings_metadata.csv"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+LIST_PAGE = 1000
+UPSERT_BATCH = 100
+CHECKPOINT_PATH = os.path.join(EMBEDDINGS_DIR, "embed_checkpoint.npz")
+FAILED_PATH = os.path.join(EMBEDDINGS_DIR, "failed_files.json")
+
+
+def list_reference_files(supabase) -> dict:
+    """{storage path: content hash} for every image under FOLDER (paginated, storage lists 100 by default)."""
+    files, offset = {}, 0
+    while True:
+        page = supabase.storage.from_(REFERENCE_STORAGE_BUCKET).list(
+            FOLDER, {"limit": LIST_PAGE, "offset": offset, "sortBy": {"column": "name", "order": "asc"}}
+        )
+        for f in page:
+            if not f['name'].lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            meta = f.get('metadata') or {}
+            # eTag is the content MD5 for regular uploads; fall back to size + mtime
+            content_hash = (meta.get('eTag') or '').strip('"') or f"{meta.get('size')}-{f.get('updated_at')}"
+            files[f"{FOLDER}{f['name']}"] = content_hash
+        if len(page) < LIST_PAGE:
+            return files
+        offset += LIST_PAGE
+
+
+def _embed_batch(model, processor, images: list[np.ndarray], device: str) -> np.ndarray:
+    inputs = processor(images=images, return_tensors="pt").to(device) # preprocessing before embedding
+    with torch.no_grad():
+        features = model.get_image_features(**inputs)
+        features = features / features.norm(dim=-1, keepdim=True) # L2 norm
+    return features.cpu().numpy().astype("float32")
+
+
+def load_checkpoint(files: dict) -> dict:
+    """{path: vector} embedded by an interrupted run, for files whose hash hasn't changed since."""
+    if not os.path.exists(CHECKPOINT_PATH):
+        return {}
+    ckpt = np.load(CHECKPOINT_PATH)
+    return {
+        str(p): v for p, h, v in zip(ckpt["paths"], ckpt["hashes"], ckpt["vectors"])
+        if files.get(str(p)) == str(h)
+    }
+
+
+def save_checkpoint(done: dict, files: dict, failed: dict) -> None:
+    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    paths = list(done)
+    tmp = f"{CHECKPOINT_PATH}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, paths=np.array(paths, dtype=str), hashes=np.array([files[p] for p in paths], dtype=str),
+                 vectors=np.stack([done[p] for p in paths]) if paths else np.zeros((0, 0), dtype="float32"))
+    os.replace(tmp, CHECKPOINT_PATH)
+    with open(FAILED_PATH, "w", encoding="utf-8") as f:
+        json.dump(failed, f, ensure_ascii=False, indent=2)
+
+
+def fetch_pool_metadata(supabase, reference_ids: list[str]) -> dict:
+    """reference_image_id -> reference_image_pool.metadata (category, style, ...) for the filter columns."""
+    metadata = {}
+    for i in range(0, len(reference_ids), UPSERT_BATCH):
+        res = supabase.table("reference_image_pool")\
+            .select("reference_image_id,metadata")\
+            .in_("reference_image_id", reference_ids[i:i + UPSERT_BATCH])\
+            .execute()
+        for r in res.data or []:
+            metadata[r["reference_image_id"]] = r.get("metadata") or {}
+    return metadata
+
 
-# 1. Connect Supabase
-supabase = create_client(REFERENCE_URL, SUPABASE_KEY)
+async def embed_files(paths: list[str], files: dict, device: str, batch_size: int,
+                      downloaders: int, decode_workers: int, checkpoint_every: int) -> tuple:
+    """
+    Streaming download -> decode -> batched CLIP.
+    Downloads run concurrently on the shared httpx client and feed a bounded
+    queue (so memory stays flat when CLIP is the bottleneck), JPEG decode +
+    resize runs in a process pool, and CLIP runs `batch_size` images per
+    forward pass in a thread so downloads keep going meanwhile.
+    Embedded vectors and failures are checkpointed every `checkpoint_every`
+    batches; a rerun picks the vectors up again and retries the failures.
+    Returns (L2-normalized embeddings, paths that succeeded).
+    """
+    done = load_checkpoint(files)
+    if done:
+        print(f"Resuming: {len(done)} embeddings restored from {CHECKPOINT_PATH}")
+    todo = [p for p in paths if p not in done]
+    failed: dict[str, dict] = {}
 
-# 2. Fetch image list
-img_list = supabase.storage.from_(REFERENCE_STORAGE_BUCKET).list(FOLDER)
-img_files = [f['name'] for f in img_list if f['name'].lower().endswith(('.jpg', '.jpeg','.png','.bmp', 'webp'))]
+    # fork the decode workers before torch spins up its thread pools
+    decode_pool = ProcessPoolExecutor(max_workers=decode_workers)
+    list(decode_pool.map(abs, range(decode_workers)))
 
-# 3. CLIP model load
-device = "cuda" if torch.cuda.is_available() else "cpu" # mps for silicon mac 
-model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
-processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32", use_fast=True)
+    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
+    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32", use_fast=True)
 
-# 4. Save embeddings
-embeddings = []
-rows_to_upsert = []
-total = len(img_files)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=batch_size * 4)
+    pending = iter(todo)
 
-now = datetime.now().isoformat()
+    async def download():
+        for path in pending:  # shared iterator: each path is taken by one downloader
+            url = f"{REFERENCE_URL}/storage/v1/object/public/{REFERENCE_STORAGE_BUCKET}/{path}"
+            try:
+                image = await loop.run_in_executor(decode_pool, decode_resized, await fetch_image(url))
+                await queue.put((path, image))
+            except Exception as e:
+                failed[path] = {"content_hash": files[path], "error": f"{type(e).__name__}: {e}"}
+                print(f"[ERROR] {path}: {e}")
 
-# 5. fetch and embed images
-for idx, filename in enumerate(img_files, 1):
-    img_id = os.path.splitext(os.path.basename(filename))[0]
-    url = f"{REFERENCE_URL}/storage/v1/object/public/{REFERENCE_STORAGE_BUCKET}/{FOLDER}{filename}"
+    async def feed():
+        await asyncio.gather(*[download() for _ in range(downloaders)])
+        await queue.put(None)
+
+    feeder = asyncio.create_task(feed())
+    started = time.perf_counter()
+    batches = 0
+    finished = False
     try:
-        # image -> url upload
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()  # Check for HTTP errors
-        # 2) BytesIO -> PIL Image
-        image = Image.open(io.BytesIO(response.content)).convert("RGB") # read image bytes from response 
-        response.close()
-        inputs = processor(images=image, return_tensors="pt").to(device) # preprocessing before embedding
-        with torch.no_grad():
-            features = model.get_image_features(**inputs)
-            features = features / features.norm(dim=-1, keepdim=True) # L2 norm
-            arr = features.cpu().numpy()[0]
-        embeddings.append(arr)
-
-        # Prepare metadata
-        new_id = str(uuid.uuid4())
-        rows_to_upsert.append({
-            "reference_image_id": new_id,
-            "url": url,
-            "created_at": now
+        while not finished:
+            batch = []
+            while len(batch) < batch_size:
+                item = await queue.get()
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+            if batch:
+                vectors = await asyncio.to_thread(_embed_batch, model, processor, [img for _, img in batch], device)
+                for (path, _), vec in zip(batch, vectors):
+                    done[path] = vec
+                batches += 1
+                elapsed = time.perf_counter() - started
+                processed = len(done) + len(failed) - (len(paths) - len(todo))
+                print(f"{int(len(done) / max(1, len(paths)) * 100)}% embedded {len(done)}/{len(paths)}, "
+                      f"{len(failed)} failed, {processed / elapsed:.1f} img/s")
+                if batches % checkpoint_every == 0:
+                    save_checkpoint(done, files, failed)
+        await feeder
+    finally:
+        if not feeder.done():
+            feeder.cancel()
+        save_checkpoint(done, files, failed)
+        decode_pool.shutdown(cancel_futures=True)
+        await close_http_client()
+
+    if failed:
+        print(f"{len(failed)} files failed, listed in {FAILED_PATH}; rerun to retry them")
+    embedded = [p for p in paths if p in done]
+    if not embedded:
+        return np.zeros((0, 0), dtype="float32"), []
+    return np.stack([done[p] for p in embedded]).astype("float32"), embedded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed reference images and build the FAISS index")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=None,
+                        help="flat (exact), ivfpq or hnsw (approximate, for large pools); default: keep the current type, else flat")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists for ivfpq (default ~4*sqrt(n))")
+    parser.add_argument("--full", action="store_true", help="ignore the previous build and re-embed every file")
+    parser.add_argument("--batch-size", type=int, default=32, help="images per CLIP forward pass")
+    parser.add_argument("--downloaders", type=int, default=16, help="concurrent downloads")
+    parser.add_argument("--decode-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="batches between checkpoints")
+    args = parser.parse_args()
+
+    # 1. Connect Supabase
+    supabase = create_client(REFERENCE_URL, SUPABASE_KEY)
+
+    # 2. Diff storage against the previous build
+    files = list_reference_files(supabase)
+    prev_index, prev_meta, prev_emb = (None, None, None) if args.full else read_build_state(EMBEDDINGS_DIR)
+    prev = {} if prev_meta is None else {
+        row["path"]: (pos, row) for pos, row in enumerate(metadata_rows(prev_meta))
+    }
+    # an empty hash comes from the converted legacy index: trust the row, adopt the storage hash
+    kept = [p for p, h in files.items() if p in prev and prev[p][1]["content_hash"] in (h, "")]
+    to_embed = sorted(p for p in files if p not in kept)
+    removed = [p for p in prev if p not in files]
+    print(f"{len(files)} files: {len(kept)} unchanged, {len(to_embed)} new/changed, {len(removed)} removed")
+
+    # 3. Embed only new / changed files
+    device = "cuda" if torch.cuda.is_available() else "cpu" # mps for silicon mac
+    new_emb, embedded = asyncio.run(embed_files(
+        to_embed, files, device, args.batch_size, args.downloaders, args.decode_workers, args.checkpoint_every
+    )) if to_embed else (None, [])
+    # a changed file that failed to download keeps its previous row and vector
+    # (and its old hash, so the next run retries it); only deleted files go stale
+    embedded_paths = set(embedded)
+    carried = [p for p in to_embed if p in prev and p not in embedded_paths]
+    if carried:
+        print(f"{len(carried)} changed files failed, keeping their previous embeddings")
+
+    # 4. Merge rows + embeddings, sorted by id
+    now = datetime.now().isoformat()
+    rows, vectors = [], []
+    for p in kept:
+        pos, row = prev[p]
+        rows.append(dict(row, content_hash=files[p]))
+        vectors.append(prev_emb[pos])
+    for p in carried:
+        pos, row = prev[p]
+        rows.append(row)
+        vectors.append(prev_emb[pos])
+    new_rows = []
+    for i, p in enumerate(embedded):
+        new_rows.append({
+            "id": stable_id(p),
+            # a changed file keeps its pool row (legacy rows have random ids)
+            "reference_image_id": prev[p][1]["reference_image_id"] if p in prev else reference_uuid(p),
+            "url": f"{REFERENCE_URL}/storage/v1/object/public/{REFERENCE_STORAGE_BUCKET}/{p}",
+            "created_at": now,
+            "path": p,
+            "content_hash": files[p],
         })
-        percent = int((idx / total) *100)
-        print(f"{percent}% Image embedded: {img_id} ({idx}/{total})")
-    except Exception as e:
-        print(f"[ERROR] {filename}: {e}")
-
-# # 6. Embedding in faiss
-os.makedirs("batch/embeddings", exist_ok=True)
-
-embeddings = np.stack(embeddings)
-d = embeddings.shape[1]
-index = faiss.IndexFlatL2(d)
-index.add(embeddings)
-faiss.write_index(index, "batch/embeddings/image_embeddings.index")
-print(f"{len(embeddings)} embeddings saved")
-
-# 7. Save metadata to local CSV
-with open(csv_path, "w", newline="", encoding="utf-8") as f:
-    writer = csv.DictWriter(f, fieldnames=["reference_image_id", "url", "created_at"])
-    writer.writeheader()
-    writer.writerows(rows_to_upsert)
-print(f"{len(rows_to_upsert)} metadata rows saved to {csv_path}.")
-
-# 8. Push to supabase storage
-BATCH = 100
-for i in range(0, len(rows_to_upsert), BATCH):
-    chunk = rows_to_upsert[i:i + BATCH]
-    resp = supabase.table("reference_image_pool")\
-        .upsert(chunk, on_conflict="reference_image_id")\
-        .execute()
-
-print(f"{len(rows_to_upsert)} rows upserted to reference_image_pool")
\ No newline at end of file
+        vectors.append(new_emb[i])
+    rows += new_rows
+    if not rows:
+        print("No embeddings, nothing to write")
+        return
+    # filter columns are refreshed from the pool on every run, so tagging rows in the
+    # DB takes effect at the next build (files added by this run get them next time)
+    pool_metadata = fetch_pool_metadata(supabase, [r["reference_image_id"] for r in rows])
+    for r in rows:
+        meta = pool_metadata.get(r["reference_image_id"]) or {}
+        r["category"] = str(meta.get("category") or "")
+        r["style"] = str(meta.get("style") or "")
+
+    order = sorted(range(len(rows)), key=lambda i: rows[i]["id"])
+    rows = [rows[i] for i in order]
+    embeddings = np.stack([vectors[i] for i in order]).astype("float32")
+    ids = np.array([r["id"] for r in rows], dtype="int64")
+
+    # 5. Patch the previous index in place where possible, else build from the stored embeddings
+    index_type = args.index_type or (index_type_of(prev_index) if prev_index is not None else "flat")
+    if prev_index is not None and index_type_of(prev_index) == index_type and index_type != "hnsw":
+        reused = set(kept) | set(carried)
+        stale = [prev[p][1]["id"] for p in prev if p not in reused]  # removed + re-embedded
+        if stale:
+            prev_index.remove_ids(np.array(stale, dtype="int64"))
+        if new_rows:
+            prev_index.add_with_ids(new_emb, np.array([r["id"] for r in new_rows], dtype="int64"))
+        index = prev_index
+        print(f"Patched {index_type} index: -{len(stale)} +{len(new_rows)}")
+    else:
+        index = build_index(embeddings, index_type, ids=ids, nlist=args.nlist)
+        print(f"Built {index_type} index from {len(ids)} embeddings")
+
+    # 6. Push new / changed rows to supabase first (stable ids -> upsert, no duplicates):
+    # once CURRENT moves, workers recommend these ids and history_records has an FK on them.
+    # Rows of removed files stay in reference_image_pool: history_records references them.
+    pool_rows = [{k: r[k] for k in ("reference_image_id", "url", "created_at")} for r in new_rows]
+    for i in range(0, len(pool_rows), UPSERT_BATCH):
+        supabase.table("reference_image_pool")\
+            .upsert(pool_rows[i:i + UPSERT_BATCH], on_conflict="reference_image_id")\
+            .execute()
+    print(f"{len(pool_rows)} rows upserted to reference_image_pool")
+
+    # 7. Publish index + metadata sidecar (sorted by id) + raw vectors as a new version, last;
+    # running API workers pick it up on their next reload check
+    version = publish_reference_index(index, build_metadata(rows), EMBEDDINGS_DIR, embeddings=embeddings)
+    print(f"{len(rows)} embeddings and metadata published to {EMBEDDINGS_DIR} as version {version} ({METADATA_FILE})")
+    if os.path.exists(CHECKPOINT_PATH):
+        os.remove(CHECKPOINT_PATH)  # everything it held is in the index now
+
+
+if __name__ == "__main__":
+    main()
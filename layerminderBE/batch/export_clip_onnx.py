@@ -0,0 +1,77 @@
+import os
+import argparse
+
+import torch
+from transformers import CLIPVisionModelWithProjection
+
+from services.clip_encoder import CLIP_MODEL_ID, onnx_path
+
+'''
+Exports the CLIP image tower (+ projection) to ONNX for CLIP_BACKEND=onnx.
+Input "pixel_values" (N, 3, 224, 224) float32, output "image_embeds" (N, 512),
+batch dimension dynamic. --quantize also writes the int8 dynamic-quantized
+variant next to it (used with CLIP_QUANTIZE=true).
+Requires the optional 'onnx' and 'onnxruntime' packages.
+
+python -m batch.export_clip_onnx --quantize
+python -m batch.clip_parity --backend onnx --quantize
+'''
+
+
+class ImageEmbeds(torch.nn.Module):
+    """Only the tensor we need as output, so the graph has a single named output."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).image_embeds
+
+
+def export_onnx(model, output: str, opset: int = 17) -> None:
+    """CLIPVisionModelWithProjection -> fp32 ONNX graph at `output`."""
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    size = model.config.image_size
+    with torch.no_grad():
+        torch.onnx.export(
+            ImageEmbeds(model.eval()),
+            (torch.zeros(1, 3, size, size),),
+            output,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=opset,
+            dynamo=False,
+        )
+
+
+def quantize_onnx(path: str) -> str:
+    """int8 dynamic quantization (weights int8, activations quantized at runtime). Returns the new path."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = path.replace(".onnx", ".int8.onnx")
+    quantize_dynamic(path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the CLIP image encoder to ONNX")
+    parser.add_argument("--output", default=onnx_path(False), help="fp32 model path (default: CLIP_ONNX_PATH)")
+    parser.add_argument("--quantize", action="store_true", help="also write the int8 model")
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    # 1. Export fp32
+    export_onnx(CLIPVisionModelWithProjection.from_pretrained(CLIP_MODEL_ID), args.output, args.opset)
+    print(f"exported {args.output} ({os.path.getsize(args.output) / 2**20:.0f} MB)")
+
+    # 2. int8 variant next to it
+    if args.quantize:
+        int8_path = quantize_onnx(args.output)
+        print(f"quantized {int8_path} ({os.path.getsize(int8_path) / 2**20:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
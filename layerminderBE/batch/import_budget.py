@@ -0,0 +1,62 @@
+import sys
+import argparse
+import subprocess
+
+'''
+Import-time budget for the API process.
+Runs `python -X importtime -c "import run"` in a fresh interpreter and reports
+the total import time, peak RSS and the slowest modules, and fails if the
+budget is exceeded or an ML dependency is imported (those belong behind the
+pipeline / worker boundary and load lazily on first use).
+
+python -m batch.import_budget              # default budget: 1.0s
+python -m batch.import_budget --budget 0.8 --top 30
+'''
+
+FORBIDDEN = ("numpy", "faiss", "torch", "transformers", "PIL")
+
+parser = argparse.ArgumentParser(description="Check the import-time budget of run.py")
+parser.add_argument("--module", default="run", help="module to import (default: run)")
+parser.add_argument("--budget", type=float, default=1.0, help="max seconds for the import")
+parser.add_argument("--top", type=int, default=20, help="slowest modules to list")
+args = parser.parse_args()
+
+code = (
+    "import time, resource; t = time.perf_counter(); "
+    f"import {args.module}; "
+    "print(time.perf_counter() - t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+)
+proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+if proc.returncode != 0:
+    print("\n".join(l for l in proc.stderr.splitlines() if not l.startswith("import time:"))[-2000:])
+    raise SystemExit(f"importing {args.module} failed")
+
+# 1. Parse "import time: self [us] | cumulative | imported package"
+modules = []
+for line in proc.stderr.splitlines():
+    if not line.startswith("import time:") or "imported package" in line:
+        continue
+    self_us, cumulative_us, name = [part.strip() for part in line.split(":", 1)[1].split("|")]
+    modules.append((int(cumulative_us), int(self_us), name))
+
+seconds, max_rss_kb = proc.stdout.split()
+seconds = float(seconds)
+
+# 2. Report
+print(f"import {args.module}: {seconds:.3f}s (budget {args.budget:.3f}s), peak RSS {int(max_rss_kb) / 1024:.0f} MB, "
+      f"{len(modules)} modules")
+print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+for cumulative_us, self_us, name in sorted(modules, reverse=True)[:args.top]:
+    print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+
+# 3. Budget
+loaded = {name for _, _, name in modules}
+heavy = sorted(m for m in loaded if m.split(".")[0] in FORBIDDEN)
+failures = []
+if heavy:
+    failures.append(f"ML dependencies imported at startup: {', '.join(heavy[:10])}")
+if seconds > args.budget:
+    failures.append(f"import took {seconds:.3f}s > {args.budget:.3f}s")
+if failures:
+    raise SystemExit("\n".join(failures))
+print("OK")
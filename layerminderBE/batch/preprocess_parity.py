@@ -0,0 +1,80 @@
+import os
+import time
+import asyncio
+import argparse
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from transformers import AutoImageProcessor
+
+from services.clip_encoder import CLIP_MODEL_ID, load_encoder
+from services.clip_preprocess import preprocess
+from services.image_fetcher import fetch_images, close_http_client
+from services.reference_index import EMBEDDINGS_DIR, METADATA_FILE, ensure_current_version, version_directory
+
+'''
+Tolerance check of the NumPy preprocessing (CLIP_PREPROCESS=numpy) against
+the HF AutoImageProcessor(use_fast=False) it replaces.
+Reports pixel differences, per-image preprocessing time of both paths and,
+with --embed, the cosine between the resulting CLIP vectors.
+
+python -m batch.preprocess_parity --samples 32 --embed
+python -m batch.preprocess_parity --files a.jpeg b.png
+'''
+
+parser = argparse.ArgumentParser(description="Compare NumPy CLIP preprocessing with the HF processor")
+parser.add_argument("--files", nargs="*", help="local images (default: sample of the reference pool)")
+parser.add_argument("--samples", type=int, default=32)
+parser.add_argument("--embed", action="store_true", help="also compare CLIP embeddings (torch backend)")
+parser.add_argument("--max-mean-abs", type=float, default=0.05, help="tolerance on normalized pixel values")
+parser.add_argument("--min-cosine", type=float, default=0.995)
+args = parser.parse_args()
+
+
+# 1. Images as raw bytes
+if args.files:
+    blobs = [open(path, "rb").read() for path in args.files]
+else:
+    directory = version_directory(EMBEDDINGS_DIR, ensure_current_version(EMBEDDINGS_DIR))
+    metadata = np.load(os.path.join(directory, METADATA_FILE))
+    rows = np.random.default_rng(0).choice(len(metadata), size=min(args.samples, len(metadata)), replace=False)
+
+    async def download():
+        try:
+            return await fetch_images([metadata[i]["url"].decode("utf-8") for i in rows])
+        finally:
+            await close_http_client()
+
+    blobs = asyncio.run(download())
+
+# 2. Both paths, timed end to end from bytes
+processor = AutoImageProcessor.from_pretrained(CLIP_MODEL_ID, use_fast=False)
+
+t0 = time.perf_counter()
+hf = processor(images=[Image.open(BytesIO(b)).convert("RGB") for b in blobs], return_tensors="np")["pixel_values"]
+hf_ms = (time.perf_counter() - t0) * 1000 / len(blobs)
+
+t0 = time.perf_counter()
+fast = preprocess(blobs)
+fast_ms = (time.perf_counter() - t0) * 1000 / len(blobs)
+
+# 3. Compare
+diff = np.abs(hf - fast)
+print(f"images={len(blobs)} shape={fast.shape}")
+print(f"preprocess/image  hf {hf_ms:.1f} ms, numpy {fast_ms:.1f} ms ({hf_ms / max(fast_ms, 1e-9):.1f}x)")
+print(f"pixel |diff|      mean {diff.mean():.4f} max {diff.max():.4f} (normalized units)")
+failures = []
+if diff.mean() > args.max_mean_abs:
+    failures.append(f"mean pixel diff {diff.mean():.4f} > {args.max_mean_abs}")
+
+if args.embed:
+    encoder = load_encoder("torch", False)
+    cos = np.sum(encoder.encode(hf) * encoder.encode(fast), axis=1)
+    print(f"embedding cosine  min {cos.min():.4f} mean {cos.mean():.4f}")
+    if cos.min() < args.min_cosine:
+        failures.append(f"min cosine {cos.min():.4f} < {args.min_cosine}")
+
+if failures:
+    raise SystemExit("\n".join(failures))
+print("OK")
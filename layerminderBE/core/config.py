@@ -13,6 +13,72 @@ class Settings(BaseSettings):
     REFERENCE_STORAGE_BUCKET: str
     JWT_SECRET: str
 
+    # Supabase async data layer
+    SUPABASE_TIMEOUT_SEC: float = 20.0
+
+    # Pipeline stage events: "local" (in-process) or "redis" (across workers)
+    EVENT_BROKER: str = "local"
+    REDIS_URL: str = "redis://localhost:6379/0"
+
+    # Pipeline job queue: "background" (in the API process) or "sqlite" (worker.py)
+    PIPELINE_QUEUE: str = "background"
+    PIPELINE_QUEUE_PATH: str = "data/pipeline_jobs.db"
+    WORKER_CONCURRENCY: int = 4
+    JOB_LEASE_SEC: float = 600.0
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BACKOFF_SEC: float = 30.0  # before the 2nd attempt, doubled per attempt
+    JOB_RETRY_BACKOFF_MAX_SEC: float = 600.0
+    WORKER_METRICS_PORT: int = 0  # >0: worker.py serves /metrics on this port
+
+    # Per-user credit balance cache for /credits/balance (0 disables)
+    CREDIT_BALANCE_CACHE_SEC: float = 10.0
+
+    # Concurrent external calls / CPU jobs per process
+    OPENAI_IMAGE_EDIT_CONCURRENCY: int = 4
+    OPENAI_CHAT_CONCURRENCY: int = 8
+    CLIP_CONCURRENCY: int = 2
+
+    # CLIP executor: "thread" or "process" pool, CLIP_WORKERS x CLIP_TORCH_THREADS cores
+    CLIP_EXECUTOR: str = "thread"
+    CLIP_WORKERS: int = 1
+    CLIP_TORCH_THREADS: int = 1  # intra-op threads, torch or onnxruntime
+    # image encoder runtime: "torch" | "onnx" (see services/clip_encoder.py)
+    CLIP_BACKEND: str = "torch"
+    CLIP_QUANTIZE: bool = False
+    CLIP_ONNX_PATH: str = "data/clip_vision.onnx"
+    # "numpy" (reduced-scale JPEG decode, batched normalize) | "hf" (AutoImageProcessor)
+    CLIP_PREPROCESS: str = "numpy"
+    # load CLIP + the reference index in the background at boot (see /ready)
+    WARMUP_ON_STARTUP: bool = False
+
+    # Recommendation (CLIP)
+    CLIP_BATCH_SIZE: int = 8
+    # ANN search params, applied when the reference index is IVF / HNSW
+    FAISS_NPROBE: int = 16
+    FAISS_EF_SEARCH: int = 64
+    # references stored per record; "rrf" (one query per image, rank fusion) | "mean" (averaged query)
+    RECOMMENDATION_TOP_N: int = 5
+    RECOMMENDATION_STRATEGY: str = "rrf"
+    RECOMMENDATION_CANDIDATES: int = 50  # per query, before re-ranking
+    RECOMMENDATION_RRF_K: int = 60
+    RECOMMENDATION_MMR_LAMBDA: float = 0.7  # 1.0 = no diversity re-rank
+    # seconds between checks for a newly published index version (0 = never reload)
+    INDEX_RELOAD_INTERVAL_SEC: float = 30.0
+    # CLIP embeddings by image content hash: LRU entries per process + on-disk store ("" = memory only)
+    EMBEDDING_CACHE_SIZE: int = 1024
+    EMBEDDING_CACHE_DIR: str = "data/embedding_cache"
+    EMBEDDING_CACHE_DTYPE: str = "float16"
+    EMBEDDING_CACHE_DISK_MB: int = 512  # disk level cap, 0 = unlimited
+
+    # Generated image vectors for "similar images": "local" (SQLite) | "pgvector"
+    IMAGE_VECTOR_STORE: str = "local"
+    IMAGE_VECTOR_STORE_PATH: str = "data/image_vectors.db"
+
+    # Image fetching (shared async HTTP client)
+    IMAGE_FETCH_TIMEOUT_SEC: float = 10.0
+    IMAGE_FETCH_MAX_CONNECTIONS: int = 32
+    IMAGE_FETCH_MAX_CONNECTIONS_PER_HOST: int = 8
+
     model_config = SettingsConfigDict(
         env_file=str(Path(__file__).parent.parent.parent/".env"),
         env_file_encoding="utf-8",
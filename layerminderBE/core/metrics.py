@@ -0,0 +1,56 @@
+"""
+Prometheus metrics: pipeline stage timings and per-route request latency.
+Exposed on /metrics (run.py). Set PROMETHEUS_MULTIPROC_DIR when running
+several uvicorn workers so /metrics aggregates all of them.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Pipeline stages run from ~10ms (FAISS search) to ~90s (image edit)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180)
+
+PIPELINE_STAGE_SECONDS = Histogram(
+    "layerminder_pipeline_stage_seconds",
+    "Duration of generation pipeline stages and sub-steps",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "layerminder_http_request_duration_seconds",
+    "HTTP request latency by route (time to response start for streams)",
+    ["method", "route", "status"],
+)
+
+
+@contextmanager
+def observe(stage: str) -> Iterator[None]:
+    """with observe("image.openai_edit"): ...  (also fine around awaits)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PIPELINE_STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def observe_seconds(stage: str, seconds: float) -> None:
+    """For timings measured elsewhere (e.g. inside the CLIP executor process)."""
+    PIPELINE_STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def render_latest() -> tuple[bytes, str]:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,7 +1,42 @@
 import os 
-from supabase import create_client
+import asyncio
+from supabase import create_client, acreate_client, AsyncClient, AsyncClientOptions
 from core.config import settings
 
 SUPABASE_URL = settings.SUPABASE_URL
 SUPABASE_KEY = settings.SUPABASE_SERVICE_ROLE
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
\ No newline at end of file
+
+# Sync client: batch scripts and one-off jobs only.
+# Request handlers and the pipeline go through `repositories` (async).
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Async client: one per process, its PostgREST/Storage sessions are
+# pooled httpx HTTP/2 clients shared by every request on the event loop.
+_async_client: AsyncClient | None = None
+_async_lock: asyncio.Lock | None = None
+
+
+async def get_async_supabase() -> AsyncClient:
+    global _async_client, _async_lock
+    if _async_client is not None:
+        return _async_client
+    if _async_lock is None:
+        _async_lock = asyncio.Lock()
+    async with _async_lock:
+        if _async_client is None:
+            _async_client = await acreate_client(
+                SUPABASE_URL,
+                SUPABASE_KEY,
+                options=AsyncClientOptions(
+                    postgrest_client_timeout=settings.SUPABASE_TIMEOUT_SEC,
+                    storage_client_timeout=int(settings.SUPABASE_TIMEOUT_SEC),
+                ),
+            )
+    return _async_client
+
+
+async def close_async_supabase() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.postgrest.aclose()
+        _async_client = None
@@ -0,0 +1,57 @@
+"""
+Async access to the credit RPCs
+(see migrations/*_add_beta_credit_system.sql, *_add_credit_reservations.sql).
+"""
+from typing import Any
+
+from core.supabase_client import get_async_supabase
+
+
+async def get_user_credits(user_id: str) -> Any:
+    db = await get_async_supabase()
+    res = await db.rpc("get_user_credits", {"p_user_id": user_id}).execute()
+    return res.data
+
+
+async def consume_credit(user_id: str, amount: int, reason: str) -> Any:
+    db = await get_async_supabase()
+    res = await db.rpc(
+        "consume_credit",
+        {
+            "p_user_id": user_id,
+            "p_amount": amount,
+            "p_reason": reason
+        }
+    ).execute()
+    return res.data
+
+
+async def reserve_credit(user_id: str, amount: int, reason: str) -> Any:
+    db = await get_async_supabase()
+    res = await db.rpc(
+        "reserve_credit",
+        {
+            "p_user_id": user_id,
+            "p_amount": amount,
+            "p_reason": reason
+        }
+    ).execute()
+    return res.data
+
+
+async def commit_credit(reservation_id: str) -> Any:
+    db = await get_async_supabase()
+    res = await db.rpc("commit_credit", {"p_reservation_id": reservation_id}).execute()
+    return res.data
+
+
+async def refund_credit(reservation_id: str, reason: str) -> Any:
+    db = await get_async_supabase()
+    res = await db.rpc(
+        "refund_credit",
+        {
+            "p_reservation_id": reservation_id,
+            "p_reason": reason
+        }
+    ).execute()
+    return res.data
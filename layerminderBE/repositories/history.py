@@ -0,0 +1,175 @@
+"""
+Async access to history_sessions, history_records and history_record_images.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+from core.supabase_client import get_async_supabase
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _first(rows: Optional[list]) -> Optional[dict]:
+    return rows[0] if rows else None
+
+
+# ---- history_sessions ----
+async def create_session(session_id: str, user_id: str, created_at: str) -> dict:
+    db = await get_async_supabase()
+    row = {"session_id": session_id, "user_id": user_id, "created_at": created_at}
+    res = await db.table("history_sessions").insert(row).execute()
+    return _first(res.data) or row
+
+
+async def list_sessions(user_id: str) -> list[dict]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("history_sessions")
+        .select("session_id, user_id, created_at")
+        .eq("user_id", user_id)
+        .order("created_at")
+        .execute()
+    )
+    return res.data or []
+
+
+async def get_session_owner(session_id: str) -> Optional[str]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("history_sessions")
+        .select("user_id")
+        .eq("session_id", session_id)
+        .limit(1)
+        .execute()
+    )
+    row = _first(res.data)
+    return row["user_id"] if row else None
+
+
+async def delete_session(session_id: str, user_id: str) -> list[dict]:
+    """Returns the deleted rows (empty when nothing matched)."""
+    db = await get_async_supabase()
+    res = await (
+        db.table("history_sessions")
+        .delete()
+        .eq("session_id", session_id)
+        .eq("user_id", user_id)
+        .execute()
+    )
+    return res.data or []
+
+
+async def list_record_summaries(user_id: str) -> list[dict]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("v_record_list")
+        .select("*")
+        .eq("user_id", user_id)
+        .order("created_at")
+        .execute()
+    )
+    return res.data or []
+
+
+# ---- history_records ----
+async def create_record(record_id: str, session_id: str) -> None:
+    db = await get_async_supabase()
+    now = now_iso()
+    await db.table("history_records").insert({
+        "record_id": record_id,
+        "session_id": session_id,
+        "image_status": "pending",
+        "created_at": now,
+        "updated_at": now
+    }).execute()
+
+
+async def update_record(record_id: str, fields: dict) -> None:
+    """Partial update; updated_at is always refreshed."""
+    db = await get_async_supabase()
+    await (
+        db.table("history_records")
+        .update({**fields, "updated_at": now_iso()})
+        .eq("record_id", record_id)
+        .execute()
+    )
+
+
+async def get_record(record_id: str, columns: str = "*") -> Optional[dict]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("history_records")
+        .select(columns)
+        .eq("record_id", record_id)
+        .limit(1)
+        .execute()
+    )
+    return _first(res.data)
+
+
+def flatten_record_images(rows: Optional[list]) -> list[dict]:
+    """Nested history_record_images(image_id, seq, images(url)) -> [{image_id, seq, url}] by seq."""
+    return sorted(
+        (
+            {
+                "image_id": r.get("image_id"),
+                "seq": r.get("seq"),
+                "url": (r.get("images") or {}).get("url")
+            }
+            for r in (rows or [])
+        ),
+        key=lambda r: r["seq"] or 0
+    )
+
+
+async def get_record_detail(user_id: str, record_id: str) -> Optional[dict]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("v_record_detail")
+        .select("*")
+        .eq("user_id", user_id)
+        .eq("record_id", record_id)
+        .limit(1)
+        .execute()
+    )
+    return _first(res.data)
+
+
+# ---- history_record_images ----
+async def add_record_images(rows: list[dict]) -> None:
+    """Bulk insert of {record_id, image_id, seq} rows."""
+    db = await get_async_supabase()
+    await db.table("history_record_images").insert(rows).execute()
+
+
+async def delete_record_images(record_id: str) -> None:
+    db = await get_async_supabase()
+    await db.table("history_record_images").delete().eq("record_id", record_id).execute()
+
+
+async def list_record_images(record_id: str) -> list[dict]:
+    """[{image_id, seq, url}] ordered by seq."""
+    db = await get_async_supabase()
+    res = await (
+        db.table("history_record_images")
+        .select("image_id, seq, images(url)")
+        .eq("record_id", record_id)
+        .order("seq")
+        .execute()
+    )
+    return flatten_record_images(res.data)
+
+
+async def get_record_id_for_image(image_id: str) -> Optional[str]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("history_record_images")
+        .select("record_id")
+        .eq("image_id", image_id)
+        .limit(1)
+        .execute()
+    )
+    row = _first(res.data)
+    return row["record_id"] if row else None
@@ -0,0 +1,45 @@
+"""
+Async access to image_embeddings / match_user_images
+(see migrations/*_add_image_embeddings.sql). Used when IMAGE_VECTOR_STORE=pgvector.
+"""
+import json
+from typing import Optional
+
+from core.supabase_client import get_async_supabase
+
+
+async def upsert_embeddings(rows: list[dict]) -> None:
+    db = await get_async_supabase()
+    await db.table("image_embeddings").upsert(rows, on_conflict="image_id").execute()
+
+
+async def get_embedding(user_id: str, image_id: str) -> Optional[list[float]]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("image_embeddings")
+        .select("embedding")
+        .eq("user_id", user_id)
+        .eq("image_id", image_id)
+        .limit(1)
+        .execute()
+    )
+    rows = res.data or []
+    if not rows:
+        return None
+    embedding = rows[0]["embedding"]
+    # PostgREST returns vector columns as their text form "[0.1,0.2,...]"
+    return json.loads(embedding) if isinstance(embedding, str) else embedding
+
+
+async def match_user_images(user_id: str, image_id: str, offset: int, size: int) -> list[dict]:
+    db = await get_async_supabase()
+    res = await db.rpc(
+        "match_user_images",
+        {
+            "p_user_id": user_id,
+            "p_image_id": image_id,
+            "p_limit": size,
+            "p_offset": offset
+        }
+    ).execute()
+    return [{"image_id": r["image_id"], "score": r["score"]} for r in res.data or []]
@@ -0,0 +1,48 @@
+"""
+Async access to the images table.
+"""
+from typing import Optional
+
+from core.supabase_client import get_async_supabase
+
+
+async def create_images(rows: list[dict]) -> list[dict]:
+    """Bulk insert; a single row is passed as a one-item list."""
+    db = await get_async_supabase()
+    res = await db.table("images").insert(rows).execute()
+    return res.data or []
+
+
+async def get_image_url(image_id: str) -> Optional[str]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("images")
+        .select("url")
+        .eq("image_id", image_id)
+        .limit(1)
+        .execute()
+    )
+    rows = res.data or []
+    return rows[0]["url"] if rows else None
+
+
+async def get_image(image_id: str, columns: str = "*") -> Optional[dict]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("images")
+        .select(columns)
+        .eq("image_id", image_id)
+        .limit(1)
+        .execute()
+    )
+    rows = res.data or []
+    return rows[0] if rows else None
+
+
+async def get_image_urls(image_ids: list[str]) -> dict[str, str]:
+    """image_id -> url for the given ids (missing ids are left out)."""
+    if not image_ids:
+        return {}
+    db = await get_async_supabase()
+    res = await db.table("images").select("image_id,url").in_("image_id", image_ids).execute()
+    return {r["image_id"]: r["url"] for r in res.data or []}
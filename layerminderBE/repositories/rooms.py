@@ -0,0 +1,117 @@
+"""
+Async access to layer_rooms and room_images.
+"""
+from typing import Optional
+
+from core.supabase_client import get_async_supabase
+
+
+def _first(rows: Optional[list]) -> Optional[dict]:
+    return rows[0] if rows else None
+
+
+# ---- layer_rooms ----
+async def slug_exists(owner_id: str, slug: str) -> bool:
+    db = await get_async_supabase()
+    res = await (
+        db.table("layer_rooms")
+        .select("id")
+        .eq("owner_id", owner_id)
+        .eq("slug", slug)
+        .limit(1)
+        .execute()
+    )
+    return bool(res.data)
+
+
+async def create_room(room: dict) -> Optional[dict]:
+    db = await get_async_supabase()
+    res = await db.table("layer_rooms").insert(room).execute()
+    return _first(res.data)
+
+
+async def list_rooms(
+    user_id: str,
+    mine: bool,
+    q: str,
+    offset: int,
+    size: int,
+) -> list[dict]:
+    db = await get_async_supabase()
+    query = db.table("layer_rooms").select("*").is_("archived_at", "null") # picking up alive ones 
+    if mine:
+        query = query.eq("owner_id", user_id)
+    else:
+        query = query.eq("is_public", True)
+
+    if q:
+        query = query.ilike("name", f"%{q}%")
+
+    res = await (
+        query.range(offset, offset + size - 1)
+            .order("created_at", desc=True)
+            .execute()
+    )
+    return res.data or []
+
+
+async def get_room(room_id: str, columns: str = "*", alive_only: bool = False) -> Optional[dict]:
+    db = await get_async_supabase()
+    query = db.table("layer_rooms").select(columns).eq("id", room_id)
+    if alive_only:
+        query = query.is_("archived_at", "null")
+    res = await query.limit(1).execute()
+    return _first(res.data)
+
+
+async def update_room(room_id: str, fields: dict) -> Optional[dict]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("layer_rooms")
+        .update(fields)
+        .eq("id", room_id)
+        .execute()
+    )
+    return _first(res.data)
+
+
+# ---- room_images ----
+async def add_room_image(row: dict) -> Optional[dict]:
+    db = await get_async_supabase()
+    res = await db.table("room_images").insert(row).execute()
+    return _first(res.data)
+
+
+async def list_room_images(room_id: str) -> list[dict]:
+    db = await get_async_supabase()
+    res = await (
+        db.table("room_images")
+        .select("room_image_id, image_id, note, seq, images(url)")
+        .eq("room_id", room_id)
+        .order("seq")  # Order by seq
+        .execute()
+    )
+    return res.data or []
+
+
+async def remove_room_image(room_id: str, image_id: str) -> list[dict]:
+    """Returns the deleted rows (empty when the image was not pinned)."""
+    db = await get_async_supabase()
+    res = await (
+        db.table("room_images")
+        .delete()
+        .eq("room_id", room_id)
+        .eq("image_id", image_id)
+        .execute()
+    )
+    return res.data or []
+
+
+async def increment_pin_count(room_id: str) -> None:
+    db = await get_async_supabase()
+    await db.rpc("increment_pin_count", {"room_id_param": room_id}).execute()
+
+
+async def decrement_pin_count(room_id: str) -> None:
+    db = await get_async_supabase()
+    await db.rpc("decrement_pin_count", {"room_id_param": room_id}).execute()
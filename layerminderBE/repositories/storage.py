@@ -0,0 +1,16 @@
+"""
+Async access to Supabase storage.
+"""
+from core.config import settings
+from core.supabase_client import get_async_supabase
+
+
+def public_url(bucket: str, key: str) -> str:
+    """Public object URL, built locally (no round trip)."""
+    base = settings.SUPABASE_URL.rstrip("/")
+    return f"{base}/storage/v1/object/public/{bucket}/{key.lstrip('/')}"
+
+
+async def upload(bucket: str, key: str, content: bytes, content_type: str = "image/jpeg") -> None:
+    db = await get_async_supabase()
+    await db.storage.from_(bucket).upload(key, content, {"contentType": content_type})
@@ -0,0 +1,10 @@
+"""
+Async access to Supabase Auth users (admin API).
+"""
+from core.supabase_client import get_async_supabase
+
+
+async def get_user_by_id(user_id: str):
+    db = await get_async_supabase()
+    res = await db.auth.admin.get_user_by_id(user_id)
+    return res.user
@@ -1,8 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-import jwt
 
 from core.config import settings
-from core.supabase_client import supabase
+from repositories import users as users_repo
 from auth import get_current_user
 from schemas import ProfileResponse
 
@@ -16,8 +15,7 @@ async def get_profile(user_id: str = Depends(get_current_user)):
     2) Return profile table from Supabase Auth
     """
     try:
-        user = supabase.auth.admin.get_user_by_id(user_id)
-        info = user.user
+        info = await users_repo.get_user_by_id(user_id)
         metadata = info.user_metadata or {}
 
 
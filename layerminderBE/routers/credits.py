@@ -30,7 +30,7 @@ async def get_credit_balance(user_id: str = Depends(get_current_user)) -> Credit
     Returns:
         CreditBalanceResponse with user_id and current credit balance
     """
-    credits = credit_service.get_user_credits(user_id)
+    credits = await credit_service.get_user_credits(user_id)
 
     return CreditBalanceResponse(
         user_id=user_id,
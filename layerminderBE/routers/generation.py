@@ -2,13 +2,12 @@ from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, status
 from fastapi.responses import StreamingResponse
 import asyncio, json, uuid
 
-from datetime import datetime, timezone
-
-from core.supabase_client import supabase
+from repositories import history as history_repo
 from auth import get_current_user
 from schemas import ImageGenerationRequest, ImageGenerationResponse
-from services.pipeline import full_pipeline
+from services.jobs import get_job_queue
 from services.credit import credit_service 
+from services.events import event_hub
 
 router = APIRouter(tags=['AI'])
 
@@ -22,66 +21,70 @@ async def generate_images(
     backgound_tasks: BackgroundTasks,
     user_id: str=Depends(get_current_user)
 ):
-    # 1) Check credits FIRST (before any processing)
-    current_credits = credit_service.get_user_credits(user_id)
-    if current_credits < 1:
-        raise HTTPException(
-            status_code=status.HTTP_402_PAYMENT_REQUIRED,
-            detail={
-                "error": "insufficient_credits",
-                "message": "You don't have enough credits to generate images.",
-                "current_credits": current_credits,
-                "required_credits": 1
-            }
-        )
-
-    # 2) Checking the session
-    sess = (
-        supabase.table("history_sessions")
-        .select("user_id")
-        .eq("session_id", str(payload.session_id))
-        .single().execute()
-    )
+    # 1) Checking the session
+    owner_id = await history_repo.get_session_owner(str(payload.session_id))
 
-    if not sess.data or sess.data["user_id"] != user_id:
+    if owner_id != user_id:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    # 3) Consume credit (this will fail if concurrent request depleted credits)
-    success = credit_service.consume_credit(
+    # 2) Reserve credit: check + deduct in one atomic call
+    #    (committed by the pipeline, refunded if image generation fails)
+    reservation = await credit_service.reserve_credit(
         user_id=user_id,
         amount=1,
         reason=f"Image generation for session {payload.session_id}"
     )
 
-    if not success:
+    if not reservation.get("reserved"):
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
             detail={
-                "error": "credit_consumption_failed",
-                "message": "Failed to consume credit. Please try again.",
-                "current_credits": credit_service.get_user_credits(user_id)
+                "error": "insufficient_credits",
+                "message": "You don't have enough credits to generate images.",
+                "current_credits": reservation.get("credits", 0),
+                "required_credits": 1
             }
         )
+    reservation_id = reservation["reservation_id"]
 
-    # 4) Create record (pending)
-    record_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
-    supabase.table("history_records").insert({
-        "record_id": record_id,
-        "session_id": str(payload.session_id),
-        "image_status": "pending",
-        "created_at": now,
-        "updated_at": now
-    }).execute()
+    try:
+        # 3) Create record (pending)
+        record_id = str(uuid.uuid4())
+        await history_repo.create_record(record_id, str(payload.session_id))
 
-    # 5) Apply BackgroundTask
-    backgound_tasks.add_task(
-        full_pipeline,
-        record_id,
-        payload.input_image_keys,
-        user_id,
-        payload.keyword
-    )
+        # 4) Hand over to the worker queue, or run as BackgroundTask in this process
+        job_queue = get_job_queue()
+        if job_queue is not None:
+            await asyncio.to_thread(job_queue.enqueue, record_id, {
+                "input_image_keys": payload.input_image_keys,
+                "keyword": payload.keyword,
+                "user_id": user_id,
+                "reservation_id": reservation_id,
+            })
+        else:
+            # imported here: API replicas behind a queue never load the pipeline stack
+            from services.pipeline import full_pipeline
+
+            # tracked now, so early /stream subscribers get pushes
+            event_hub.track(record_id)
+            backgound_tasks.add_task(
+                full_pipeline,
+                record_id,
+                payload.input_image_keys,
+                payload.keyword,
+                user_id,
+                reservation_id=reservation_id
+            )
+    except Exception:
+        # 5) Nothing will run: give the credit back (a failed refund is logged,
+        #    the original error is what the client gets)
+        try:
+            await credit_service.refund_reservation(
+                reservation_id, user_id, reason="Generation could not be started"
+            )
+        except Exception:
+            pass
+        raise
 
     # 6) Response
     return ImageGenerationResponse(
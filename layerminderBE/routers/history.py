@@ -3,10 +3,11 @@ from uuid import UUID
 from datetime import datetime, timezone
 from typing import List
 import uuid
+from postgrest.exceptions import APIError
 
-from core.supabase_client import supabase
+from repositories import history as history_repo
 from auth import get_current_user
-from schemas import HistorySession
+from schemas import HistorySession, RecordRecommendationsOut
 
 router = APIRouter(tags=["history"])
 
@@ -15,25 +16,19 @@ router = APIRouter(tags=["history"])
 async def create_session(user_id: str = Depends(get_current_user)):
     session_id = str(uuid.uuid4())
     created_at = datetime.now(timezone.utc).isoformat()
-    row = {"session_id": session_id, "user_id": user_id, "created_at": created_at}
-    resp = supabase.table("history_sessions").insert(row).execute()
-    if getattr(resp, "error", None):
-        raise HTTPException(status_code=500, detail=f"DB insert failed: {resp.error}")
+    try:
+        await history_repo.create_session(session_id, user_id, created_at)
+    except APIError as e:
+        raise HTTPException(status_code=500, detail=f"DB insert failed: {e.message}")
     return HistorySession(session_id=session_id, user_id=user_id, created_at=created_at)
 
 # 2. Get session
 @router.get("/history_sessions", response_model=List[HistorySession])
 async def list_sessions(user_id: str = Depends(get_current_user)):
-    resp = (
-        supabase.table("history_sessions")
-        .select("session_id, user_id, created_at")
-        .eq("user_id", user_id)
-        .order("created_at")
-        .execute()
-    )
-    if getattr(resp, "error", None):
-        raise HTTPException(status_code=500, detail=f"DB fetch failed: {resp.error}")
-    sessions = resp.data or []
+    try:
+        sessions = await history_repo.list_sessions(user_id)
+    except APIError as e:
+        raise HTTPException(status_code=500, detail=f"DB fetch failed: {e.message}")
     return [HistorySession(**s) for s in sessions]
 
 # 3. Delete Session
@@ -46,21 +41,16 @@ async def delete_session(
     user_id: str = Depends(get_current_user)
 ):
     # Delete corresponding user_id's row
-    resp = (
-        supabase.table("history_sessions")
-        .delete()
-        .eq("session_id", session_id) # same as WHERE id = <session_id>
-        .eq("user_id", user_id)
-        .execute()
-    )
-    if getattr(resp, "error", None):
+    try:
+        deleted = await history_repo.delete_session(session_id, user_id)
+    except APIError as e:
         raise HTTPException(
             status_code=500,
-            detail=f"DB delete failed: {resp.error.message}"
+            detail=f"DB delete failed: {e.message}"
         )
     
     # Error 401: no data to delete
-    if not resp.data or len(resp.data) == 0:
+    if not deleted:
         raise HTTPException(
             status_code=404,
             detail="Session not found or already deleted"
@@ -68,15 +58,41 @@ async def delete_session(
     
 # 4. Get Images from history session
 @router.get("/history_sessions/images")
-def list_session_images(user_id: str = Depends(get_current_user)):
+async def list_session_images(user_id: str = Depends(get_current_user)):
     try:
-        res = (supabase.table("v_record_list")
-                .select("*")
-                .eq("user_id",user_id)
-                .order("created_at")
-                .execute()
-        )
+        data = await history_repo.list_record_summaries(user_id)
     except Exception as e:
         raise HTTPException(500, detail = f"Supabase Error: {e}")
-    data = res.data or []
-    return data
\ No newline at end of file
+    return data
+
+# 5. Get the top-N reference recommendations of a record
+@router.get("/history_records/{record_id}/recommendations",
+            response_model=RecordRecommendationsOut)
+async def get_record_recommendations(
+    record_id: UUID,
+    user_id: str = Depends(get_current_user)):
+    try:
+        row = await history_repo.get_record(
+            str(record_id),
+            "session_id,recommendation_status,recommendations,reference_image_id,reference_image_pool(url)"
+        )
+        owner = await history_repo.get_session_owner(row["session_id"]) if row else None
+    except APIError as e:
+        raise HTTPException(status_code=500, detail=f"DB fetch failed: {e.message}")
+
+    if not row or owner != user_id:
+        raise HTTPException(404, detail="Record not found")
+
+    items = row.get("recommendations") or []
+    # records from before top-N recommendations only have the single reference
+    if not items and row.get("reference_image_id"):
+        items = [{
+            "rank": 1,
+            "reference_image_id": row["reference_image_id"],
+            "url": (row.get("reference_image_pool") or {}).get("url"),
+        }]
+    return RecordRecommendationsOut(
+        record_id=record_id,
+        recommendation_status=row.get("recommendation_status"),
+        items=items,
+    )
@@ -4,8 +4,10 @@ image meta data 등록하는 API
 '''
 
 from fastapi import APIRouter, HTTPException, Depends, status
+from postgrest.exceptions import APIError
 from schemas import ImageMetadataRequest, ImageMetadataResponse
-from core.supabase_client import supabase
+from repositories import images as images_repo
+from repositories import storage as storage_repo
 from core.config import settings
 from auth import get_current_user
 
@@ -20,7 +22,7 @@ router = APIRouter(tags=["images"])
 @router.post("/images/metadata", 
              response_model = ImageMetadataResponse,
              status_code=status.HTTP_201_CREATED)
-def create_image_metadata(
+async def create_image_metadata(
     req: ImageMetadataRequest,
     user_id: str = Depends(get_current_user)
     ):
@@ -30,9 +32,9 @@ def create_image_metadata(
     created_at = datetime.now(timezone.utc).isoformat()
     
     # 2) public URL
-    public_url = supabase.storage.from_(STORAGE_BUCKET).get_public_url(req.file_key)
-    if not public_url:
+    if not req.file_key:
         raise HTTPException(status_code=400, detail="Invalid file_key")
+    public_url = storage_repo.public_url(STORAGE_BUCKET, req.file_key)
 
     # Insert into DB
     images_row = {
@@ -42,12 +44,13 @@ def create_image_metadata(
         "type": req.type,
         "created_at": created_at
     }
-    resp = supabase.table("images").insert(images_row).execute()
+    try:
+        await images_repo.create_images([images_row])
     # error Handling
-    if getattr(resp, "error", None):
+    except APIError as e:
         raise HTTPException(
             status_code=500,
-            detail=f"DB insert failed: {resp.error}"
+            detail=f"DB insert failed: {e.message}"
         )
     
     return ImageMetadataResponse(
@@ -56,4 +59,4 @@ def create_image_metadata(
         url=public_url,
         type=req.type,
         created_at=created_at
-    )
\ No newline at end of file
+    )
@@ -1,41 +1,73 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Query, status
 from uuid import UUID
+import asyncio
 
-from core.supabase_client import supabase
+from repositories import history as history_repo
+from repositories import images as images_repo
 from auth import get_current_user
-from schemas import ImageRecordInfoOut
+from schemas import ImageRecordInfoOut, SimilarImagesOut
 
 router = APIRouter(tags=['images_view'])
 
 # Clicks image
 @router.get("/images/{image_id}/record",
             response_model=ImageRecordInfoOut)
-def get_image_record_info(
+async def get_image_record_info(
     image_id: UUID,
     user_id: str = Depends(get_current_user)):
     
     # 1) From view, get the rows that matches user_id, image_id
-    rec = (supabase.table("history_record_images")
-             .select("record_id")
-             .eq("image_id", str(image_id))
-             .single()
-             .execute()
-    ).data
-
-    if not rec:
-        raise HTTPException(404, detail="Image not found or not clickable")
+    record_id = await history_repo.get_record_id_for_image(str(image_id))
 
-    record_id = rec["record_id"]
+    if not record_id:
+        raise HTTPException(404, detail="Image not found or not clickable")
 
     # 2) record_id -> detail(image array + ref + keywords)
-    row = (supabase.table("v_record_detail")
-           .select("*")
-           .eq("user_id", user_id)
-           .eq("record_id", record_id)
-           .single()
-           .execute()
-           ).data
+    row = await history_repo.get_record_detail(user_id, record_id)
     if not row:
         raise HTTPException(404, detail = "Record not found")
     
     return row
+
+# Similar images, from the vectors the recommendation stage already computed
+@router.get("/images/{image_id}/similar",
+            response_model=SimilarImagesOut)
+async def get_similar_images(
+    image_id: UUID,
+    kind: str = Query("generated", pattern="^(generated|reference)$"),
+    page: int = 1,
+    size: int = 20,
+    user_id: str = Depends(get_current_user)):
+
+    # imported here: numpy/faiss stay out of API startup (see batch/import_budget.py)
+    from services.vector_store import get_vector_store
+
+    page = max(1, page)
+    size = max(1, min(size, 100))
+    offset = (page - 1) * size
+
+    # 1) Only the owner's images are searchable
+    image = await images_repo.get_image(str(image_id), "user_id")
+    if not image or str(image.get("user_id")) != user_id:
+        raise HTTPException(404, detail="Image not found")
+
+    store = get_vector_store()
+
+    # 2-a) Nearest images of the same user
+    if kind == "generated":
+        matches = await store.similar(user_id, str(image_id), offset, size)
+        if matches is None:
+            raise HTTPException(404, detail="No embedding for this image yet")
+        urls = await images_repo.get_image_urls([m["image_id"] for m in matches])
+        items = [{**m, "url": urls.get(m["image_id"])} for m in matches]
+
+    # 2-b) Nearest reference items (same FAISS index as the recommendation)
+    else:
+        vector = await store.get(user_id, str(image_id))
+        if vector is None:
+            raise HTTPException(404, detail="No embedding for this image yet")
+        from services.recommendation import search_references
+        refs = await asyncio.to_thread(search_references, vector, offset, size)
+        items = [{"image_id": r["reference_image_id"], "url": r["url"], "score": r["score"]} for r in refs]
+
+    return SimilarImagesOut(image_id=image_id, kind=kind, page=page, size=size, items=items)
@@ -10,7 +10,7 @@ from schemas import (
     RoomUpdate,
     RoomOut
 )
-from core.supabase_client import supabase
+from repositories import rooms as rooms_repo
 from auth import get_current_user
 
 router = APIRouter(prefix="/layer-rooms", tags=["layer-rooms"])
@@ -25,7 +25,7 @@ def _slug_with_suffix(base: str) -> str:
     return f"{base}-{str(uuid.uuid4())[:4]}"
 
 @router.post("", response_model=RoomOut, status_code=status.HTTP_201_CREATED)
-def create_room(body: RoomCreate, 
+async def create_room(body: RoomCreate, 
                 user_id: str = Depends(get_current_user)):
     """
     Create a new layer room.
@@ -35,16 +35,7 @@ def create_room(body: RoomCreate,
     slug = base_slug or str(uuid.uuid4())[:8]
 
     # Check if slug already exists for this user
-    existing_room = (
-        supabase.table("layer_rooms")
-        .select("id")
-        .eq("owner_id", user_id)
-        .eq("slug", slug)
-        .execute()
-        .data
-        or []
-    )
-    if existing_room:
+    if await rooms_repo.slug_exists(user_id, slug):
         slug = _slug_with_suffix(base_slug)
 
     room_data = {
@@ -59,18 +50,19 @@ def create_room(body: RoomCreate,
     }
 
     # Insert into DB
-    response = supabase.table("layer_rooms").insert(room_data).execute()
-    if getattr(response, "error", None):
+    try:
+        room = await rooms_repo.create_room(room_data)
+    except APIError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=response.error.message
+            detail=e.message
         )
 
-    return RoomOut(**response.data[0])
+    return RoomOut(**(room or room_data))
 
 
 @router.get("", response_model=List[RoomOut])
-def list_rooms(
+async def list_rooms(
     page: int = 1,       # Seperated in pages to deliever
     size: int = 20,      # How many rows in single page to be?
     mine: bool = True,   # Only mine or else
@@ -82,45 +74,23 @@ def list_rooms(
     """
     page = max(1, page)
     size = max(1, min(size, 100))
-    query = supabase.table("layer_rooms").select("*").is_("archived_at", "null") # picking up alive ones 
-    if mine:
-        query = query.eq("owner_id", user_id)
-    else:
-        query = query.eq("is_public", True)
-
-    if q:
-        query = query.ilike("name", f"%{q}%")
-
     offset = (page - 1) * size
-    rows = (
-        query.range(offset, offset + size - 1)
-            .order("created_at", desc=True)
-            .execute()
-            .data or []
-    )
+    rows = await rooms_repo.list_rooms(user_id, mine, q, offset, size)
     return [RoomOut(**row) for row in rows]
 
 
 @router.get("/{room_id}", response_model=RoomOut)
-def get_room(room_id: uuid.UUID, user_id: str = Depends(get_current_user)):
+async def get_room(room_id: uuid.UUID, user_id: str = Depends(get_current_user)):
     """
     Get a single layer room.
     """
-    response = (
-        supabase.table("layer_rooms")
-        .select("*")
-        .eq("id", str(room_id))
-        .is_("archived_at", "null")
-        .maybe_single()
-        .execute()
-    )
-
-    if not response.data:
+    room = await rooms_repo.get_room(str(room_id), alive_only=True)
+
+    if not room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Room not found"
         )
 
-    room = response.data
     if not room["is_public"] and room["owner_id"] != user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -131,7 +101,7 @@ def get_room(room_id: uuid.UUID, user_id: str = Depends(get_current_user)):
 
 
 @router.patch("/{room_id}", response_model=RoomOut)
-def update_room(
+async def update_room(
     room_id: uuid.UUID,
     body: RoomUpdate,
     user_id: str = Depends(get_current_user),
@@ -140,18 +110,12 @@ def update_room(
     Update a layer room.
     """
     # First, verify the user owns the room
-    room_response = (
-        supabase.table("layer_rooms")
-        .select("owner_id")
-        .eq("id", str(room_id))
-        .maybe_single()
-        .execute()
-    )
-    if not room_response.data:
+    room = await rooms_repo.get_room(str(room_id), columns="owner_id")
+    if not room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Room not found"
         )
-    if room_response.data["owner_id"] != user_id:
+    if room["owner_id"] != user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have permission to update this room",
@@ -169,19 +133,13 @@ def update_room(
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
 
     try:
-        res = (
-            supabase.table("layer_rooms")
-            .update(update_data)
-            .eq("id", str(room_id))
-            .execute()
-        )
+        row = await rooms_repo.update_room(str(room_id), update_data)
     except APIError as e:
         raise HTTPException(
             status_code = status.HTTP_400_BAD_REQUEST,
             detail=e.message or "Supabase update failed"
         )
 
-    row = (res.data or [None])[0]
     if not row:
         raise HTTPException(status_code=404, detail="Room not found or not updated")
     
@@ -189,36 +147,32 @@ def update_room(
 
 
 @router.delete("/{room_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_room(room_id: uuid.UUID, user_id: str = Depends(get_current_user)):
+async def delete_room(room_id: uuid.UUID, user_id: str = Depends(get_current_user)):
     """
     Delete (archive) a layer room.
     """
     try:
-        room_res = (
-            supabase.table("layer_rooms")
-            .select("owner_id")
-            .eq("id", str(room_id))
-            .maybe_single()
-            .execute()
-        )
+        room = await rooms_repo.get_room(str(room_id), columns="owner_id")
     except APIError as e:
         raise HTTPException(
             status_code=400,
             detail=e.message or "Room not found."
         )
 
-    if room_res.data["owner_id"] != user_id:
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Room not found"
+        )
+    if room["owner_id"] != user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have permission to delete this room",
         )
 
     try:
-        res = (
-            supabase.table("layer_rooms")
-            .update({"archived_at": datetime.now(timezone.utc).isoformat()})
-            .eq("id", str(room_id))
-            .execute()
+        await rooms_repo.update_room(
+            str(room_id),
+            {"archived_at": datetime.now(timezone.utc).isoformat()}
         )
     except APIError as e:
         raise HTTPException(
@@ -1,5 +1,8 @@
 '''
 Router for generation router's SSE
+Stage results are pushed by full_pipeline through services.events;
+polling history_records is only the fallback for records processed
+by another process (and for the catch-up snapshot on connect).
 '''
 
 from fastapi import APIRouter, HTTPException
@@ -8,7 +11,8 @@ import asyncio
 import json
 import time
 
-from core.supabase_client import supabase
+from repositories import history as history_repo
+from services.events import event_hub
 
 router = APIRouter(tags=["AI"])
 
@@ -20,167 +24,172 @@ READY = "ready"
 FAILED = "failed"
 ERROR_STATES_IMAGE={"error_images", "error"}
 
+# SSE event -> key in `sent`
+STAGE_EVENTS = {
+    "images_generated": "image",
+    "story_generated": "story",
+    "keywords_generated": "keywords",
+    "recommendation_generated": "recommendation",
+}
+
+
+def _failed_stages(event: str, data) -> tuple[str, ...]:
+    """Stages a failure event settles; story and keywords are one pipeline stage."""
+    if not isinstance(data, dict):
+        return ()
+    if event == "generation_failed":
+        stage = data.get("stage")
+        return ("story", "keywords") if stage in ("story", "keywords") else ((stage,) if stage else ())
+    if event == "error" and data.get("step") in STAGE_EVENTS.values():
+        return (data["step"],)
+    return ()
+
+
 def sse_event(event: str, data: dict | list | str) -> str:
     """Format a Server-Sent Event."""
     payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
     return f"event: {event}\ndata: {payload}\n\n"
 
 
+STATUS_COLUMNS = "image_status,story_status,keywords_status,reference_image_id,recommendation_status,recommendation_error"
+
+# Payload columns (joins included) fetched with the status row until their stage is sent
+PAYLOAD_COLUMNS = {
+    "image": "history_record_images(image_id,seq,images(url))",
+    "story": "story",
+    "keywords": "keywords",
+    "recommendation": "reference_image_pool(url),recommendations",
+}
+
+
+async def _poll_events(record_id: str, settled: dict) -> list[tuple[str, dict | list, bool]]:
+    """
+    One poll of history_records: status and payload columns in one round trip.
+    Returns (event, data, final) for every stage that is ready or failed but
+    not sent yet. Only an image failure is final: the other stages run
+    concurrently, so one failing says nothing about the rest.
+    """
+    events = []
+    columns = ",".join([STATUS_COLUMNS] + [c for key, c in PAYLOAD_COLUMNS.items() if not settled[key]])
+
+    try:
+        row = await history_repo.get_record(record_id, columns)
+        if not row:
+            return [("error", {"step": "poll", "error": "record_not_found"}, True)]
+    except Exception as e:
+        return [("error", {"step": "poll", "error": str(e)}, False)]  # keep trying until timeout
+    
+    # Failures handling
+    if row.get("image_status") in ERROR_STATES_IMAGE:
+        return [("generation_failed", {"reason": "stage_failed", "stage": "image"}, True)]
+    if not settled["story"] and row.get("story_status") == "error":
+        events.append(("generation_failed", {"reason": "stage_failed", "stage": "story"}, False))
+    elif not settled["keywords"] and row.get("keywords_status") == "error":
+        events.append(("generation_failed", {"reason": "stage_failed", "stage": "keywords"}, False))
+    
+    # 1) images ready
+    if not settled["image"] and row.get("image_status") == "ready":
+        imgs = history_repo.flatten_record_images(row.get("history_record_images"))
+        events.append(("images_generated", imgs, False))
+
+    # 2) story ready
+    if not settled["story"] and row.get("story_status") == "ready":
+        events.append(("story_generated", {"story": row.get("story")}, False))
+
+    # 3) keywords ready
+    if not settled["keywords"] and row.get("keywords_status") == "ready":
+        events.append(("keywords_generated", {"keywords": row.get("keywords")}, False))
+
+    # 4) recommendation ready (presence check)
+    rec_status = row.get("recommendation_status")
+    if not settled["recommendation"] and rec_status == FAILED:
+        events.append(("error", {
+            "step": "recommendation",
+            "error": row.get("recommendation_error") or "unknown"
+        }, False))
+    
+    if (not settled["recommendation"]) and (rec_status == READY):
+        events.append(("recommendation_generated", {
+            "reference_image_id": row.get("reference_image_id"),
+            "reference_image_url": (row.get("reference_image_pool") or {}).get("url"),
+            "recommendations": row.get("recommendations") or []
+        }, False))
+
+    return events
+
+
 @router.get("/stream/{record_id}")
 async def stream_generation(record_id: str):
     # 1) Pre-check: record existence (fail fast)
     try:
-        record = (
-            supabase.table("history_records")
-            .select("record_id")
-            .eq("record_id", record_id)
-            .single()
-            .execute()
-        )
-        if not record.data:
-            raise HTTPException(status_code=404, detail="Record not found")
+        record = await history_repo.get_record(record_id, "record_id")
     except Exception as e:
         # If Supabase itself errors on the pre-check, surface that
         raise HTTPException(status_code=500, detail=f"Precheck failed: {e}")
+    if not record:
+        raise HTTPException(status_code=404, detail="Record not found")
 
     async def event_generator():
         sent = {"image": False, "story": False, "keywords": False, "recommendation": False}
+        # stage -> sent or failed; the stream ends once every stage settled
+        settled = dict(sent)
         start = time.monotonic()
         last_heartbeat = start
+        snapshot_taken = False
 
         try:
-            while True:
-                # Timeout guard
-                now = time.monotonic()
-                if now - start > TIMEOUT_SEC:
-                    yield sse_event("generation_failed", {"reason": "timeout"})
-                    return
-
-                # Heartbeat ping
-                if now - last_heartbeat >= HEARTBEAT_INTERVAL_SEC:
-                    yield sse_event("ping", {"t": int(now)})
-                    last_heartbeat = now
-
-                # Poll the minimal status fields
-                try:
-                    row = (
-                        supabase.table("history_records")
-                        .select("image_status,story_status,keywords_status,reference_image_id,recommendation_status,recommendation_error")
-                        .eq("record_id", record_id)
-                        .single()
-                        .execute()
-                        .data
-                    )
-                    if not row:
-                        yield sse_event("error", {"step": "poll", "error": "record_not_found"})
-                        break
-                except Exception as e:
-                    yield sse_event("error", {"step": "poll", "error": str(e)})
-                    await asyncio.sleep(POLL_INTERVAL_SEC)
-                    continue  # keep trying until timeout
-                
-                # Failures handling
-                if row.get("image_status") in ERROR_STATES_IMAGE:
-                    yield sse_event("generation_failed", {"reason": "stage_failed", "stage": "image"})
-                    return
-                if row.get("story_status") == "error":
-                    yield sse_event("generation_failed", {"reason": "stage_failed", "stage": "story"})
-                    return
-                if row.get("keywords_status") == "error":
-                    yield sse_event("generation_failed", {"reason":"stage_failed", "stage": "keywords"})
-                    return
-                
-                # 1) images ready
-                if not sent["image"] and row.get("image_status") == "ready":
-                    try:
-                        imgs = (
-                            supabase.table("history_record_images")
-                            .select("image_id,seq, images(url)")
-                            .eq("record_id", record_id)
-                            .order("seq")
-                            .execute()
-                            .data
-                        ) or []
-                        # Flatten nested "images": {"url":"..."} into "url"
-                        imgs = [
-                            {
-                                "image_id": r.get("image_id"),
-                                "seq": r.get("seq"),
-                                "url": (r.get("images") or {}).get("url")
-                            }
-                            for r in imgs
-                        ]
-                        yield sse_event("images_generated", imgs)
-                        sent["image"] = True
-                    except Exception as e:
-                        yield sse_event("error", {"step": "images", "error": str(e)})
-
-                # 2) story ready
-                if not sent["story"] and row.get("story_status") == "ready":
-                    try:
-                        story = (
-                            supabase.table("history_records")
-                            .select("story")
-                            .eq("record_id", record_id)
-                            .single()
-                            .execute()
-                            .data
-                        ) or {}
-                        yield sse_event("story_generated", story)
-                        sent["story"] = True
-                    except Exception as e:
-                        yield sse_event("error", {"step": "story", "error": str(e)})
-
-                # 3) keywords ready
-                if not sent["keywords"] and row.get("keywords_status") == "ready":
-                    try:
-                        keywords = (
-                            supabase.table("history_records")
-                            .select("keywords")
-                            .eq("record_id", record_id)
-                            .single()
-                            .execute()
-                            .data
-                        ) or {}
-                        yield sse_event("keywords_generated", keywords)
-                        sent["keywords"] = True
-                    except Exception as e:
-                        yield sse_event("error", {"step": "keywords", "error": str(e)})
-
-                # 4) recommendation ready (presence check)
-                rec_status = row.get("recommendation_status")
-                if rec_status == FAILED:
-                    yield sse_event("error", {
-                        "step": "recommendation",
-                        "error": row.get("recommendation_error") or "unknown"
-                    })
-                    return
-                
-                if (not sent["recommendation"]) and (rec_status == 'ready'):
-                    try:
-                        rec_row = (
-                            supabase.table("history_records")
-                            .select("reference_image_id, reference_image_pool(url)")
-                            .eq("record_id", record_id)
-                            .single()
-                            .execute()
-                            .data
-                        ) or {}
-                        payload = {
-                            "reference_image_id": rec_row.get("reference_image_id"),
-                            "reference_image_url": (rec_row.get("reference_image_pool") or {}).get("url")
-                        }
-                        yield sse_event("recommendation_generated", payload)
-                        sent["recommendation"] = True
-                    except Exception as e:
-                        yield sse_event("error", {"step": "recommendation", "error": str(e)})
-
-                # Done?
-                if all(sent.values()):
-                    yield sse_event("done", {"ok": True})
-                    return
-
-                await asyncio.sleep(POLL_INTERVAL_SEC)
+            # Subscribe before the snapshot, so no stage event can slip in between
+            async with event_hub.subscribe(record_id) as queue:
+                while True:
+                    # Timeout guard
+                    now = time.monotonic()
+                    if now - start > TIMEOUT_SEC:
+                        yield sse_event("generation_failed", {"reason": "timeout"})
+                        return
+
+                    # Heartbeat ping
+                    if now - last_heartbeat >= HEARTBEAT_INTERVAL_SEC:
+                        yield sse_event("ping", {"t": int(now)})
+                        last_heartbeat = now
+
+                    # Push mode once caught up; poll when the record runs elsewhere
+                    push = snapshot_taken and event_hub.is_live(record_id)
+                    if push:
+                        wait = min(HEARTBEAT_INTERVAL_SEC, max(0.0, TIMEOUT_SEC - (now - start)))
+                        try:
+                            msg = await asyncio.wait_for(queue.get(), timeout=wait)
+                        except asyncio.TimeoutError:
+                            continue
+                        events = [(msg["event"], msg["data"], msg.get("final", False))]
+                    else:
+                        events = await _poll_events(record_id, settled)
+                        snapshot_taken = True
+
+                    for event, data, final in events:
+                        key = STAGE_EVENTS.get(event)
+                        if key:
+                            if settled[key]:
+                                continue
+                            sent[key] = settled[key] = True
+                        failed = _failed_stages(event, data)
+                        if failed:
+                            if all(settled[stage] for stage in failed):
+                                continue
+                            for stage in failed:
+                                settled[stage] = True
+                        yield sse_event(event, data)
+                        if final:
+                            return
+
+                    # Done? (after a stage failure: close once the others settled too)
+                    if all(sent.values()):
+                        yield sse_event("done", {"ok": True})
+                        return
+                    if all(settled.values()):
+                        return
+
+                    if not push:
+                        await asyncio.sleep(POLL_INTERVAL_SEC)
 
         except asyncio.CancelledError:
             # Client disconnected; just exit quietly
@@ -201,4 +210,4 @@ async def stream_generation(record_id: str):
         event_generator(),
         media_type="text/event-stream",
         headers=headers
-    )
\ No newline at end of file
+    )
@@ -1,10 +1,16 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
-import uvicorn, os
+import uvicorn, os, time
 
 from core.config import settings
+from services.warmup import start_warmup, warmup_state
+from core.supabase_client import close_async_supabase
+from services.image_fetcher import close_http_client
+from services.concurrency import shutdown_executors
+from core.metrics import HTTP_REQUEST_SECONDS, render_latest
 
 # routers
 from routers.history import router as history_router
@@ -19,6 +25,47 @@ from routers.credits import router as credits_router
 
 app = FastAPI(title="LayerMinder API v1.0")
 
+@app.on_event("startup")
+async def warm_up_models():
+    if settings.WARMUP_ON_STARTUP:
+        start_warmup()
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await close_http_client()
+    await close_async_supabase()
+    shutdown_executors()
+
+# Per-route latency (route template, not the raw path, to keep labels bounded)
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            request.method,
+            getattr(route, "path", "unmatched"),
+            str(status_code),
+        ).observe(time.perf_counter() - start)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
+# Readiness probe: 503 while warm-up is pending/running.
+# disabled / failed still answer 200 because requests then load lazily.
+@app.get("/ready", include_in_schema=False)
+def ready():
+    state = warmup_state()
+    status_code = 503 if state["status"] in ("pending", "running") else 200
+    return JSONResponse(state, status_code=status_code)
+
 # Security scheme
 bearer_scheme = HTTPBearer(bearerFormat="JWT", scheme_name="bearerAuth")
 
@@ -53,6 +53,29 @@ class ImageRecordInfoOut(BaseModel):
     reference_iamge_url: Optional[str] = None
     images: List[ImageItem] = []
 
+class RecommendationItem(BaseModel):
+    rank: int
+    reference_image_id: UUID
+    url: Optional[str] = None
+    score: Optional[float] = None   # rank-fusion / similarity score, higher is better
+
+class RecordRecommendationsOut(BaseModel):
+    record_id: UUID
+    recommendation_status: Optional[str] = None
+    items: List[RecommendationItem] = []
+
+class SimilarImageItem(BaseModel):
+    image_id: UUID              # generated image_id or reference_image_id
+    url: Optional[str] = None
+    score: float                # cosine similarity
+
+class SimilarImagesOut(BaseModel):
+    image_id: UUID
+    kind: str                   # "generated" | "reference"
+    page: int
+    size: int
+    items: List[SimilarImageItem] = []
+
 # Room
 class RoomCreate(BaseModel):
     name: str
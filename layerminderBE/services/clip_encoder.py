@@ -0,0 +1,86 @@
+"""
+CLIP image encoders: pixel_values (N, 3, 224, 224) float32 -> (N, D) L2-normalized.
+
+Only the vision tower + projection is loaded (CLIPModel would also load the
+unused text tower). CLIP_BACKEND picks the runtime:
+- torch: CLIPVisionModelWithProjection, optionally int8 dynamic-quantized
+  Linear layers (CLIP_QUANTIZE)
+- onnx : ONNX Runtime session over CLIP_ONNX_PATH, exported by
+  `python -m batch.export_clip_onnx` (int8 variant with --quantize);
+  needs the optional 'onnxruntime' package
+
+Check a backend against the stored reference vectors with
+`python -m batch.clip_parity` before switching production to it;
+tests/test_clip_encoder.py holds the runtimes to fixed cosine tolerances.
+"""
+import numpy as np
+
+from core.config import settings
+
+CLIP_MODEL_ID = "openai/clip-vit-base-patch32"
+
+
+def _normalize(features: np.ndarray) -> np.ndarray:
+    features = np.asarray(features, dtype="float32")
+    return features / np.linalg.norm(features, axis=-1, keepdims=True)
+
+
+class TorchVisionEncoder:
+    def __init__(self, model_id: str = CLIP_MODEL_ID, quantize: bool = False, threads: int = 1):
+        import torch
+        from transformers import CLIPVisionModelWithProjection
+
+        torch.set_num_threads(max(1, threads))
+        model = CLIPVisionModelWithProjection.from_pretrained(model_id).eval()
+        if quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self._torch = torch
+
+    def encode(self, pixel_values: np.ndarray) -> np.ndarray:
+        with self._torch.no_grad():
+            out = self.model(pixel_values=self._torch.from_numpy(np.ascontiguousarray(pixel_values)))
+        return _normalize(out.image_embeds.numpy())
+
+
+class OnnxVisionEncoder:
+    def __init__(self, path: str, threads: int = 1):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("CLIP_BACKEND=onnx requires the 'onnxruntime' package") from e
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = max(1, threads)
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def encode(self, pixel_values: np.ndarray) -> np.ndarray:
+        (image_embeds,) = self.session.run(
+            ["image_embeds"], {"pixel_values": np.ascontiguousarray(pixel_values, dtype="float32")}
+        )
+        return _normalize(image_embeds)
+
+
+def onnx_path(quantize: bool | None = None) -> str:
+    quantize = settings.CLIP_QUANTIZE if quantize is None else quantize
+    base = settings.CLIP_ONNX_PATH
+    return base.replace(".onnx", ".int8.onnx") if quantize else base
+
+
+def backend_tag(backend: str | None = None, quantize: bool | None = None) -> str:
+    """Identifies the vectors a backend produces (embedding cache namespace)."""
+    backend = backend or settings.CLIP_BACKEND
+    quantize = settings.CLIP_QUANTIZE if quantize is None else quantize
+    return f"{CLIP_MODEL_ID.replace('/', '--')}--{backend}{'-int8' if quantize else ''}"
+
+
+def load_encoder(backend: str | None = None, quantize: bool | None = None):
+    backend = backend or settings.CLIP_BACKEND
+    quantize = settings.CLIP_QUANTIZE if quantize is None else quantize
+    threads = settings.CLIP_TORCH_THREADS
+    if backend == "onnx":
+        return OnnxVisionEncoder(onnx_path(quantize), threads=threads)
+    if backend == "torch":
+        return TorchVisionEncoder(quantize=quantize, threads=threads)
+    raise ValueError(f"unknown CLIP_BACKEND: {backend} (expected torch or onnx)")
@@ -0,0 +1,60 @@
+"""
+Concurrency limits for the generation pipeline.
+- Semaphores cap concurrent OpenAI image edits, chat completions and
+  CLIP jobs separately (sized from settings).
+- CLIP inference runs on its own sized executor instead of the default
+  asyncio thread pool, so it neither starves nor oversubscribes the CPU.
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from core.config import settings
+
+_semaphores: dict[str, asyncio.Semaphore] = {}
+_clip_executor: Optional[Executor] = None
+
+
+def _limit_sizes() -> dict[str, int]:
+    return {
+        "openai_image_edit": settings.OPENAI_IMAGE_EDIT_CONCURRENCY,
+        "openai_chat": settings.OPENAI_CHAT_CONCURRENCY,
+        "clip": settings.CLIP_CONCURRENCY,
+    }
+
+
+def limit(name: str) -> asyncio.Semaphore:
+    """async with limit("openai_image_edit"): ..."""
+    if name not in _semaphores:
+        _semaphores[name] = asyncio.Semaphore(max(1, _limit_sizes()[name]))
+    return _semaphores[name]
+
+
+def get_clip_executor() -> Executor:
+    global _clip_executor
+    if _clip_executor is None:
+        workers = max(1, settings.CLIP_WORKERS)
+        if settings.CLIP_EXECUTOR == "process":
+            # spawn: children must not inherit the event loop or torch thread pools
+            _clip_executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            _clip_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="clip")
+    return _clip_executor
+
+
+async def run_clip(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run a CLIP job (module-level fn, picklable args) on the CLIP executor."""
+    async with limit("clip"):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_clip_executor(), fn, *args)
+
+
+def shutdown_executors() -> None:
+    global _clip_executor
+    if _clip_executor is not None:
+        _clip_executor.shutdown(wait=False, cancel_futures=True)
+        _clip_executor = None
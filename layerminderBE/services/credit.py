@@ -1,18 +1,47 @@
 """
 Credit management service for LayerMinder beta users.
 Handles credit consumption, checking, and querying.
+
+/generate uses reserve -> commit / refund: reserve_credit checks and deducts
+in one RPC, the pipeline commits the reservation once images exist or
+refunds it when image generation failed.
+
+Balances are cached per user for CREDIT_BALANCE_CACHE_SEC (per process).
+Reserve / refund update the entry with the balance the RPC returned,
+consume_credit drops it.
 """
+import time
 from typing import Optional
 from fastapi import HTTPException, status
 
-from core.supabase_client import supabase
+from core.config import settings
+from repositories import credits as credits_repo
+
+# user_id -> (expires_at, credits)
+_balances: dict[str, tuple[float, int]] = {}
 
 
 class CreditService:
     """Service for managing user credits."""
 
     @staticmethod
-    def get_user_credits(user_id: str) -> int:
+    def _cached_balance(user_id: str) -> Optional[int]:
+        entry = _balances.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    @staticmethod
+    def _remember_balance(user_id: str, credits: int) -> None:
+        if settings.CREDIT_BALANCE_CACHE_SEC > 0:
+            _balances[user_id] = (time.monotonic() + settings.CREDIT_BALANCE_CACHE_SEC, credits)
+
+    @staticmethod
+    def invalidate_balance(user_id: str) -> None:
+        _balances.pop(user_id, None)
+
+    @staticmethod
+    async def get_user_credits(user_id: str) -> int:
         """
         Get the current credit balance for a user.
 
@@ -20,22 +49,24 @@ class CreditService:
             user_id: The UUID of the user
 
         Returns:
-            Current credit balance (0 if user not found)
+            Current credit balance (0 if user not found), cached briefly
         """
-        try:
-            result = supabase.rpc(
-                "get_user_credits",
-                {"p_user_id": user_id}
-            ).execute()
+        cached = CreditService._cached_balance(user_id)
+        if cached is not None:
+            return cached
 
-            return result.data if result.data is not None else 0
+        try:
+            credits = await credits_repo.get_user_credits(user_id)
+            credits = credits if credits is not None else 0
+            CreditService._remember_balance(user_id, credits)
+            return credits
 
         except Exception as e:
             print(f"[CreditService] Error getting credits for user {user_id}: {e}")
             return 0
 
     @staticmethod
-    def consume_credit(
+    async def consume_credit(
         user_id: str,
         amount: int = 1,
         reason: str = "Image generation"
@@ -55,17 +86,11 @@ class CreditService:
             HTTPException: If there's a database error
         """
         try:
-            result = supabase.rpc(
-                "consume_credit",
-                {
-                    "p_user_id": user_id,
-                    "p_amount": amount,
-                    "p_reason": reason
-                }
-            ).execute()
+            result = await credits_repo.consume_credit(user_id, amount, reason)
+            CreditService.invalidate_balance(user_id)
 
             # The function returns a boolean
-            success = result.data if result.data is not None else False
+            success = result if result is not None else False
 
             if not success:
                 print(f"[CreditService] Insufficient credits for user {user_id}. Requested: {amount}")
@@ -80,7 +105,72 @@ class CreditService:
             )
 
     @staticmethod
-    def check_sufficient_credits(user_id: str, required_amount: int = 1) -> bool:
+    async def reserve_credit(
+        user_id: str,
+        amount: int = 1,
+        reason: str = "Image generation"
+    ) -> dict:
+        """
+        Atomically check and deduct credits (one RPC).
+
+        Returns:
+            {"reserved": bool, "reservation_id": str | None, "credits": balance after the call}
+
+        Raises:
+            HTTPException: If there's a database error
+        """
+        try:
+            result = await credits_repo.reserve_credit(user_id, amount, reason) or {}
+        except Exception as e:
+            print(f"[CreditService] Error reserving credits for user {user_id}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to process credit consumption"
+            )
+
+        CreditService._remember_balance(user_id, int(result.get("credits") or 0))
+        if not result.get("reserved"):
+            print(f"[CreditService] Insufficient credits for user {user_id}. Requested: {amount}")
+        return result
+
+    @staticmethod
+    async def commit_reservation(reservation_id: str) -> None:
+        """Mark a reservation as spent (the credits were already deducted)."""
+        try:
+            await credits_repo.commit_credit(reservation_id)
+        except Exception as e:
+            # still deducted, only the ledger row stays 'reserved'
+            print(f"[CreditService] Error committing reservation {reservation_id}: {e}")
+
+    @staticmethod
+    async def refund_reservation(
+        reservation_id: str,
+        user_id: str,
+        reason: str = "Image generation failed"
+    ) -> None:
+        """
+        Give reserved credits back; a second refund of the same reservation is a no-op.
+
+        Raises:
+            Whatever the RPC raised: the user was charged for nothing, so the
+            caller must not carry on as if the refund happened
+        """
+        try:
+            credits = await credits_repo.refund_credit(reservation_id, reason)
+        except Exception as e:
+            print(f"[CreditService] ERROR refund of reservation {reservation_id} "
+                  f"(user {user_id}) failed, credit still deducted: {e}")
+            CreditService.invalidate_balance(user_id)
+            raise
+
+        if credits is not None and credits >= 0:
+            CreditService._remember_balance(user_id, credits)
+        else:
+            print(f"[CreditService] Reservation {reservation_id} was already settled, nothing refunded")
+            CreditService.invalidate_balance(user_id)
+
+    @staticmethod
+    async def check_sufficient_credits(user_id: str, required_amount: int = 1) -> bool:
         """
         Check if user has sufficient credits without consuming them.
 
@@ -91,7 +181,7 @@ class CreditService:
         Returns:
             True if user has enough credits, False otherwise
         """
-        current_credits = CreditService.get_user_credits(user_id)
+        current_credits = await CreditService.get_user_credits(user_id)
         return current_credits >= required_amount
 
 
@@ -0,0 +1,141 @@
+"""
+CLIP embedding cache keyed by the sha256 of the image bytes.
+Two levels: an in-memory LRU per process and a .npy file per vector on disk
+(shared by every process on the host, survives restarts). Vectors are stored
+as EMBEDDING_CACHE_DTYPE (float16 halves the disk/memory use; cosine scores
+move by ~1e-3) and always handed back as float32.
+
+The disk level is capped at EMBEDDING_CACHE_DISK_MB: a disk hit bumps the
+file's mtime, and every SWEEP_EVERY writes a background sweep deletes the
+least recently used files until the directory is back under the cap.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from core.config import settings
+
+SWEEP_EVERY = 500
+# a sweep goes down to this fraction of the cap, so it doesn't rerun right away
+SWEEP_TARGET = 0.9
+# temp files older than this are leftovers of a crashed writer
+STALE_TMP_SEC = 3600
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, namespace: str, directory: str | None = None,
+                 capacity: int | None = None, dtype: str | None = None, disk_mb: int | None = None):
+        directory = settings.EMBEDDING_CACHE_DIR if directory is None else directory
+        # namespace = model id, so switching encoders never serves stale vectors
+        self.directory = os.path.join(directory, namespace) if directory else ""
+        self.capacity = settings.EMBEDDING_CACHE_SIZE if capacity is None else capacity
+        self.dtype = np.dtype(dtype or settings.EMBEDDING_CACHE_DTYPE)
+        disk_mb = settings.EMBEDDING_CACHE_DISK_MB if disk_mb is None else disk_mb
+        self.disk_bytes = disk_mb * 1024 * 1024
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()  # CLIP executor threads share one cache
+        self._writes = 0
+        self._sweeping = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.npy")
+
+    def get(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            vec = self._memory.get(key)
+            if vec is not None:
+                self._memory.move_to_end(key)
+                return vec
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            vec = np.load(path).astype("float32")
+            os.utime(path)  # recently used: the sweep evicts by mtime
+        except (FileNotFoundError, ValueError, OSError):
+            return None  # missing, half-written or just evicted file: treat as a miss
+        self._remember(key, vec)
+        return vec
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        vec = np.asarray(vec, dtype="float32")
+        self._remember(key, vec)
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique per writer: threads / processes storing the same key don't share a temp file
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+            np.save(f, vec.astype(self.dtype))
+        os.replace(f.name, path)
+        self._maybe_sweep()
+
+    def _maybe_sweep(self) -> None:
+        if self.disk_bytes <= 0:
+            return
+        with self._lock:
+            self._writes += 1
+            if self._writes % SWEEP_EVERY:
+                return
+        if self._sweeping.acquire(blocking=False):
+            threading.Thread(target=self._sweep, daemon=True, name="embedding-cache-sweep").start()
+
+    def _sweep(self) -> None:
+        """Delete least recently used files until the directory is under SWEEP_TARGET of the cap."""
+        try:
+            now = time.time()
+            files, total = [], 0
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue  # removed by another process meanwhile
+                    if name.endswith(".tmp"):
+                        if now - stat.st_mtime > STALE_TMP_SEC:
+                            self._remove(path)
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            if total <= self.disk_bytes:
+                return
+            files.sort()
+            target = self.disk_bytes * SWEEP_TARGET
+            removed = 0
+            for _, size, path in files:
+                if total <= target:
+                    break
+                self._remove(path)
+                total -= size
+                removed += 1
+            print(f"[EmbeddingCache] evicted {removed} files from {self.directory}")
+        except Exception as e:
+            print(f"[EmbeddingCache] sweep of {self.directory} failed: {e}")
+        finally:
+            self._sweeping.release()
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _remember(self, key: str, vec: np.ndarray) -> None:
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._memory[key] = vec
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.capacity:
+                self._memory.popitem(last=False)
@@ -0,0 +1,120 @@
+"""
+Pipeline stage events (pub/sub).
+full_pipeline publishes one message per finished stage and
+/stream/{record_id} subscribes to them instead of polling the database.
+
+Brokers:
+- LocalBroker: in-process only (default, also the stand-in for tests)
+- RedisBroker: Redis pub/sub, shared by every worker/process
+"""
+import asyncio
+import json
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Any
+
+from core.config import settings
+
+CHANNEL_PREFIX = "layerminder:record:"
+
+
+class LocalBroker:
+    """In-process broker: one asyncio.Queue per subscriber."""
+    shared = False
+
+    def __init__(self):
+        self._queues: dict[str, set[asyncio.Queue]] = defaultdict(set)
+
+    async def publish(self, channel: str, message: dict) -> None:
+        for queue in list(self._queues.get(channel, ())):
+            queue.put_nowait(message)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str) -> AsyncIterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._queues[channel].add(queue)
+        try:
+            yield queue
+        finally:
+            self._queues[channel].discard(queue)
+            if not self._queues[channel]:
+                del self._queues[channel]
+
+
+class RedisBroker:
+    """Redis pub/sub broker, so a stream can follow a record processed on another worker."""
+    shared = True
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("EVENT_BROKER=redis requires the 'redis' package") from e
+        self._redis = redis.from_url(url)
+
+    async def publish(self, channel: str, message: dict) -> None:
+        await self._redis.publish(channel, json.dumps(message, ensure_ascii=False))
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str) -> AsyncIterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue()
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(channel)
+
+        async def reader():
+            async for m in pubsub.listen():
+                if m.get("type") == "message":
+                    queue.put_nowait(json.loads(m["data"]))
+
+        task = asyncio.create_task(reader())
+        try:
+            yield queue
+        finally:
+            task.cancel()
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
+
+
+class EventHub:
+    """
+    Record-scoped pub/sub on top of a broker.
+    Tracks which records are processed by this process, so subscribers
+    know whether pushes will reach them or they have to poll.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self._local_records: set[str] = set()
+
+    def track(self, record_id: str) -> None:
+        self._local_records.add(record_id)
+
+    def untrack(self, record_id: str) -> None:
+        self._local_records.discard(record_id)
+
+    def is_live(self, record_id: str) -> bool:
+        """True when stage events for this record will be pushed to subscribers here."""
+        return self.broker.shared or record_id in self._local_records
+
+    async def publish(self, record_id: str, event: str, data: Any, final: bool = False) -> None:
+        """Best effort: a broker failure must never break the pipeline."""
+        try:
+            await self.broker.publish(
+                CHANNEL_PREFIX + record_id,
+                {"event": event, "data": data, "final": final}
+            )
+        except Exception as e:
+            print(f"[EventHub] publish failed for {record_id}: {e}")
+
+    def subscribe(self, record_id: str):
+        """async with event_hub.subscribe(record_id) as queue: ..."""
+        return self.broker.subscribe(CHANNEL_PREFIX + record_id)
+
+
+def _create_broker():
+    if settings.EVENT_BROKER == "redis":
+        return RedisBroker(settings.REDIS_URL)
+    return LocalBroker()
+
+
+event_hub = EventHub(_create_broker())
@@ -0,0 +1,57 @@
+"""
+Shared async image fetcher.
+One pooled httpx client per process, so every stage of the pipeline
+downloads its images concurrently over reused connections.
+"""
+import asyncio
+from urllib.parse import urlsplit
+
+import httpx
+
+from core.config import settings
+
+_client: httpx.AsyncClient | None = None
+_host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Create the pooled client on first use and reuse it afterwards."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.IMAGE_FETCH_TIMEOUT_SEC),
+            limits=httpx.Limits(
+                max_connections=settings.IMAGE_FETCH_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.IMAGE_FETCH_MAX_CONNECTIONS,
+            ),
+            follow_redirects=True,
+        )
+    return _client
+
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    if host not in _host_semaphores:
+        _host_semaphores[host] = asyncio.Semaphore(settings.IMAGE_FETCH_MAX_CONNECTIONS_PER_HOST)
+    return _host_semaphores[host]
+
+
+async def fetch_image(url: str) -> bytes:
+    """Download a single image and return its raw bytes."""
+    async with _host_semaphore(url):
+        r = await get_http_client().get(url)
+        r.raise_for_status()
+    return r.content
+
+
+async def fetch_images(urls: list[str]) -> list[bytes]:
+    """Download all urls at the same time, keeping the input order."""
+    return list(await asyncio.gather(*[fetch_image(url) for url in urls]))
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _host_semaphores.clear()
@@ -2,11 +2,15 @@ import os, uuid, base64, asyncio
 from io import BytesIO
 from datetime import datetime, timezone
 from typing import List
-import httpx
 from openai import AsyncOpenAI
 
-from core.supabase_client import supabase
+from repositories import history as history_repo
+from repositories import images as images_repo
+from repositories import storage as storage_repo
 from core.config import settings
+from services.image_fetcher import fetch_image
+from services.concurrency import limit
+from core.metrics import observe
 
 # 1. load env variables
 STORAGE_BUCKET = settings.SUPABASE_STORAGE_BUCKET
@@ -20,7 +24,6 @@ client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 # 3. helper: Supabase storage making it to fileobject
 async def _fetch_fileobject(file_key:str) -> BytesIO:
     clean_key = file_key.lstrip("/").split("?", 1)[0]
-    base = settings.SUPABASE_URL.rstrip("/")  # e.g. https://uscw…supabase.co
 
     # Determine bucket based on file_key prefix
     # Reference images start with "reference/"
@@ -29,12 +32,9 @@ async def _fetch_fileobject(file_key:str) -> BytesIO:
     else:
         bucket = STORAGE_BUCKET
 
-    url = f"{base}/storage/v1/object/public/{bucket}/{clean_key}"
+    url = storage_repo.public_url(bucket, clean_key)
 
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url)
-        r.raise_for_status()
-    bio = BytesIO(r.content)
+    bio = BytesIO(await fetch_image(url))
     bio.name = os.path.basename(clean_key)
     return bio
 
@@ -44,78 +44,85 @@ async def generate_and_store_images(
         input_image_keys: List[str], 
         user_id: str,
         keyword: str = "modern" # default
-        ) -> None:
+        ) -> List[dict]:
+    """
+    Returns the generated images in seq order as
+    {"image_id", "seq", "url", "key", "content"} dicts, where content holds the
+    decoded JPEG bytes so later stages don't download them again.
+    """
     # error message
     if not input_image_keys:
         raise ValueError("You need minimum 1 image to proceed Layerminder.")
     
     # 1) Change the status
-    supabase.table("history_records")\
-        .update({
-            "image_status": "processing",
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        })\
-        .eq("record_id", record_id)\
-        .execute()
+    await history_repo.update_record(record_id, {"image_status": "processing"})
     
     # 2) Fetch files
-    file_objs = await asyncio.gather(
-        *[_fetch_fileobject(key) for key in input_image_keys]
-    )
-
-    # 3) Image Generation
-    result = await client.images.edit(
-        model=OPENAI_MODEL,
-        image=file_objs,
-        prompt= f'''
+    with observe("image.fetch_inputs"):
+        file_objs = await asyncio.gather(
+            *[_fetch_fileobject(key) for key in input_image_keys]
+        )
+
+    # 3) Image Generation (capped per process: OPENAI_IMAGE_EDIT_CONCURRENCY)
+    async with limit("openai_image_edit"):
+        with observe("image.openai_edit"):
+            result = await client.images.edit(
+                model=OPENAI_MODEL,
+                image=file_objs,
+                prompt= f'''
         Combine these two image into one thing that one can sit on.
         Details should be minimalistic and {keyword}(0.8), with a clean aesthetic.
         Take the key design concepts from the given image.
         ''' if keyword else None,
-        quality="low",
-        size="1024x1024",
-        output_format="jpeg",
-        output_compression=50,
-        n=4
-    )
+                quality="low",
+                size="1024x1024",
+                output_format="jpeg",
+                output_compression=50,
+                n=4
+            )
+
+    # 4) Decode results and upload them to storage concurrently
+    generated = []
     for idx, item in enumerate(result.data, start=1):
-        img_bytes = base64.b64decode(item.b64_json)
-        file_name = f"{uuid.uuid4().hex}.jpeg"
-
-        # a) Upload to Supabase storage
-        generated_key = f"generated/{user_id}/{file_name}"
-        resp = supabase.storage.from_(STORAGE_BUCKET).upload(
-            generated_key,
-            img_bytes,
-            {"contentType": "image/jpeg"}
-        )
-        public_url = supabase.storage.from_(STORAGE_BUCKET)\
-            .get_public_url(generated_key)
-    
-        # b) INSERT into images table 
-        new_image_id = str(uuid.uuid4())
-        supabase.table("images").insert({
-            "image_id": new_image_id,
-            "user_id": user_id,
-            "url": public_url,
-            "type": "generated",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }).execute()
-
-        # c) Mapping on history_record_images 
-        supabase.table("history_record_images").insert({
-            "record_id": record_id,
-            "image_id": new_image_id,
-            "seq": idx
-        }).execute()
+        generated_key = f"generated/{user_id}/{uuid.uuid4().hex}.jpeg"
+        generated.append({
+            "image_id": str(uuid.uuid4()),
+            "seq": idx,
+            "url": storage_repo.public_url(STORAGE_BUCKET, generated_key),
+            "key": generated_key,
+            "content": base64.b64decode(item.b64_json),
+        })
+
+    with observe("image.upload"):
+        await asyncio.gather(*[
+            storage_repo.upload(STORAGE_BUCKET, g["key"], g["content"], "image/jpeg")
+            for g in generated
+        ])
+
+    # 5) Bulk INSERT into images table
+    created_at = datetime.now(timezone.utc).isoformat()
+    with observe("image.db_write"):
+        await images_repo.create_images([
+            {
+                "image_id": g["image_id"],
+                "user_id": user_id,
+                "url": g["url"],
+                "type": "generated",
+                "created_at": created_at
+            }
+            for g in generated
+        ])
+
+        # 6) Bulk mapping on history_record_images
+        await history_repo.add_record_images([
+            {"record_id": record_id, "image_id": g["image_id"], "seq": g["seq"]}
+            for g in generated
+        ])
 
     # 7) status -> ready 
-    supabase.table("history_records").update({
-            "image_status": "ready",
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        })\
-        .eq("record_id", record_id)\
-        .execute()
+    await history_repo.update_record(record_id, {"image_status": "ready"})
+
+    return generated
     
 if __name__ == "__main__":
     tests = [
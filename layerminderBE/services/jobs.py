@@ -0,0 +1,192 @@
+"""
+Persistent job queue for full_pipeline.
+
+PIPELINE_QUEUE=sqlite: /generate only enqueues, worker.py claims and runs jobs.
+A claimed job holds a lease (renewed by the worker's heartbeat while the
+pipeline runs); if the worker dies the lease expires and the job is claimed
+again, resuming from the record's *_status columns. Every claim gets a new
+token, so a worker that lost its lease can no longer complete / fail the job.
+A failed job waits before its next attempt (available_at), doubling from
+JOB_RETRY_BACKOFF_SEC per attempt, so a transient OpenAI error does not turn
+into back-to-back paid retries.
+A job out of attempts is handed out once more with exhausted=True, for the
+worker to clean up the record before it is marked failed.
+PIPELINE_QUEUE=background (default): no queue, BackgroundTasks as before.
+"""
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Optional
+
+from core.config import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pipeline_jobs (
+    job_id TEXT PRIMARY KEY,
+    record_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    lease_until REAL,
+    lease_token TEXT,
+    available_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pipeline_jobs_status
+    ON pipeline_jobs (status, created_at);
+"""
+
+
+class SQLiteJobQueue:
+    """
+    File-based queue, safe to share between the API and worker processes.
+    Methods are blocking; call them through asyncio.to_thread.
+    """
+
+    def __init__(self, path: str, lease_sec: float, max_attempts: int,
+                 retry_backoff_sec: float = 0.0, retry_backoff_max_sec: float = 0.0):
+        self.path = path
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self.retry_backoff_sec = retry_backoff_sec
+        self.retry_backoff_max_sec = retry_backoff_max_sec
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(pipeline_jobs)")}
+            if "lease_token" not in columns:  # queue files created before claim tokens
+                conn.execute("ALTER TABLE pipeline_jobs ADD COLUMN lease_token TEXT")
+            if "available_at" not in columns:  # queue files created before retry backoff
+                conn.execute("ALTER TABLE pipeline_jobs ADD COLUMN available_at REAL")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, record_id: str, payload: dict) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO pipeline_jobs (job_id, record_id, payload, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, record_id, json.dumps(payload), now, now)
+            )
+        return job_id
+
+    def claim(self) -> Optional[dict]:
+        """
+        Atomically take the oldest queued job that is due (or one whose lease expired).
+        Returns {"job_id", "record_id", "payload", "attempts", "token", "exhausted"} or None.
+        An exhausted job is not run again: the caller cleans up and calls fail().
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT job_id, record_id, payload, attempts FROM pipeline_jobs "
+                    "WHERE (status = 'queued' AND COALESCE(available_at, 0) <= ?) "
+                    "OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                exhausted = row["attempts"] >= self.max_attempts
+                conn.execute(
+                    "UPDATE pipeline_jobs SET status = 'running', attempts = attempts + ?, "
+                    "lease_until = ?, lease_token = ?, updated_at = ? WHERE job_id = ?",
+                    (0 if exhausted else 1, now + self.lease_sec, token, now, row["job_id"])
+                )
+                conn.execute("COMMIT")
+                return {
+                    "job_id": row["job_id"],
+                    "record_id": row["record_id"],
+                    "payload": json.loads(row["payload"]),
+                    "attempts": row["attempts"] if exhausted else row["attempts"] + 1,
+                    "token": token,
+                    "exhausted": exhausted,
+                }
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def heartbeat(self, job_id: str, token: str) -> bool:
+        """Extend the lease; False if the job was claimed by someone else meanwhile."""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE pipeline_jobs SET lease_until = ?, updated_at = ? "
+                "WHERE job_id = ? AND lease_token = ? AND status = 'running'",
+                (now + self.lease_sec, now, job_id, token)
+            )
+            return cur.rowcount > 0
+
+    def complete(self, job_id: str, token: str) -> bool:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE pipeline_jobs SET status = 'done', lease_until = NULL, lease_token = NULL, "
+                "updated_at = ? WHERE job_id = ? AND lease_token = ?",
+                (time.time(), job_id, token)
+            )
+            return cur.rowcount > 0
+
+    def retry_delay(self, attempts: int) -> float:
+        """Seconds before the next attempt: backoff * 2^(attempts - 1), capped."""
+        delay = self.retry_backoff_sec * 2 ** max(0, attempts - 1)
+        return min(delay, self.retry_backoff_max_sec) if self.retry_backoff_max_sec > 0 else delay
+
+    def fail(self, job_id: str, token: str, error: str) -> bool:
+        """Back to the queue (due after retry_delay) while attempts remain, otherwise failed."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT attempts FROM pipeline_jobs WHERE job_id = ? AND lease_token = ?",
+                    (job_id, token)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return False
+                conn.execute(
+                    "UPDATE pipeline_jobs SET "
+                    "status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, "
+                    "error = ?, available_at = ?, lease_until = NULL, lease_token = NULL, updated_at = ? "
+                    "WHERE job_id = ?",
+                    (self.max_attempts, error, now + self.retry_delay(row["attempts"]), now, job_id)
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+
+_job_queue: Optional[SQLiteJobQueue] = None
+
+
+def get_job_queue() -> Optional[SQLiteJobQueue]:
+    """The configured queue, or None when the pipeline runs as a BackgroundTask."""
+    global _job_queue
+    if settings.PIPELINE_QUEUE != "sqlite":
+        return None
+    if _job_queue is None:
+        _job_queue = SQLiteJobQueue(
+            settings.PIPELINE_QUEUE_PATH,
+            lease_sec=settings.JOB_LEASE_SEC,
+            max_attempts=settings.JOB_MAX_ATTEMPTS,
+            retry_backoff_sec=settings.JOB_RETRY_BACKOFF_SEC,
+            retry_backoff_max_sec=settings.JOB_RETRY_BACKOFF_MAX_SEC,
+        )
+    return _job_queue
@@ -1,133 +1,335 @@
 import asyncio
-from datetime import datetime, timezone
 from typing import Optional
 
-from core.supabase_client import supabase
+from repositories import history as history_repo
 from services.image_generation import generate_and_store_images
 from services.story_keyword_generation import generate_and_store_story_keywords
-from services.recommendation import recommend_image
+from services.image_fetcher import fetch_images
+from services.events import event_hub
+from services.concurrency import run_clip
+from services.credit import credit_service
+from core.config import settings
+from core.metrics import observe, observe_seconds
 
-def now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+# stage -> stages it waits for; story and recommendation both only need the images
+STAGE_DEPENDENCIES = {
+    "image": (),
+    "story": ("image",),
+    "recommendation": ("image",),
+}
+
+# stage -> status column that marks it finished
+STAGE_STATUS_COLUMNS = {
+    "image": "image_status",
+    "story": "story_status",
+    "recommendation": "recommendation_status",
+}
+
+async def _load_record_images(record_id: str) -> tuple[list[str], list[bytes]]:
+    """Fallback for stages running apart from generation: (image ids, bytes) from storage."""
+    rec_imgs = await history_repo.list_record_images(record_id)
+    return [r["image_id"] for r in rec_imgs], await fetch_images([r["url"] for r in rec_imgs])
 
 async def full_pipeline(
         record_id: str,
         input_image_keys: list[str],
         keyword: Optional[str],
-        user_id: str
+        user_id: str,
+        completed: frozenset[str] = frozenset(),
+        reservation_id: Optional[str] = None,
+        retry_on_error: bool = False
 ) -> None:
     """
     Orchestrates the whole generation pipeline:
     1) Image generation
-    2) Story & keywords
-    3) Recommendation (writes status + error for observability)
+    2) Story & keywords     } concurrently, once the images exist
+    3) Recommendation       } (writes status + error for observability)
+    Every stage outcome is also published on the event hub for /stream.
+    Stages listed in `completed` are skipped (see resume_pipeline).
+    The credit reserved by /generate is settled on the final outcome only:
+    committed once the images exist, refunded otherwise. When a stage raised
+    and the caller retries the job (retry_on_error), a reservation without
+    images is left to the retry (or to fail_pipeline). A cancelled run
+    (shutdown, lease taken over) leaves it to whoever runs the job next.
     """
-    # 1) Image generation
+    event_hub.track(record_id)
+    outcome = {"images_ready": "image" in completed}
+    try:
+        with observe("pipeline.total"):
+            await _run_pipeline(record_id, input_image_keys, keyword, user_id, completed, outcome)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        if outcome["images_ready"] or not retry_on_error:
+            await _settle_reservation(reservation_id, user_id, outcome["images_ready"])
+        raise
+    else:
+        await _settle_reservation(reservation_id, user_id, outcome["images_ready"])
+    finally:
+        event_hub.untrack(record_id)
+
+async def _settle_reservation(reservation_id: Optional[str], user_id: str, images_ready: bool) -> None:
+    """The credit reserved by /generate is spent once images exist, refunded otherwise."""
+    if not reservation_id:
+        return
+    if images_ready:
+        await credit_service.commit_reservation(reservation_id)
+    else:
+        await credit_service.refund_reservation(reservation_id, user_id)
+
+async def resume_pipeline(
+        record_id: str,
+        input_image_keys: list[str],
+        keyword: Optional[str],
+        user_id: str,
+        reservation_id: Optional[str] = None,
+        retry_on_error: bool = False
+) -> None:
+    """
+    Restart-safe entry point for the worker:
+    stages whose *_status column is already "ready" are not run again.
+    """
+    row = await history_repo.get_record(record_id, ",".join(STAGE_STATUS_COLUMNS.values())) or {}
+    completed = frozenset(
+        stage for stage, column in STAGE_STATUS_COLUMNS.items()
+        if row.get(column) == "ready"
+    )
+    if "image" not in completed:
+        # drop rows left by an interrupted run before generating again
+        await history_repo.delete_record_images(record_id)
+    await full_pipeline(record_id, input_image_keys, keyword, user_id, completed,
+                        reservation_id, retry_on_error)
+
+async def fail_pipeline(
+        record_id: str,
+        user_id: str,
+        reservation_id: Optional[str],
+        error: str
+) -> None:
+    """
+    Terminal failure (the worker gave up on the job): stages that never got to
+    "ready" are marked failed, /stream subscribers are told, and the credit is
+    refunded unless the images exist. Safe to run more than once.
+    """
+    row = await history_repo.get_record(record_id, ",".join(STAGE_STATUS_COLUMNS.values())) or {}
+    updates = {}
+    if row.get("image_status") != "ready":
+        updates["image_status"] = "error"
+    if row.get("story_status") != "ready":
+        updates.update({"story_status": "error", "keywords_status": "error"})
+    if row.get("recommendation_status") != "ready":
+        updates.update({"recommendation_status": "failed", "recommendation_error": error})
+    if updates:
+        await history_repo.update_record(record_id, updates)
+    await event_hub.publish(record_id, "generation_failed", {"reason": error}, final=True)
+    await _settle_reservation(reservation_id, user_id, row.get("image_status") == "ready")
+
+async def _run_pipeline(
+        record_id: str,
+        input_image_keys: list[str],
+        keyword: Optional[str],
+        user_id: str,
+        completed: frozenset[str],
+        outcome: dict
+) -> None:
+    """
+    Runs the stages as a small dependency graph: each stage starts once its
+    dependencies succeeded, so story and recommendation run concurrently.
+    Every stage still writes its own status/error columns.
+    outcome["images_ready"] is set as soon as the images exist, so the
+    caller knows even when a later stage raises. A stage that raises cancels
+    the others before the error reaches the caller.
+    """
+    # decoded images (and their ids) shared by the stages after generation ([] -> storage fallback)
+    image_ids: list[str] = []
+    image_bytes: list[bytes] = []
+
+    async def run_image() -> bool:
+        nonlocal image_ids, image_bytes
+        generated = await _image_stage(record_id, input_image_keys, keyword, user_id)
+        if generated is None:
+            return False
+        image_ids = [g["image_id"] for g in generated]
+        image_bytes = [g["content"] for g in generated]
+        outcome["images_ready"] = True
+        return True
+
+    runners = {
+        "image": run_image,
+        "story": lambda: _story_stage(record_id, image_bytes),
+        "recommendation": lambda: _recommendation_stage(record_id, user_id, image_ids, image_bytes),
+    }
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def run(stage: str) -> bool:
+        for dep in STAGE_DEPENDENCIES[stage]:
+            if not await tasks[dep]:
+                return False
+        if stage in completed:
+            return True
+        with observe(stage):
+            return await runners[stage]()
+
+    for stage in STAGE_DEPENDENCIES:
+        tasks[stage] = asyncio.create_task(run(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        # a stage raised (or this run was cancelled): the others must not keep
+        # writing to the record once the job is settled or retried
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+async def _image_stage(
+        record_id: str,
+        input_image_keys: list[str],
+        keyword: Optional[str],
+        user_id: str
+) -> Optional[list[dict]]:
+    """1) Image generation. Returns the generated images (with decoded bytes), None on failure."""
     try:
         # status -> processing
-        supabase.table("history_records")\
-            .update({"image_status": "processing", 
-                     "updated_at":now_iso()})\
-            .eq("record_id", record_id).execute()
+        await history_repo.update_record(record_id, {"image_status": "processing"})
         
-        await generate_and_store_images(record_id, input_image_keys, keyword, user_id)
+        generated = await generate_and_store_images(
+            record_id, input_image_keys, user_id=user_id, keyword=keyword
+        )
 
         # after complete
-        supabase.table("history_records")\
-            .update({"image_status":"ready", 
-                     "updated_at":now_iso()})\
-            .eq("record_id", record_id).execute()
+        await history_repo.update_record(record_id, {"image_status": "ready"})
+        await event_hub.publish(record_id, "images_generated", [
+            {"image_id": g["image_id"], "seq": g["seq"], "url": g["url"]}
+            for g in generated
+        ])
+        # decoded bytes are carried forward, so later stages skip storage downloads
+        return generated
         
     except Exception as e:
-        supabase.table("history_records")\
-            .update({"image_status":"error", 
-                     "updated_at":now_iso()})\
-            .eq("record_id", record_id).execute()
+        try:
+            await history_repo.update_record(record_id, {"image_status": "error"})
+        except Exception as update_error:
+            # the stage failure is what counts; this one is only logged
+            print(f"[Pipeline] Marking image_status error failed: {update_error}")
+        await event_hub.publish(record_id, "generation_failed",
+                                {"reason": "stage_failed", "stage": "image"}, final=True)
         # Logging when needed
         print(f"[Pipeline] Image generation session {e}")
-        return
+        return None
     
-    # 2) Story & keywords Generation
+async def _story_stage(record_id: str, image_bytes: list[bytes]) -> bool:
+    """2) Story & keywords Generation"""
     try:
-        supabase.table("history_records")\
-            .update({"story_status": "processing",
-                     "keywords_status": "processing",
-                     "updated_at": now_iso()})\
-            .eq("record_id", record_id).execute()
+        await history_repo.update_record(record_id, {
+            "story_status": "processing",
+            "keywords_status": "processing"
+        })
         
-        await generate_and_store_story_keywords(record_id)
+        result = await generate_and_store_story_keywords(record_id, image_bytes[0] if image_bytes else None)
 
         # when it is created"
-        supabase.table("history_records")\
-            .update({"story_status":"ready", 
-                     "keywords_status": "ready",
-                     "updated_at":now_iso()})\
-            .eq("record_id", record_id).execute()
+        await history_repo.update_record(record_id, {
+            "story_status": "ready",
+            "keywords_status": "ready"
+        })
+        await event_hub.publish(record_id, "story_generated", {"story": result["story"]})
+        await event_hub.publish(record_id, "keywords_generated", {"keywords": result["keywords"]})
+        return True
 
     except Exception as e:
-        supabase.table("history_records")\
-            .update({"story_status":"error",
-                     "keywords_status": "error", 
-                     "updated_at":now_iso()})\
-            .eq("record_id", record_id).execute()
+        await history_repo.update_record(record_id, {
+            "story_status": "error",
+            "keywords_status": "error"
+        })
+        await event_hub.publish(record_id, "generation_failed",
+                                {"reason": "stage_failed", "stage": "story"})
         print(f"[Pipeline] Story generation failed: {e}")
-        return
+        return False
     
-    # 3) Recommendation
+async def _store_vectors(user_id: str, image_ids: list[str], embeddings) -> None:
+    """Keep the vectors recommend_image computed for "similar images"; never fails the stage."""
+    if embeddings is None or len(embeddings) != len(image_ids):
+        return
+    try:
+        from services.vector_store import get_vector_store
+        with observe("recommendation.store_vectors"):
+            await get_vector_store().add(user_id, image_ids, embeddings)
+    except Exception as e:
+        print(f"[Pipeline] Storing image vectors failed: {e}")
+
+async def _recommendation_stage(
+        record_id: str,
+        user_id: str,
+        image_ids: list[str],
+        image_bytes: list[bytes]
+) -> bool:
+    """3) Recommendation"""
     try:
         # a) status for recommendation
-        supabase.table("history_records").update({
-            "recommendation_status": "processing",
-            "updated_at": now_iso()
-        }).eq("record_id", record_id).execute()
-
-        # b) Load image urls
-        rec_imgs = supabase.table("history_record_images")\
-            .select("image_id, images(url)")\
-            .eq("record_id", record_id)\
-            .order("seq", desc=False)\
-            .execute().data or []
+        await history_repo.update_record(record_id, {"recommendation_status": "processing"})
+
+        # b) Images from generation step (storage only as a fallback)
+        if not image_bytes:
+            with observe("recommendation.download"):
+                image_ids, image_bytes = await _load_record_images(record_id)
         
         # Guard: no images to recommend from
-        if not rec_imgs:
-            supabase.table("history_records").update({
+        if not image_bytes:
+            await history_repo.update_record(record_id, {
                 "recommendation_status": "failed",
-                "recommendation_error":"no_images_available",
-                "updated_at": now_iso()
-            }).eq("record_id", record_id).execute()
+                "recommendation_error": "no_images_available"
+            })
+            await event_hub.publish(record_id, "error",
+                                    {"step": "recommendation", "error": "no_images_available"})
             print("[Pipeline] Recommendation skipped: no_images_available")
-            return
-        
-        image_urls = [r["images"]["url"] for r in rec_imgs]
+            return False
 
-        # c) Recommend
-        rec = await asyncio.to_thread(recommend_image, image_urls, 1)
+        # c) Recommend (numpy/faiss/torch are only imported once a pipeline gets here)
+        from services.recommendation import recommend_image
+        rec = await run_clip(recommend_image, image_bytes, settings.RECOMMENDATION_TOP_N)
+        for step, seconds in ((rec or {}).get("timings") or {}).items():
+            observe_seconds(f"recommendation.{step}", seconds)
+        await _store_vectors(user_id, image_ids, (rec or {}).get("embeddings"))
         ref = (rec or {}).get("reference")
         ref_id = (ref or {}).get("id")
 
         # Guard: no candidate found
         if not ref_id:
-            supabase.table("history_records").update({
+            await history_repo.update_record(record_id, {
                 "recommendation_status": "failed",
-                "recommendation_error": "no_candidate_found",
-                "updated_at": now_iso()
-            }).eq("record_id", record_id).execute()
+                "recommendation_error": "no_candidate_found"
+            })
+            await event_hub.publish(record_id, "error",
+                                    {"step": "recommendation", "error": "no_candidate_found"})
             print("[Pipeline] Recommendation failed: no_candidate_found")
-            return
-
-        # d) Success: Update history_records
-        supabase.table("history_records")\
-            .update({"reference_image_id": ref_id,
-                     "recommendation_status": "ready", 
-                     "recommendation_error": None,
-                     "updated_at": now_iso()})\
-            .eq("record_id", record_id).execute()
+            return False
+
+        # d) Success: Update history_records (best match + the full top-N list)
+        recommendations = [
+            {"rank": rank, "reference_image_id": r["id"], "url": r["url"], "score": r["score"]}
+            for rank, r in enumerate(rec.get("references") or [ref], start=1)
+        ]
+        await history_repo.update_record(record_id, {
+            "reference_image_id": ref_id,
+            "recommendations": recommendations,
+            "recommendation_status": "ready", 
+            "recommendation_error": None
+        })
+        await event_hub.publish(record_id, "recommendation_generated", {
+            "reference_image_id": ref_id,
+            "reference_image_url": ref.get("url"),
+            "recommendations": recommendations
+        })
+        return True
         
     except Exception as e:
         # f) Unexpected failure
-        supabase.table("history_records").update({
+        error = f"{type(e).__name__}: {e}"
+        await history_repo.update_record(record_id, {
             "recommendation_status": "failed",
-            "recommendation_error": f"{type(e).__name__}: {e}",
-            "updated_at": now_iso()
-        }).eq("record_id", record_id).execute()
-        print(f"[Pipeline] Recommendation failed: {e}")
\ No newline at end of file
+            "recommendation_error": error
+        })
+        await event_hub.publish(record_id, "error",
+                                {"step": "recommendation", "error": error})
+        print(f"[Pipeline] Recommendation failed: {e}")
+        return False
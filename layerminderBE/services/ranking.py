@@ -0,0 +1,52 @@
+"""
+Re-ranking helpers for reference recommendations (pure NumPy).
+
+- reciprocal rank fusion: merges one result list per generated image, so a
+  reference that ranks well for several images beats one that is the best
+  match for a single image only
+- MMR (maximal marginal relevance): picks the final top-N trading relevance
+  against similarity to what was already picked, so the user doesn't get
+  five near-duplicates of one chair
+"""
+import numpy as np
+
+
+def rrf_merge(labels: np.ndarray, k: int = 60) -> list[tuple[int, float]]:
+    """
+    labels: (Q, K) FAISS result labels, one row per query, best first (-1 = empty).
+    Returns [(label, fused score)] best first; score = sum over queries of 1 / (k + rank).
+    """
+    scores: dict[int, float] = {}
+    for row in labels:
+        for rank, label in enumerate(row, start=1):
+            if label < 0:
+                continue
+            scores[int(label)] = scores.get(int(label), 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, n: int, lambda_: float = 0.7) -> list[int]:
+    """
+    Greedy MMR over candidates (best first).
+    relevance: (C,) scores, vectors: (C, D) L2-normalized candidate vectors.
+    lambda_=1 is plain relevance order, lower values favor diversity.
+    Returns the chosen candidate positions in pick order.
+    """
+    count = len(relevance)
+    if count == 0:
+        return []
+    # relevance to [0, 1] so it is on the same scale as cosine similarity
+    rel = np.asarray(relevance, dtype="float32")
+    spread = rel.max() - rel.min()
+    rel = (rel - rel.min()) / spread if spread > 0 else np.ones_like(rel)
+    sims = np.asarray(vectors, dtype="float32") @ np.asarray(vectors, dtype="float32").T
+
+    chosen = [int(np.argmax(rel))]
+    max_sim = sims[chosen[0]].copy()
+    while len(chosen) < min(n, count):
+        score = lambda_ * rel - (1.0 - lambda_) * max_sim
+        score[chosen] = -np.inf
+        pick = int(np.argmax(score))
+        chosen.append(pick)
+        max_sim = np.maximum(max_sim, sims[pick])
+    return chosen
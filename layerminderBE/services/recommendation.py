@@ -1,15 +1,15 @@
 import numpy as np
 import faiss
-import requests
 from io import BytesIO
-import csv
 import os
+import time
 import logging
 
-from core.supabase_client import supabase
-
-FAISS_INDEX = "batch/embeddings/image_embeddings.index"
-METADATA = "batch/embeddings/image_embeddings_metadata.csv"
+from core.config import settings
+from services.reference_index import IndexRegistry, search_parameters
+from services.embedding_cache import EmbeddingCache, content_hash
+from services.clip_encoder import CLIP_MODEL_ID, backend_tag, load_encoder
+from services.ranking import rrf_merge, mmr_select
 
 # Moved to dockerfile
 # os.environ["OMP_NUM_THREADS"] = "1"
@@ -21,66 +21,189 @@ _faiss_loaded = False
 _clip_loaded = False
 
 # Global cache variables
-_faiss_index = None
-_metadata = None
-_clip_model = None
+_index_registry = IndexRegistry()
+_embedding_cache = EmbeddingCache(namespace=f"{backend_tag()}--{settings.CLIP_PREPROCESS}")
+_clip_encoder = None
 _clip_processor = None
 
 def load_index():
-    """ Import Faiss and metadata only one time"""
-    global _faiss_index, _metadata
-    if _faiss_index is None or _metadata is None:
-        logger.debug("[init] Loading FAISS index and metadata...")
-        _faiss_index = faiss.read_index(FAISS_INDEX)
-        with open(METADATA, encoding='utf-8') as f:
-            _metadata = list(csv.DictReader(f))
-    return _faiss_index, _metadata
+    """
+    Current (FAISS index, metadata) pair, both memory-mapped.
+    Loaded on first use; newly published versions are swapped in by a
+    background reload (see services.reference_index.IndexRegistry).
+    """
+    return _index_registry.get()
 
 def load_clip():
-    """Load CLIP model and Processor only one time"""
-    global _clip_model, _clip_processor
-    if _clip_model is None or _clip_processor is None:
-        logger.debug("[init] Loading CLIP model and processor...")
-        from transformers import AutoImageProcessor, CLIPModel
-        import torch
-        device = "cpu"
-        _clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
-        _clip_processor = AutoImageProcessor.from_pretrained("openai/clip-vit-base-patch32", use_fast=False)
-    return _clip_model, _clip_processor
+    """
+    Load the CLIP image encoder (settings.CLIP_BACKEND) and Processor only one time.
+    The processor is None with CLIP_PREPROCESS=numpy (services.clip_preprocess).
+    """
+    global _clip_encoder, _clip_processor
+    if _clip_encoder is None:
+        logger.debug("[init] Loading CLIP encoder and processor...")
+        if settings.CLIP_PREPROCESS == "hf":
+            from transformers import AutoImageProcessor
+            _clip_processor = AutoImageProcessor.from_pretrained(CLIP_MODEL_ID, use_fast=False)
+        _clip_encoder = load_encoder()
+    return _clip_encoder, _clip_processor
     
-def get_image_embedding(url: str) -> np.ndarray:
+def _load_image(data: bytes):
     from PIL import Image
-    import torch
 
-    response = requests.get(url, timeout=10)
-    response.raise_for_status()
-    img = Image.open(BytesIO(response.content)).convert("RGB")
+    return Image.open(BytesIO(data)).convert("RGB")
+
+def get_image_embeddings(images: list[bytes], batch_size: int | None = None) -> np.ndarray:
+    """
+    Embed several images with batched CLIP forward passes.
+    Images already seen (same content hash) come from the embedding cache and
+    are neither decoded nor run through the model; the rest are preprocessed
+    together and run `batch_size` at a time (settings.CLIP_BATCH_SIZE by default).
+    Returns an (N, D) array of L2-normalized vectors.
+    """
+    keys = [content_hash(data) for data in images]
+    vectors = [_embedding_cache.get(key) for key in keys]
+    missing = [i for i, vec in enumerate(vectors) if vec is None]
+    if missing:
+        computed = _embed_uncached([images[i] for i in missing], batch_size)
+        for i, vec in zip(missing, computed):
+            _embedding_cache.put(keys[i], vec)
+            vectors[i] = vec
+    return np.stack(vectors).astype("float32")
+
+def _pixel_values(images: list[bytes], processor) -> np.ndarray:
+    if processor is None:
+        from services.clip_preprocess import preprocess
+        return preprocess(images)
+    return processor(images=[_load_image(data) for data in images], return_tensors="np")["pixel_values"]
+
+def _embed_uncached(images: list[bytes], batch_size: int | None = None) -> np.ndarray:
+    batch_size = max(1, batch_size or settings.CLIP_BATCH_SIZE)
 
-    model, processor = load_clip()
-    device = "cpu"
-    inputs = processor(images=img, return_tensors="pt").to(device)
+    encoder, processor = load_clip()
+    chunks = []
+    for start in range(0, len(images), batch_size):
+        chunks.append(encoder.encode(_pixel_values(images[start:start + batch_size], processor)))
+    return np.concatenate(chunks, axis=0).astype("float32")
 
-    with torch.no_grad():
-        features = model.get_image_features(**inputs)
-        features = features / features.norm(dim=-1, keepdim=True)
-    return features.cpu().numpy()[0]
+def get_image_embedding(image: bytes) -> np.ndarray:
+    return get_image_embeddings([image])[0]
 
-def recommend_image(urls: list[str], top_k: int = 1) -> dict:
-    if not urls:
-        return {"reference": None}
+def recommend_image(images: list[bytes], top_k: int = 1,
+                    strategy: str | None = None, diversity: float | None = None,
+                    filters: dict | None = None) -> dict:
+    """
+    images: raw bytes of the generated images
+    (download them with services.image_fetcher.fetch_images)
+    Returns the top_k references as "references" (best first; "reference" is the first).
+    strategy: "rrf" searches with every image vector in one batched FAISS call
+      and merges the lists by reciprocal rank; "mean" searches with their average.
+    diversity: MMR lambda for the final pick (1.0 = relevance order only).
+    Both default to settings.RECOMMENDATION_*.
+    filters: restrict candidates, e.g. {"category": ["chair", "stool"], "style": "minimal",
+      "created_after": "2025-06-01"}; applied inside the FAISS search (IDSelector).
+    Also returns {"timings": {"embed", "search", "rerank"}} in seconds, measured here
+    because this may run inside the CLIP executor process, and the per-image
+    vectors as "embeddings" so callers can keep them (services.vector_store).
+    """
+    if not images:
+        return {"reference": None, "references": []}
+    strategy = strategy or settings.RECOMMENDATION_STRATEGY
+    diversity = settings.RECOMMENDATION_MMR_LAMBDA if diversity is None else diversity
 
     faiss_index, metadata = load_index()
-    features = [get_image_embedding(url) for url in urls]
-    mean_vec = np.mean(np.stack(features), axis=0, keepdims=True)
+    t0 = time.perf_counter()
+    features = get_image_embeddings(images)
+    t1 = time.perf_counter()
+
+    params, allowed = None, faiss_index.ntotal
+    if filters:
+        selector, allowed = metadata.filters.selector(filters)
+        params = search_parameters(faiss_index, selector) if selector is not None else None
+
+    candidates = min(max(top_k, settings.RECOMMENDATION_CANDIDATES), allowed)
+    if candidates == 0:  # nothing matches the filters
+        return {"reference": None, "references": [],
+                "timings": {"embed": t1 - t0, "search": 0.0, "rerank": 0.0}, "embeddings": features}
+    if strategy == "rrf":
+        D, I = faiss_index.search(features, candidates, params=params)
+        ranked = rrf_merge(I, settings.RECOMMENDATION_RRF_K)
+    else:
+        mean_vec = np.mean(features, axis=0, keepdims=True)
+        faiss.normalize_L2(mean_vec)  # inner product on unit vectors = cosine
+        D, I = faiss_index.search(mean_vec, candidates, params=params)
+        ranked = [(int(label), float(score)) for score, label in zip(D[0], I[0]) if label >= 0]
+    t2 = time.perf_counter()
+
+    # approximate indexes can come back empty (e.g. nprobe too small)
+    labels = [label for label, _ in ranked]
+    picks = list(range(min(top_k, len(labels))))
+    vectors = metadata.vectors_for(labels) if diversity < 1.0 and len(labels) > top_k else None
+    if vectors is not None:
+        picks = mmr_select(np.array([score for _, score in ranked]), vectors, top_k, diversity)
+    t3 = time.perf_counter()
+
+    references = []
+    for pick in picks:
+        row = metadata[labels[pick]]
+        references.append({"id": row["reference_image_id"], "url": row["url"], "score": ranked[pick][1]})
+    return {
+        "reference": references[0] if references else None,
+        "references": references,
+        "timings": {"embed": t1 - t0, "search": t2 - t1, "rerank": t3 - t2},
+        "embeddings": features,
+    }
+
+def search_references(vector: np.ndarray, offset: int = 0, size: int = 20) -> list[dict]:
+    """Reference items nearest to one stored image vector, best first (page of offset/size)."""
+    faiss_index, metadata = load_index()
+    query = np.asarray(vector, dtype="float32").reshape(1, -1)
+    D, I = faiss_index.search(query, min(offset + size, faiss_index.ntotal))
+    return [
+        {"reference_image_id": metadata[label]["reference_image_id"],
+         "url": metadata[label]["url"],
+         "score": float(score)}
+        for score, label in zip(D[0][offset:], I[0][offset:])
+        if label >= 0
+    ]
+
+def warm_up() -> dict:
+    """
+    Load everything the first recommendation would otherwise pay for and
+    return the seconds spent on each step (cold-start report).
+    Runs inside the CLIP executor, so process workers warm themselves.
+    """
+    from PIL import Image
+
+    timings = {}
+    t = time.perf_counter()
+    if settings.CLIP_PREPROCESS == "hf" or settings.CLIP_BACKEND == "torch":
+        import transformers  # noqa: F401  (import cost alone is seconds)
+    if settings.CLIP_BACKEND == "torch":
+        import torch  # noqa: F401
+    timings["import_ml_libs"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    load_clip()
+    timings["load_clip_weights"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    faiss_index, _ = load_index()
+    timings["load_index"] = time.perf_counter() - t
 
-    D, I = faiss_index.search(mean_vec, top_k)
-    best_idx = I[0][0]
-    recommendation = metadata[best_idx]
-    return {"reference": {"id": recommendation["reference_image_id"], "url": recommendation["url"]}}
+    # one throwaway forward pass + search: first calls allocate and initialize kernels
+    buf = BytesIO()
+    Image.new("RGB", (224, 224)).save(buf, format="JPEG")
+    t = time.perf_counter()
+    faiss_index.search(_embed_uncached([buf.getvalue()]), 1)
+    timings["first_inference"] = time.perf_counter() - t
+    return timings
 
 # test snippet
 if __name__ == "__main__":
     urls = [
         "https://uscwuogmxxaxwvfueasr.supabase.co/storage/v1/object/public/layerminder/generated/d00af0f8-18be-41bc-b080-97a687e1952d/464a443450b84bc58e5562916145133b_1753962489036_bxzdxc.jpg?"
     ] * 4
-    print(recommend_image(urls))
\ No newline at end of file
+    import asyncio
+    from services.image_fetcher import fetch_images
+    print(recommend_image(asyncio.run(fetch_images(urls))))
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Metadata filters for reference search, built once per index version.
+
+Category / style are dictionary-encoded into one packed bitset per value
+(n/8 bytes each); created_at is an int64 column of epoch seconds. A filter
+is evaluated with a few vectorized AND / OR / compare ops over those arrays,
+and the result is handed to FAISS as an IDSelector so the search itself skips
+excluded references (no over-fetch and post-filter in Python).
+"""
+import numpy as np
+import faiss
+
+FILTER_COLUMNS = ("category", "style")
+
+
+def _parse_timestamps(values: np.ndarray) -> np.ndarray:
+    """ISO strings -> epoch seconds (to the second, timezone suffix ignored, empty -> 0). Once per version."""
+    heads = [v.decode("utf-8")[:19] or "1970-01-01T00:00:00" for v in values]
+    return np.array(heads, dtype="datetime64[s]").astype("int64")
+
+
+class ReferenceFilters:
+    def __init__(self, array: np.ndarray, labels: np.ndarray):
+        self.size = len(array)
+        self.labels = np.asarray(labels, dtype="int64")  # FAISS label of each row
+        self.all = np.packbits(np.ones(self.size, dtype=bool))
+        self.none = np.zeros_like(self.all)
+
+        # column -> lower-cased value -> packed bitset of the rows having it
+        self.bitsets: dict[str, dict[str, np.ndarray]] = {}
+        for column in FILTER_COLUMNS:
+            if column not in array.dtype.names:
+                continue
+            vocab, codes = np.unique(np.asarray(array[column]), return_inverse=True)
+            self.bitsets[column] = {
+                value.decode("utf-8").lower(): np.packbits(codes == code)
+                for code, value in enumerate(vocab) if value
+            }
+        self.created_at = _parse_timestamps(array["created_at"]) if "created_at" in array.dtype.names else None
+
+    def mask(self, filters: dict) -> np.ndarray:
+        """
+        filters: {"category": str | list[str], "style": str | list[str],
+                  "created_after": ISO date/datetime}
+        Values within a column are OR-ed, columns are AND-ed.
+        Returns a (size,) bool array.
+        """
+        bits = self.all.copy()
+        for column in FILTER_COLUMNS:
+            wanted = filters.get(column)
+            if not wanted:
+                continue
+            if column not in self.bitsets:
+                raise ValueError(f"reference index has no '{column}' column to filter on")
+            column_bits = self.none.copy()
+            for value in [wanted] if isinstance(wanted, str) else wanted:
+                column_bits |= self.bitsets[column].get(value.lower(), self.none)
+            bits &= column_bits
+
+        selected = np.unpackbits(bits, count=self.size).astype(bool)
+        if filters.get("created_after"):
+            if self.created_at is None:
+                raise ValueError("reference index has no 'created_at' column to filter on")
+            cutoff = np.datetime64(str(filters["created_after"])[:19], "s").astype("int64")
+            selected &= self.created_at >= cutoff
+        return selected
+
+    def selector(self, filters: dict) -> tuple:
+        """
+        (IDSelector or None, number of selected rows).
+        None means "no restriction". The selector is built from whichever side
+        is smaller (selected ids, or NOT the excluded ones) to keep it cheap.
+        """
+        selected = self.mask(filters)
+        count = int(selected.sum())
+        if count == self.size:
+            return None, count
+        if count * 2 <= self.size:
+            ids = np.ascontiguousarray(self.labels[selected])
+            return faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids)), count
+        ids = np.ascontiguousarray(self.labels[~selected])
+        excluded = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+        selector = faiss.IDSelectorNot(excluded)
+        selector.excluded = excluded  # keep the inner selector alive as long as the outer one
+        return selector, count
@@ -0,0 +1,460 @@
+"""
+On-disk format of the reference image index.
+
+Each build is published as an immutable directory under
+batch/embeddings/versions/<version>/ and batch/embeddings/CURRENT names the
+live one (replaced atomically). IndexRegistry notices a new CURRENT in the
+background and swaps (version, index, metadata) as one tuple, so running
+workers pick up a rebuilt pool without a restart. A version directory holds:
+
+- reference.index: FAISS index over L2-normalized CLIP vectors, inner product
+  (= cosine). Loaded with IO_FLAG_MMAP_IFC so every worker process shares one
+  page-cached copy instead of holding its own (plain IO_FLAG_MMAP still
+  copies flat / HNSW vectors into the process).
+- reference_metadata.npy: fixed-width structured array sorted by "id", the
+  int64 label stored in the index. Loaded with mmap_mode="r" for the same
+  reason. It doubles as the manifest for incremental builds (path + hash).
+- reference_embeddings.npy: the raw float32 vectors in metadata order, kept so
+  incremental builds can reuse them and approximate indexes (IVF-PQ, HNSW)
+  can be rebuilt or benchmarked against exact search.
+
+Without CURRENT, the legacy IndexFlatL2 + CSV pair shipped in
+batch/embeddings is published as the first version on first load
+(ensure_current_version): IndexFlatIP scores, stable ids and storage paths,
+and the existing reference_image_id of every row, so the first incremental
+build re-embeds nothing and adds no pool rows. If the directory is read-only
+the same conversion happens in memory.
+"""
+import csv
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+import faiss
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_DIR = "batch/embeddings"
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+KEEP_VERSIONS = 3
+INDEX_FILE = "reference.index"
+METADATA_FILE = "reference_metadata.npy"
+EMBEDDINGS_FILE = "reference_embeddings.npy"
+LEGACY_INDEX_FILE = "image_embeddings.index"
+LEGACY_METADATA_FILE = "image_embeddings_metadata.csv"
+CONVERT_LOCK_FILE = ".convert.lock"
+
+# category / style come from reference_image_pool.metadata and back the search filters
+METADATA_COLUMNS = ("reference_image_id", "url", "created_at", "path", "content_hash", "category", "style")
+
+INDEX_TYPES = ("flat", "ivfpq", "hnsw")
+
+
+def stable_id(path: str) -> int:
+    """Index label for a storage path: first 63 bits of sha1, same on every run."""
+    return int.from_bytes(hashlib.sha1(path.encode("utf-8")).digest()[:8], "big") >> 1
+
+
+def reference_uuid(path: str) -> str:
+    """reference_image_pool primary key for a storage path, so re-runs upsert instead of duplicating."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"layerminder-reference:{path}"))
+
+
+class ReferenceMetadata:
+    """
+    Row access over the structured array: metadata[label] -> dict of str.
+    With an "id" column labels are looked up by binary search,
+    otherwise (legacy CSV) the label is the row position.
+    `vectors` (row-aligned, memory-mapped) are there when the version has
+    reference_embeddings.npy; approximate indexes can't give them back exactly.
+    """
+
+    def __init__(self, array: np.ndarray, vectors: np.ndarray | None = None):
+        self.array = array
+        self.vectors = vectors
+        self.ids = array["id"] if "id" in array.dtype.names else None
+        self._filters = None
+
+    @property
+    def filters(self):
+        """Columnar filter arrays (services.reference_filters), built on first use."""
+        if self._filters is None:
+            from services.reference_filters import ReferenceFilters
+            labels = self.ids if self.ids is not None else np.arange(len(self.array))
+            self._filters = ReferenceFilters(self.array, labels)
+        return self._filters
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def position(self, label: int) -> int:
+        if self.ids is None:
+            return int(label)
+        pos = int(np.searchsorted(self.ids, label))
+        if pos >= len(self.ids) or self.ids[pos] != label:
+            raise KeyError(label)
+        return pos
+
+    def __getitem__(self, label: int) -> dict:
+        row = self.array[self.position(label)]
+        return {name: row[name].decode("utf-8") for name in self.array.dtype.names if name != "id"}
+
+    def vectors_for(self, labels) -> np.ndarray | None:
+        if self.vectors is None:
+            return None
+        return np.asarray(self.vectors[[self.position(label) for label in labels]], dtype="float32")
+
+
+def build_metadata(rows: list[dict], columns: tuple = METADATA_COLUMNS) -> np.ndarray:
+    """
+    list of dicts -> structured array with fixed-width utf-8 byte columns,
+    plus an int64 "id" column when the rows carry one.
+    """
+    encoded = {c: [str(r.get(c) or "").encode("utf-8") for r in rows] for c in columns}
+    dtype = [(c, f"S{max([len(v) for v in encoded[c]] + [1])}") for c in columns]
+    with_ids = bool(rows) and all("id" in r for r in rows)
+    if with_ids:
+        dtype = [("id", "<i8")] + dtype
+    array = np.zeros(len(rows), dtype=dtype)
+    if with_ids:
+        array["id"] = [r["id"] for r in rows]
+    for c in columns:
+        array[c] = encoded[c]
+    return array
+
+
+def metadata_rows(array: np.ndarray) -> list[dict]:
+    """Inverse of build_metadata, used to carry unchanged rows into the next build."""
+    rows = []
+    for row in array:
+        item = {name: row[name].decode("utf-8") for name in array.dtype.names if name != "id"}
+        if "id" in array.dtype.names:
+            item["id"] = int(row["id"])
+        rows.append(item)
+    return rows
+
+
+def build_index(embeddings: np.ndarray, index_type: str = "flat", ids: np.ndarray | None = None,
+                nlist: int | None = None, pq_m: int = 32, hnsw_m: int = 32):
+    """
+    Inner-product index over normalized vectors, labelled with `ids`
+    (row positions by default).
+    flat : exact search, fine up to ~tens of thousands of vectors
+    ivfpq: inverted lists + product quantization, smallest and fastest at 100k+
+    hnsw : graph index, highest recall per ms but keeps full vectors in memory
+    flat and ivfpq support remove_ids, so incremental builds patch them in place;
+    hnsw cannot delete and is rebuilt from the stored embeddings.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    n, d = embeddings.shape
+    ids = np.arange(n, dtype="int64") if ids is None else np.asarray(ids, dtype="int64")
+    if index_type == "flat":
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(d))
+    elif index_type == "ivfpq":
+        # ~4*sqrt(n) lists, with >= 39 training points per centroid
+        nlist = nlist or max(1, int(4 * np.sqrt(n)))
+        nlist = max(1, min(nlist, n // 39))
+        if n < 256 or d % pq_m:
+            raise ValueError(f"ivfpq needs >= 256 vectors and dim divisible by {pq_m} (got n={n}, d={d})")
+        index = faiss.index_factory(d, f"IVF{nlist},PQ{pq_m}", faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+    elif index_type == "hnsw":
+        index = faiss.IndexIDMap2(faiss.IndexHNSWFlat(d, hnsw_m, faiss.METRIC_INNER_PRODUCT))
+    else:
+        raise ValueError(f"unknown index type: {index_type} (expected one of {INDEX_TYPES})")
+    index.add_with_ids(embeddings, ids)
+    return index
+
+
+def _unwrap(index):
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_type_of(index) -> str:
+    base = _unwrap(index)
+    if faiss.try_extract_index_ivf(base) is not None:
+        return "ivfpq"
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def apply_search_params(index, nprobe: int | None = None, ef_search: int | None = None) -> None:
+    """Set nprobe / efSearch on whichever applies to this index type."""
+    ps = faiss.ParameterSpace()  # recurses through IndexIDMap
+    index_type = index_type_of(index)
+    if index_type == "ivfpq":
+        ps.set_index_parameter(index, "nprobe", nprobe or settings.FAISS_NPROBE)
+    elif index_type == "hnsw":
+        ps.set_index_parameter(index, "efSearch", ef_search or settings.FAISS_EF_SEARCH)
+
+
+def search_parameters(index, selector=None):
+    """
+    Per-call SearchParameters carrying an IDSelector. They replace the
+    index-level nprobe / efSearch for that call, so those are set here too.
+    """
+    index_type = index_type_of(index)
+    if index_type == "ivfpq":
+        return faiss.SearchParametersIVF(sel=selector, nprobe=settings.FAISS_NPROBE)
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=settings.FAISS_EF_SEARCH)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _save_npy(path: str, array: np.ndarray) -> None:
+    with open(path, "wb") as f:  # np.save(path) would append ".npy" to the tmp name
+        np.save(f, array)
+
+
+def _write_text(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _atomic_write(path: str, write) -> None:
+    tmp = f"{path}.tmp"
+    write(tmp)
+    os.replace(tmp, path)  # readers holding an mmap keep the old inode
+
+
+def write_reference_index(index, metadata: np.ndarray, directory: str = EMBEDDINGS_DIR,
+                          embeddings: np.ndarray | None = None) -> None:
+    if index.ntotal != len(metadata):
+        raise ValueError(f"index has {index.ntotal} vectors but metadata has {len(metadata)} rows")
+    os.makedirs(directory, exist_ok=True)
+    if len(metadata) and "id" in metadata.dtype.names and np.any(np.diff(metadata["id"]) <= 0):
+        raise ValueError("metadata must be sorted by unique id")
+    if embeddings is not None:
+        _atomic_write(os.path.join(directory, EMBEDDINGS_FILE),
+                      lambda p: _save_npy(p, np.asarray(embeddings, dtype="float32")))
+    _atomic_write(os.path.join(directory, METADATA_FILE),
+                  lambda p: _save_npy(p, metadata))
+    _atomic_write(os.path.join(directory, INDEX_FILE),
+                  lambda p: faiss.write_index(index, p))
+
+
+def current_version(root: str = EMBEDDINGS_DIR) -> str | None:
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_directory(root: str = EMBEDDINGS_DIR, version: str | None = None) -> str:
+    return os.path.join(root, VERSIONS_DIR, version) if version else root
+
+
+def publish_reference_index(index, metadata: np.ndarray, root: str = EMBEDDINGS_DIR,
+                            embeddings: np.ndarray | None = None) -> str:
+    """Write a new version directory, then point CURRENT at it. Returns the version."""
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    write_reference_index(index, metadata, version_directory(root, version), embeddings)
+    _atomic_write(os.path.join(root, CURRENT_FILE), lambda p: _write_text(p, version))
+
+    # keep a few previous versions for rollback (write their name into CURRENT)
+    versions = sorted(os.listdir(os.path.join(root, VERSIONS_DIR)))
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(version_directory(root, old), ignore_errors=True)
+    return version
+
+
+def _read_index_mmap(path: str):
+    """Zero-copy read: vectors stay in the page cache. Logs the mode actually used."""
+    try:
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)
+    except Exception as e:
+        # index types without mmap support are read into memory
+        logger.warning("[index] mmap not supported for %s (%s), reading into memory", path, e)
+        index = faiss.read_index(path)
+        logger.info("[index] loaded %s into memory (%d vectors)", path, index.ntotal)
+        return index
+    logger.info("[index] loaded %s memory-mapped (%d vectors)", path, index.ntotal)
+    return index
+
+
+def read_build_state(root: str = EMBEDDINGS_DIR) -> tuple:
+    """
+    (index, metadata array, embeddings) of the current build for incremental runs,
+    or (None, None, None) when there is none in the id-keyed format.
+    The index is read into memory (not mmap) because it is about to be modified.
+    """
+    directory = version_directory(root, ensure_current_version(root))
+    paths = [os.path.join(directory, f) for f in (INDEX_FILE, METADATA_FILE, EMBEDDINGS_FILE)]
+    if not all(os.path.exists(p) for p in paths):
+        return None, None, None
+    metadata = np.load(paths[1])
+    if "id" not in metadata.dtype.names or "content_hash" not in metadata.dtype.names:
+        return None, None, None
+    return faiss.read_index(paths[0]), metadata, np.load(paths[2])
+
+
+def storage_path(url: str) -> str:
+    """Public object URL -> path inside the bucket (what the batch job keys files by)."""
+    return url.split("/object/public/", 1)[1].split("/", 1)[1]
+
+
+def _convert_legacy(directory: str) -> tuple:
+    """
+    Legacy IndexFlatL2 + CSV -> (IndexFlatIP with stable ids, metadata sorted by id, vectors).
+    reference_image_id is kept (history_records points at those pool rows);
+    content_hash is unknown, the next incremental build adopts the storage one.
+    """
+    legacy = faiss.read_index(os.path.join(directory, LEGACY_INDEX_FILE))
+    vectors = legacy.reconstruct_n(0, legacy.ntotal).astype("float32")
+    faiss.normalize_L2(vectors)
+    with open(os.path.join(directory, LEGACY_METADATA_FILE), encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    if len(rows) != len(vectors):
+        raise RuntimeError(f"legacy index/metadata mismatch in {directory}: {len(vectors)} != {len(rows)}")
+    for row in rows:
+        row["path"] = storage_path(row["url"])
+        row["id"] = stable_id(row["path"])
+        row["content_hash"] = ""
+    order = sorted(range(len(rows)), key=lambda i: rows[i]["id"])
+    rows = [rows[i] for i in order]
+    vectors = np.ascontiguousarray(vectors[order])
+    ids = np.array([r["id"] for r in rows], dtype="int64")
+    return build_index(vectors, "flat", ids=ids), build_metadata(rows), vectors
+
+
+def _read_legacy(directory: str) -> tuple:
+    index, metadata, vectors = _convert_legacy(directory)
+    return index, ReferenceMetadata(metadata, vectors)
+
+
+def read_reference_index(directory: str = EMBEDDINGS_DIR) -> tuple:
+    """Returns (faiss index, ReferenceMetadata) stored in `directory`."""
+    index_path = os.path.join(directory, INDEX_FILE)
+    metadata_path = os.path.join(directory, METADATA_FILE)
+    if not (os.path.exists(index_path) and os.path.exists(metadata_path)):
+        logger.warning("[index] %s not found, converting the legacy CSV index in memory", index_path)
+        return _read_legacy(directory)
+
+    index = _read_index_mmap(index_path)
+    apply_search_params(index)
+    metadata = np.load(metadata_path, mmap_mode="r")
+    if index.ntotal != len(metadata):
+        raise RuntimeError(f"index/metadata mismatch in {directory}: {index.ntotal} != {len(metadata)}")
+    embeddings_path = os.path.join(directory, EMBEDDINGS_FILE)
+    vectors = np.load(embeddings_path, mmap_mode="r") if os.path.exists(embeddings_path) else None
+    if vectors is not None and len(vectors) != len(metadata):
+        vectors = None  # not row-aligned: better no diversity re-rank than a wrong one
+    return index, ReferenceMetadata(metadata, vectors)
+
+
+class IndexRegistry:
+    """
+    Holds the live (version, index, metadata) tuple of one process.
+    get() returns both halves from the same tuple, so a caller never pairs an
+    index with another version's metadata. At most every `check_interval`
+    seconds it looks at CURRENT and, if it moved, loads the new version in a
+    background thread; callers keep using the old tuple until the swap.
+    """
+
+    def __init__(self, root: str = EMBEDDINGS_DIR, check_interval: float | None = None):
+        self.root = root
+        self.check_interval = settings.INDEX_RELOAD_INTERVAL_SEC if check_interval is None else check_interval
+        self._snapshot: tuple | None = None
+        self._lock = threading.Lock()
+        self._loading = False
+        self._checked_at = 0.0
+
+    @property
+    def version(self) -> str | None:
+        return self._snapshot[0] if self._snapshot else None
+
+    def _load(self, version: str | None) -> tuple:
+        t0 = time.perf_counter()
+        index, metadata = read_reference_index(version_directory(self.root, version))
+        metadata.filters  # build the filter bitsets here, off the request path
+        logger.info("[index] loaded version %s (%d vectors) in %.2fs",
+                    version or "unversioned", index.ntotal, time.perf_counter() - t0)
+        return version, index, metadata
+
+    def _initial_version(self) -> str | None:
+        try:
+            return ensure_current_version(self.root)
+        except OSError as e:
+            # read-only deploy: read_reference_index converts the legacy files in memory
+            logger.warning("[index] could not publish the legacy index in %s: %s", self.root, e)
+            return current_version(self.root)
+
+    def get(self) -> tuple:
+        """Returns (faiss index, ReferenceMetadata)."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load(self._initial_version())
+                    self._checked_at = time.monotonic()
+            snapshot = self._snapshot
+        else:
+            self._maybe_reload()
+        return snapshot[1], snapshot[2]
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if self.check_interval <= 0 or self._loading or now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = current_version(self.root)
+        if version == self.version:
+            return
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._reload, args=(version,), daemon=True, name="index-reload").start()
+
+    def _reload(self, version: str | None) -> None:
+        try:
+            self._snapshot = self._load(version)  # single assignment: the swap is atomic
+        except Exception as e:
+            # keep serving the old version, retry on a later check
+            logger.error("[index] failed to load version %s: %s", version, e)
+        finally:
+            self._loading = False
+
+
+def convert_legacy(root: str = EMBEDDINGS_DIR) -> str:
+    """Publish the legacy IndexFlatL2 + CSV pair as an IndexFlatIP + .npy version."""
+    index, metadata, vectors = _convert_legacy(root)
+    return publish_reference_index(index, metadata, root, embeddings=vectors)
+
+
+def ensure_current_version(root: str = EMBEDDINGS_DIR) -> str | None:
+    """
+    CURRENT; when there is none yet but the legacy files are there, they are
+    published as the first version. Processes starting together serialize on
+    a lock file, so one converts and the others reuse its version.
+    """
+    version = current_version(root)
+    if version or not os.path.exists(os.path.join(root, LEGACY_INDEX_FILE)):
+        return version
+    with open(os.path.join(root, CONVERT_LOCK_FILE), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        version = current_version(root)
+        if version is None:
+            version = convert_legacy(root)
+            logger.info("[index] published legacy files in %s as version %s", root, version)
+    return version
+
+
+if __name__ == "__main__":
+    # optional, the first load does the same: python -m services.reference_index
+    version = ensure_current_version()
+    print(f"{EMBEDDINGS_DIR} current version: {version}")
@@ -1,51 +1,45 @@
-import asyncio, base64, httpx
-from datetime import datetime, timezone
+import asyncio, base64
+from typing import Optional
 from openai import AsyncOpenAI
 
-from core.supabase_client import supabase
+from repositories import history as history_repo
 from core.config import settings 
+from services.image_fetcher import fetch_image
+from services.concurrency import limit
+from core.metrics import observe
 
 client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
 CHAT_GPT_MODEL = "gpt-4.1-nano"
 
 
-async def generate_and_store_story_keywords(record_id: str):
+async def _load_first_image(record_id: str) -> bytes:
+    """Fallback: download the first generated image of a record from storage."""
+    rec_imgs = await history_repo.list_record_images(record_id)
+    return await fetch_image(rec_imgs[0]["url"])
+
+
+async def generate_and_store_story_keywords(record_id: str, image: Optional[bytes] = None):
     """
     1) history_record_images -> load url list from images table
+       (skipped when the pipeline already hands over the first image bytes)
     2) Image URL and system message to prompt
     3) Keyword parsing
     4) history_records table story, keywords, update
+    Returns {"story", "keywords"} as stored.
     """
-    now = datetime.now(timezone.utc).isoformat()
-
     # 1) story_status -> processing
-    supabase.table("history_records")\
-        .update({"story_status":"processing",
-                 "keywords_status": "processing", 
-                 "updated_at": now})\
-        .eq("record_id", record_id)\
-        .execute()
-    
-    # 2) Get images from history_record_images
-    rec_imgs = supabase.table("history_record_images")\
-        .select("image_id, seq")\
-        .eq("record_id", record_id)\
-        .execute().data or []
-    image_ids = [r["image_id"] for r in rec_imgs]
-    
-    # 3) Get urls from images table
-    imgs = supabase.table("images")\
-        .select("url")\
-        .in_("image_id", image_ids)\
-        .execute().data or []
+    await history_repo.update_record(record_id, {
+        "story_status": "processing",
+        "keywords_status": "processing"
+    })
     
-    urls = [i["url"] for i in imgs]
+    # 2~3) Only go to storage when running apart from image generation
+    if image is None:
+        with observe("story.fetch_image"):
+            image = await _load_first_image(record_id)
 
-    # 4) First image URL fetch -> base64 encode
-    async with httpx.AsyncClient() as http:
-        resp = await http.get(urls[0])
-        resp.raise_for_status()
-        b64 = base64.b64encode(resp.content).decode("utf-8")
+    # 4) First image -> base64 encode
+    b64 = base64.b64encode(image).decode("utf-8")
 
 
     # 4) Generate story with OpenAI
@@ -103,12 +97,14 @@ async def generate_and_store_story_keywords(record_id: str):
         }
     }
 
-    completion = await client.chat.completions.create(
-        model=CHAT_GPT_MODEL,
-        messages=[system, user, image_message],
-        max_tokens=1500,
-        temperature=0.7
-    )
+    async with limit("openai_chat"):
+        with observe("story.completion"):
+            completion = await client.chat.completions.create(
+                model=CHAT_GPT_MODEL,
+                messages=[system, user, image_message],
+                max_tokens=1500,
+                temperature=0.7
+            )
 
     result = completion.choices[0].message.content.strip()
 
@@ -122,13 +118,11 @@ async def generate_and_store_story_keywords(record_id: str):
         keywords = []
 
     # 6) Update DB: story, keywords -> all ready
-    supabase.table("history_records")\
-        .update({
-            "story": desc.strip(),
-            "keywords": keywords,
-            "story_status": "ready",
-            "keywords_status": "ready",
-            "updated_at": now
-        })\
-        .eq("record_id", record_id)\
-        .execute()
+    story = desc.strip()
+    await history_repo.update_record(record_id, {
+        "story": story,
+        "keywords": keywords,
+        "story_status": "ready",
+        "keywords_status": "ready"
+    })
+    return {"story": story, "keywords": keywords}
@@ -0,0 +1,123 @@
+"""
+User-scoped store for the CLIP vectors of generated images.
+
+The recommendation stage already embeds every generated image; the vectors
+are kept here instead of being thrown away, so "similar images" needs no
+extra inference.
+
+IMAGE_VECTOR_STORE=local (default): SQLite file shared by the API and worker
+processes, exact search with numpy (a user has hundreds of images, not millions).
+IMAGE_VECTOR_STORE=pgvector: image_embeddings table + match_user_images RPC
+(see supabase/migrations/*_add_image_embeddings.sql).
+"""
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Optional
+
+import numpy as np
+
+from core.config import settings
+from repositories import image_embeddings as embeddings_repo
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_vectors (
+    image_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_image_vectors_user
+    ON image_vectors (user_id);
+"""
+
+
+class LocalVectorStore:
+    """
+    Vectors as float32 blobs in SQLite.
+    Blocking methods are wrapped with asyncio.to_thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _add(self, user_id: str, image_ids: list[str], vectors: np.ndarray) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO image_vectors (image_id, user_id, vector, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(image_id, user_id, np.asarray(vec, dtype="float32").tobytes(), now)
+                 for image_id, vec in zip(image_ids, vectors)]
+            )
+
+    def _similar(self, user_id: str, image_id: str, offset: int, size: int) -> Optional[list[dict]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT image_id, vector FROM image_vectors WHERE user_id = ?", (user_id,)
+            ).fetchall()
+        ids = [r[0] for r in rows]
+        if image_id not in ids:
+            return None
+        matrix = np.stack([np.frombuffer(r[1], dtype="float32") for r in rows])
+        scores = matrix @ matrix[ids.index(image_id)]
+        order = [i for i in np.argsort(-scores) if ids[i] != image_id]
+        return [{"image_id": ids[i], "score": float(scores[i])} for i in order[offset:offset + size]]
+
+    def _get(self, user_id: str, image_id: str) -> Optional[np.ndarray]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT vector FROM image_vectors WHERE user_id = ? AND image_id = ?", (user_id, image_id)
+            ).fetchone()
+        return np.frombuffer(row[0], dtype="float32") if row else None
+
+    async def add(self, user_id: str, image_ids: list[str], vectors: np.ndarray) -> None:
+        await asyncio.to_thread(self._add, user_id, image_ids, vectors)
+
+    async def get(self, user_id: str, image_id: str) -> Optional[np.ndarray]:
+        return await asyncio.to_thread(self._get, user_id, image_id)
+
+    async def similar(self, user_id: str, image_id: str, offset: int, size: int) -> Optional[list[dict]]:
+        """Nearest images of the same user, best first; None if image_id has no vector."""
+        return await asyncio.to_thread(self._similar, user_id, image_id, offset, size)
+
+
+class PgVectorStore:
+    """Same interface on Supabase (pgvector); search runs in Postgres."""
+
+    async def add(self, user_id: str, image_ids: list[str], vectors: np.ndarray) -> None:
+        await embeddings_repo.upsert_embeddings([
+            {"image_id": image_id, "user_id": user_id, "embedding": np.asarray(vec, dtype="float32").tolist()}
+            for image_id, vec in zip(image_ids, vectors)
+        ])
+
+    async def get(self, user_id: str, image_id: str) -> Optional[np.ndarray]:
+        embedding = await embeddings_repo.get_embedding(user_id, image_id)
+        return np.asarray(embedding, dtype="float32") if embedding is not None else None
+
+    async def similar(self, user_id: str, image_id: str, offset: int, size: int) -> Optional[list[dict]]:
+        if await embeddings_repo.get_embedding(user_id, image_id) is None:
+            return None
+        return await embeddings_repo.match_user_images(user_id, image_id, offset, size)
+
+
+_store = None
+
+
+def get_vector_store():
+    global _store
+    if _store is None:
+        if settings.IMAGE_VECTOR_STORE == "pgvector":
+            _store = PgVectorStore()
+        else:
+            _store = LocalVectorStore(settings.IMAGE_VECTOR_STORE_PATH)
+    return _store
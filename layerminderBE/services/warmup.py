@@ -0,0 +1,52 @@
+"""
+Boot-time warm-up (WARMUP_ON_STARTUP).
+Loads CLIP and the reference index in the background right after startup so
+the first generation on a fresh instance doesn't pay for them. /ready reports
+the progress and the cold-start timings.
+"""
+import asyncio
+import time
+
+from core.config import settings
+from core.metrics import observe_seconds
+from services.concurrency import get_clip_executor
+
+BOOT_STARTED = time.perf_counter()
+
+_state: dict = {"status": "disabled", "timings": {}, "error": None}
+_task: asyncio.Task | None = None
+
+
+def warmup_state() -> dict:
+    return dict(_state)
+
+
+async def _warm_up() -> None:
+    from services.recommendation import warm_up
+
+    _state["status"] = "running"
+    t0 = time.perf_counter()
+    try:
+        # one call per CLIP worker, submitted together so each process worker takes one
+        loop = asyncio.get_running_loop()
+        executor = get_clip_executor()
+        workers = max(1, settings.CLIP_WORKERS) if settings.CLIP_EXECUTOR == "process" else 1
+        results = await asyncio.gather(*[loop.run_in_executor(executor, warm_up) for _ in range(workers)])
+        timings = {step: max(r[step] for r in results) for step in results[0]}
+        timings["warmup_total"] = time.perf_counter() - t0
+        timings["ready_after_boot"] = time.perf_counter() - BOOT_STARTED
+        for step, seconds in timings.items():
+            observe_seconds(f"warmup.{step}", seconds)
+        _state.update(status="ready", timings=timings)
+        print("[Warmup] cold start: " + ", ".join(f"{k}={v:.2f}s" for k, v in timings.items()))
+    except Exception as e:
+        # requests still load lazily, so a failed warm-up only costs the first user
+        _state.update(status="failed", error=f"{type(e).__name__}: {e}")
+        print(f"[Warmup] failed: {e}")
+
+
+def start_warmup() -> None:
+    global _task
+    if _task is None:
+        _state["status"] = "pending"
+        _task = asyncio.create_task(_warm_up())
@@ -0,0 +1,45 @@
+-- CLIP vectors of generated images, for "similar images" (IMAGE_VECTOR_STORE=pgvector)
+
+-- 1. Extension + table
+CREATE EXTENSION IF NOT EXISTS vector WITH SCHEMA extensions;
+
+CREATE TABLE IF NOT EXISTS public.image_embeddings (
+    image_id UUID PRIMARY KEY REFERENCES public.images(image_id) ON DELETE CASCADE,
+    user_id UUID NOT NULL,
+    embedding extensions.vector(512) NOT NULL, -- L2-normalized, so inner product = cosine
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_image_embeddings_user
+    ON public.image_embeddings (user_id);
+
+-- 2. Nearest images of the same user, best first (excluding the query image)
+CREATE OR REPLACE FUNCTION public.match_user_images(
+    p_user_id UUID,
+    p_image_id UUID,
+    p_limit INT DEFAULT 20,
+    p_offset INT DEFAULT 0
+)
+RETURNS TABLE (image_id UUID, score FLOAT) AS $$
+    SELECT e.image_id,
+           -(e.embedding OPERATOR(extensions.<#>) q.embedding) AS score -- <#> is negative inner product
+    FROM public.image_embeddings e,
+         (SELECT embedding FROM public.image_embeddings
+          WHERE image_id = p_image_id AND user_id = p_user_id) q
+    WHERE e.user_id = p_user_id
+      AND e.image_id <> p_image_id
+    ORDER BY e.embedding OPERATOR(extensions.<#>) q.embedding
+    LIMIT p_limit OFFSET p_offset;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+-- 3. Auth + RLS (the API writes and searches with the service role).
+--    p_user_id is trusted as given, so the default grant to anon /
+--    authenticated would let anyone rank another user's images.
+REVOKE EXECUTE ON FUNCTION public.match_user_images FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.match_user_images TO service_role;
+
+ALTER TABLE public.image_embeddings ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own image embeddings"
+    ON public.image_embeddings FOR SELECT
+    USING (user_id = auth.uid());
@@ -0,0 +1,5 @@
+-- Top-N reference recommendations per record, best first:
+-- [{"rank": 1, "reference_image_id": "...", "url": "...", "score": 0.03}, ...]
+-- reference_image_id keeps the first one, so existing views are unchanged.
+ALTER TABLE public.history_records
+    ADD COLUMN IF NOT EXISTS recommendations JSONB NOT NULL DEFAULT '[]'::jsonb;
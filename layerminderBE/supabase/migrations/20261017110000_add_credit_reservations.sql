@@ -0,0 +1,137 @@
+-- Credit reservations: /generate deducts with ONE atomic call (reserve_credit),
+-- the pipeline then commits the reservation when images were generated or
+-- refunds it when image generation failed.
+
+-- 1. Reservation ledger (one row per /generate request)
+CREATE TABLE IF NOT EXISTS public.credit_reservations (
+    reservation_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    amount INT NOT NULL CHECK (amount > 0),
+    status TEXT NOT NULL DEFAULT 'reserved'
+        CHECK (status IN ('reserved', 'committed', 'refunded')),
+    reason TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    settled_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_credit_reservations_user
+    ON public.credit_reservations (user_id, created_at DESC);
+
+ALTER TABLE public.credit_reservations ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own credit reservations"
+    ON public.credit_reservations FOR SELECT
+    USING (user_id = auth.uid());
+
+-- 2. Reserve: check + deduct + log in one round trip
+-- Returns {"reserved": bool, "reservation_id": uuid | null, "credits": balance after the call}
+CREATE OR REPLACE FUNCTION public.reserve_credit(
+    p_user_id UUID,
+    p_amount INT DEFAULT 1,
+    p_reason TEXT DEFAULT 'Image generation'
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_current_credits INT;
+    v_reservation_id UUID;
+BEGIN
+    -- 1) Check current credits
+    SELECT credits INTO v_current_credits
+    FROM public.credits
+    WHERE user_id = p_user_id
+    FOR UPDATE; -- Lock the row for update
+
+    -- 2) If not enough credits, report the balance
+    IF v_current_credits IS NULL OR v_current_credits < p_amount THEN
+        RETURN jsonb_build_object(
+            'reserved', FALSE,
+            'reservation_id', NULL,
+            'credits', COALESCE(v_current_credits, 0)
+        );
+    END IF;
+
+    -- 3) Deduct credits
+    UPDATE public.credits
+    SET credits = credits - p_amount,
+        updated_at = NOW()
+    WHERE user_id = p_user_id;
+
+    -- 4) Open the reservation and log the event
+    INSERT INTO public.credit_reservations (user_id, amount, reason)
+    VALUES (p_user_id, p_amount, p_reason)
+    RETURNING reservation_id INTO v_reservation_id;
+
+    INSERT INTO public.credit_events (user_id, delta, event_type, reason, idempotency_key)
+    VALUES (p_user_id, -p_amount, 'reservation', p_reason, v_reservation_id::TEXT);
+
+    RETURN jsonb_build_object(
+        'reserved', TRUE,
+        'reservation_id', v_reservation_id,
+        'credits', v_current_credits - p_amount
+    );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- 3. Commit: the credit stays spent (no-op if already settled)
+CREATE OR REPLACE FUNCTION public.commit_credit(p_reservation_id UUID)
+RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE public.credit_reservations
+    SET status = 'committed',
+        settled_at = NOW()
+    WHERE reservation_id = p_reservation_id
+      AND status = 'reserved';
+
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- 4. Refund: give the credit back (only once, only while still reserved)
+-- Returns the balance after the refund, or -1 if nothing was refunded
+CREATE OR REPLACE FUNCTION public.refund_credit(
+    p_reservation_id UUID,
+    p_reason TEXT DEFAULT 'Image generation failed'
+)
+RETURNS INT AS $$
+DECLARE
+    v_user_id UUID;
+    v_amount INT;
+    v_credits INT;
+BEGIN
+    -- 1) Close the reservation (row lock makes concurrent refunds a no-op)
+    UPDATE public.credit_reservations
+    SET status = 'refunded',
+        settled_at = NOW()
+    WHERE reservation_id = p_reservation_id
+      AND status = 'reserved'
+    RETURNING user_id, amount INTO v_user_id, v_amount;
+
+    IF v_user_id IS NULL THEN
+        RETURN -1;
+    END IF;
+
+    -- 2) Give the credits back
+    UPDATE public.credits
+    SET credits = credits + v_amount,
+        updated_at = NOW()
+    WHERE user_id = v_user_id
+    RETURNING credits INTO v_credits;
+
+    -- 3) Log the event (idempotency_key is UNIQUE: the reservation row already uses the bare id)
+    INSERT INTO public.credit_events (user_id, delta, event_type, reason, idempotency_key)
+    VALUES (v_user_id, v_amount, 'refund', p_reason, 'refund:' || p_reservation_id::TEXT);
+
+    RETURN v_credits;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- 5. Giving Auth Role to the functions: service role only. The default
+--    privileges (remote_schema) grant every new function to anon and
+--    authenticated, who could otherwise reserve / commit for any p_user_id or
+--    refund their own in-flight reservation (ids are visible through RLS).
+REVOKE EXECUTE ON FUNCTION public.reserve_credit FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.commit_credit FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.refund_credit FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.reserve_credit TO service_role;
+GRANT EXECUTE ON FUNCTION public.commit_credit TO service_role;
+GRANT EXECUTE ON FUNCTION public.refund_credit TO service_role;
@@ -0,0 +1,47 @@
+"""
+Shared test setup: Settings() needs its required fields before any app
+module is imported. Nothing here talks to Supabase / OpenAI; tests replace
+the repository / service calls they exercise.
+"""
+import os
+
+import pytest
+
+for _name, _value in {
+    "OPENAI_API_KEY": "test",
+    "SUPABASE_URL": "http://localhost:54321",
+    "SUPABASE_SERVICE_ROLE": "test.test.test",  # the client checks for a JWT shape
+    "SUPABASE_STORAGE_BUCKET": "test",
+    "SUPABASE_JWT_SECRET": "test",
+    "DATABASE_URL": "postgresql://localhost/test",
+    "REFERENCE_URL": "http://localhost",
+    "REFERENCE_STORAGE_BUCKET": "test",
+    "JWT_SECRET": "test",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+
+@pytest.fixture(scope="session")
+def sample_images() -> list[bytes]:
+    """
+    Encoded test images: smooth, photo-like content (upscaled noise) in the
+    shapes the preprocessing has to handle: large JPEG (reduced-scale decode),
+    portrait / landscape, PNG with alpha, grayscale, already small.
+    """
+    from io import BytesIO
+
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    cases = [((1024, 768), "RGB", "JPEG"), ((600, 900), "RGB", "JPEG"), ((1600, 1200), "RGB", "JPEG"),
+             ((500, 500), "RGBA", "PNG"), ((640, 480), "L", "JPEG"), ((256, 200), "RGB", "PNG")]
+    images = []
+    for (w, h), mode, fmt in cases:
+        channels = {"RGB": 3, "RGBA": 4, "L": 1}[mode]
+        small = rng.integers(0, 256, size=(h // 64, w // 64, channels), dtype=np.uint8)
+        image = Image.fromarray(small.squeeze(-1) if channels == 1 else small, mode)
+        buf = BytesIO()
+        image.resize((w, h), Image.BICUBIC).save(buf, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+        images.append(buf.getvalue())
+    return images
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+transformers = pytest.importorskip("transformers")
+
+from batch.export_clip_onnx import export_onnx, quantize_onnx  # noqa: E402
+from services.clip_encoder import CLIP_MODEL_ID, OnnxVisionEncoder, TorchVisionEncoder  # noqa: E402
+from services.clip_preprocess import preprocess  # noqa: E402
+
+# min per-image cosine against the torch fp32 tower
+FP32_MIN_COSINE = 0.9999
+INT8_MIN_COSINE = 0.99  # same bar as batch/clip_parity --min-cosine
+
+
+@pytest.fixture(scope="module")
+def tiny_model_dir(tmp_path_factory) -> str:
+    """Randomly initialized vision tower with CLIP's input shape: exercises the runtimes without downloading weights."""
+    torch.manual_seed(0)
+    config = transformers.CLIPVisionConfig(
+        hidden_size=64, intermediate_size=128, num_hidden_layers=2, num_attention_heads=2,
+        image_size=224, patch_size=32, projection_dim=32,
+    )
+    directory = tmp_path_factory.mktemp("clip-tiny")
+    transformers.CLIPVisionModelWithProjection(config).save_pretrained(directory)
+    return str(directory)
+
+
+@pytest.fixture(scope="module")
+def clip_model_dir(tmp_path_factory) -> str:
+    try:
+        model = transformers.CLIPVisionModelWithProjection.from_pretrained(CLIP_MODEL_ID)
+    except OSError as e:  # weights neither cached nor downloadable
+        pytest.skip(f"{CLIP_MODEL_ID} not available: {e}")
+    directory = tmp_path_factory.mktemp("clip")
+    model.save_pretrained(directory)
+    return str(directory)
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.sum(a * b, axis=1)
+
+
+def _onnx_encoders(model_dir: str, tmp_path) -> tuple:
+    """(torch fp32 encoder, onnx fp32 path, onnx int8 path) for the model in `model_dir`."""
+    baseline = TorchVisionEncoder(model_dir)
+    path = str(tmp_path / "clip_vision.onnx")
+    export_onnx(baseline.model, path)
+    return baseline, path, quantize_onnx(path)
+
+
+def test_onnx_export_matches_torch(tiny_model_dir, sample_images, tmp_path):
+    pixel_values = preprocess(sample_images)
+    baseline, path, _ = _onnx_encoders(tiny_model_dir, tmp_path)
+
+    expected = baseline.encode(pixel_values)
+    vectors = OnnxVisionEncoder(path).encode(pixel_values)
+
+    assert vectors.shape == expected.shape
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
+    assert _cosine(expected, vectors).min() >= FP32_MIN_COSINE
+    # the batch dimension is dynamic: one image at a time gives the same vectors
+    single = np.concatenate([OnnxVisionEncoder(path).encode(pixel_values[i:i + 1]) for i in range(2)])
+    assert _cosine(vectors[:2], single).min() >= FP32_MIN_COSINE
+
+
+def test_clip_backends_match_torch_fp32(clip_model_dir, sample_images, tmp_path):
+    pixel_values = preprocess(sample_images)
+    baseline, path, int8_path = _onnx_encoders(clip_model_dir, tmp_path)
+    expected = baseline.encode(pixel_values)
+
+    candidates = {
+        "onnx": (OnnxVisionEncoder(path), FP32_MIN_COSINE),
+        "onnx-int8": (OnnxVisionEncoder(int8_path), INT8_MIN_COSINE),
+        "torch-int8": (TorchVisionEncoder(clip_model_dir, quantize=True), INT8_MIN_COSINE),
+    }
+    for label, (encoder, min_cosine) in candidates.items():
+        cos = _cosine(expected, encoder.encode(pixel_values))
+        assert cos.min() >= min_cosine, f"{label}: {cos}"
@@ -0,0 +1,46 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from services.clip_preprocess import preprocess
+
+transformers = pytest.importorskip("transformers")
+
+# normalized units (1.0 ~ 70 gray levels); same bar as batch/preprocess_parity --max-mean-abs
+MAX_MEAN_ABS = 0.05
+# embedding cosine, same bar as batch/preprocess_parity --min-cosine
+MIN_COSINE = 0.995
+# sample_images whose size needs neither reduced-scale decode nor rounding: identical pixels
+EXACT = (1, 3)
+
+
+def _hf_pixel_values(images: list[bytes]) -> np.ndarray:
+    # the processor config of openai/clip-vit-base-patch32 is CLIPImageProcessor's defaults
+    processor = transformers.CLIPImageProcessor()
+    return processor(images=[Image.open(BytesIO(b)).convert("RGB") for b in images],
+                     return_tensors="np")["pixel_values"]
+
+
+def test_numpy_preprocessing_matches_the_hf_processor(sample_images):
+    hf = _hf_pixel_values(sample_images)
+    fast = preprocess(sample_images)
+
+    assert fast.shape == hf.shape and fast.dtype == np.float32
+    per_image = np.abs(hf - fast).mean(axis=(1, 2, 3))
+    assert per_image.max() <= MAX_MEAN_ABS, per_image
+    np.testing.assert_allclose(fast[list(EXACT)], hf[list(EXACT)], atol=1e-5)
+
+
+def test_numpy_preprocessing_keeps_clip_embeddings(sample_images):
+    pytest.importorskip("torch")
+    from services.clip_encoder import CLIP_MODEL_ID, TorchVisionEncoder
+
+    try:
+        encoder = TorchVisionEncoder(CLIP_MODEL_ID)
+    except OSError as e:  # weights neither cached nor downloadable
+        pytest.skip(f"{CLIP_MODEL_ID} not available: {e}")
+
+    cos = np.sum(encoder.encode(_hf_pixel_values(sample_images)) * encoder.encode(preprocess(sample_images)), axis=1)
+    assert cos.min() >= MIN_COSINE, cos
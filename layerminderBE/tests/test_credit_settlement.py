@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+import worker
+from repositories import credits as credits_repo
+from repositories import history as history_repo
+from services import pipeline
+from services.jobs import SQLiteJobQueue
+
+
+class FakeLedger:
+    """credit_reservations semantics of commit_credit / refund_credit."""
+
+    def __init__(self):
+        self.status = {"res-1": "reserved"}
+        self.credits = 4
+
+    async def commit_credit(self, reservation_id):
+        if self.status.get(reservation_id) != "reserved":
+            return False
+        self.status[reservation_id] = "committed"
+        return True
+
+    async def refund_credit(self, reservation_id, reason):
+        if self.status.get(reservation_id) != "reserved":
+            return -1
+        self.status[reservation_id] = "refunded"
+        self.credits += 1
+        return self.credits
+
+
+@pytest.fixture
+def record(monkeypatch):
+    row = {}
+
+    async def get_record(record_id, columns="*"):
+        return dict(row)
+
+    async def update_record(record_id, fields):
+        row.update(fields)
+
+    async def delete_record_images(record_id):
+        pass
+
+    monkeypatch.setattr(history_repo, "get_record", get_record)
+    monkeypatch.setattr(history_repo, "update_record", update_record)
+    monkeypatch.setattr(history_repo, "delete_record_images", delete_record_images)
+    return row
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    ledger = FakeLedger()
+    monkeypatch.setattr(credits_repo, "commit_credit", ledger.commit_credit)
+    monkeypatch.setattr(credits_repo, "refund_credit", ledger.refund_credit)
+    return ledger
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    """The image stage raises on the first attempt only; every stage succeeds after that."""
+    calls = {"image": 0}
+    image_stage = pipeline._image_stage
+
+    async def flaky_image_stage(*args):
+        calls["image"] += 1
+        if calls["image"] == 1:
+            raise RuntimeError("openai timeout")
+        return await image_stage(*args)
+
+    async def generate_and_store_images(record_id, input_image_keys, user_id, keyword):
+        return [{"image_id": "img-1", "seq": 1, "url": "https://img/1", "content": b"png"}]
+
+    async def generate_and_store_story_keywords(record_id, image):
+        return {"story": "story", "keywords": ["k"]}
+
+    async def recommendation_stage(record_id, user_id, image_ids, image_bytes):
+        return True
+
+    monkeypatch.setattr(pipeline, "_image_stage", flaky_image_stage)
+    monkeypatch.setattr(pipeline, "generate_and_store_images", generate_and_store_images)
+    monkeypatch.setattr(pipeline, "generate_and_store_story_keywords", generate_and_store_story_keywords)
+    monkeypatch.setattr(pipeline, "_recommendation_stage", recommendation_stage)
+    return calls
+
+
+async def _drain(queue: SQLiteJobQueue, job_id: str) -> str:
+    """Run one worker slot until the job left the queue; returns its final status."""
+    stop = asyncio.Event()
+    slot = asyncio.create_task(worker._slot(queue, stop, 0))
+    try:
+        for _ in range(500):
+            with queue._connect() as conn:
+                status = conn.execute(
+                    "SELECT status FROM pipeline_jobs WHERE job_id = ?", (job_id,)
+                ).fetchone()["status"]
+            if status in ("done", "failed"):
+                return status
+            await asyncio.sleep(0.01)
+        raise AssertionError("job did not finish")
+    finally:
+        stop.set()
+        await slot
+
+
+def test_retried_job_commits_the_reservation(tmp_path, monkeypatch, record, ledger, stages):
+    monkeypatch.setattr(worker, "IDLE_POLL_SEC", 0.01)
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.db"), lease_sec=60, max_attempts=3)
+    job_id = queue.enqueue("rec-1", {
+        "input_image_keys": ["in/1.png"],
+        "keyword": None,
+        "user_id": "user-1",
+        "reservation_id": "res-1",
+    })
+
+    assert asyncio.run(_drain(queue, job_id)) == "done"
+    assert stages["image"] == 2  # failed attempt + successful retry
+    assert record["image_status"] == "ready"
+    assert ledger.status["res-1"] == "committed"
+    assert ledger.credits == 4  # never refunded in between
+
+
+def test_last_attempt_refunds_the_reservation(tmp_path, monkeypatch, record, ledger, stages):
+    monkeypatch.setattr(worker, "IDLE_POLL_SEC", 0.01)
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.db"), lease_sec=60, max_attempts=1)
+    job_id = queue.enqueue("rec-1", {
+        "input_image_keys": ["in/1.png"],
+        "keyword": None,
+        "user_id": "user-1",
+        "reservation_id": "res-1",
+    })
+
+    assert asyncio.run(_drain(queue, job_id)) == "failed"
+    assert record["image_status"] == "error"
+    assert ledger.status["res-1"] == "refunded"
+    assert ledger.credits == 5
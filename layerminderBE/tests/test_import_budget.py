@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+# same list as batch/import_budget.py: these load lazily, behind the pipeline / worker boundary
+HEAVY = ("numpy", "faiss", "torch", "transformers", "PIL")
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_api_import_keeps_ml_dependencies_unloaded():
+    # fresh interpreter: this test session may already have imported numpy / faiss
+    code = (
+        "import sys, run; "
+        "print(' '.join(sorted({m.split('.')[0] for m in sys.modules})))"
+    )
+    proc = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR,
+                          capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    loaded = set(proc.stdout.split())
+    assert not loaded & set(HEAVY), f"import run loaded {sorted(loaded & set(HEAVY))}"
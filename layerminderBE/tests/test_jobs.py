@@ -0,0 +1,33 @@
+import time
+
+from services.jobs import SQLiteJobQueue
+
+
+def _queue(tmp_path, **kwargs) -> SQLiteJobQueue:
+    return SQLiteJobQueue(str(tmp_path / "jobs.db"), lease_sec=60, max_attempts=3, **kwargs)
+
+
+def test_failed_job_waits_for_its_backoff(tmp_path):
+    queue = _queue(tmp_path, retry_backoff_sec=0.2)
+    job_id = queue.enqueue("rec-1", {"user_id": "user-1"})
+
+    job = queue.claim()
+    assert queue.fail(job["job_id"], job["token"], "RateLimitError")
+    assert queue.claim() is None  # not due yet
+
+    time.sleep(0.25)
+    job = queue.claim()
+    assert job["job_id"] == job_id and job["attempts"] == 2
+
+
+def test_retry_delay_doubles_per_attempt_up_to_the_cap(tmp_path):
+    queue = _queue(tmp_path, retry_backoff_sec=30, retry_backoff_max_sec=100)
+    assert [queue.retry_delay(a) for a in (1, 2, 3, 4)] == [30, 60, 100, 100]
+
+
+def test_fail_needs_the_current_claim_token(tmp_path):
+    queue = _queue(tmp_path)
+    queue.enqueue("rec-1", {"user_id": "user-1"})
+    job = queue.claim()
+    assert not queue.fail(job["job_id"], "stale-token", "boom")
+    assert queue.complete(job["job_id"], job["token"])
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from repositories import history as history_repo
+from services import pipeline
+
+
+def test_failing_stage_cancels_the_others(monkeypatch):
+    writes = []
+    story_cancelled = asyncio.Event()
+
+    async def update_record(record_id, fields):
+        writes.append(fields)
+
+    async def story_stage(record_id, image_bytes):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            story_cancelled.set()
+            raise
+        await history_repo.update_record(record_id, {"story_status": "ready"})
+        return True
+
+    async def recommendation_stage(record_id, user_id, image_ids, image_bytes):
+        raise RuntimeError("faiss exploded")
+
+    monkeypatch.setattr(history_repo, "update_record", update_record)
+    monkeypatch.setattr(pipeline, "_story_stage", story_stage)
+    monkeypatch.setattr(pipeline, "_recommendation_stage", recommendation_stage)
+
+    async def run():
+        with pytest.raises(RuntimeError, match="faiss exploded"):
+            await pipeline._run_pipeline("rec-1", [], None, "user-1", frozenset({"image"}),
+                                         {"images_ready": True})
+        # nothing is left running detached once the error reached the caller
+        assert story_cancelled.is_set()
+        await asyncio.sleep(0)
+        assert {"story_status": "ready"} not in writes
+
+    asyncio.run(run())
+
+
+def test_image_stage_failure_survives_a_failing_status_write(monkeypatch):
+    async def generate_and_store_images(*args, **kwargs):
+        raise RuntimeError("openai timeout")
+
+    async def update_record(record_id, fields):
+        if fields.get("image_status") == "error":
+            raise ConnectionError("supabase down")
+
+    monkeypatch.setattr(pipeline, "generate_and_store_images", generate_and_store_images)
+    monkeypatch.setattr(history_repo, "update_record", update_record)
+
+    assert asyncio.run(pipeline._image_stage("rec-1", [], None, "user-1")) is None
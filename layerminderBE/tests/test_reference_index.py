@@ -0,0 +1,44 @@
+import logging
+
+import faiss
+import numpy as np
+import pytest
+
+from services.reference_index import (
+    build_index, build_metadata, read_reference_index, write_reference_index,
+)
+
+
+def _vectors(n: int = 300, d: int = 64) -> np.ndarray:
+    x = np.random.default_rng(0).standard_normal((n, d)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def _codes(index):
+    """The vector storage inside the IDMap2 wrapper."""
+    base = faiss.downcast_index(index.index)
+    if isinstance(base, faiss.IndexHNSW):
+        base = faiss.downcast_index(base.storage)
+    return base.codes
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_index_vectors_are_memory_mapped(tmp_path, caplog, index_type):
+    vectors = _vectors()
+    ids = np.arange(len(vectors), dtype="int64") * 7 + 3
+    metadata = build_metadata([
+        {"id": int(i), "reference_image_id": f"ref-{i}", "url": f"https://ref/{i}", "path": f"{i}.png"}
+        for i in ids
+    ])
+    write_reference_index(build_index(vectors, index_type, ids=ids), metadata, str(tmp_path), vectors)
+
+    with caplog.at_level(logging.INFO, logger="services.reference_index"):
+        index, meta = read_reference_index(str(tmp_path))
+
+    assert "memory-mapped" in caplog.text
+    # plain IO_FLAG_MMAP copies these into the process (is_owned=True)
+    assert not _codes(index).is_owned
+    scores, labels = index.search(vectors[:5], 1)
+    assert labels[:, 0].tolist() == ids[:5].tolist()
+    assert np.allclose(scores[:, 0], 1.0, atol=1e-5)
+    assert meta[int(ids[4])]["reference_image_id"] == f"ref-{ids[4]}"
@@ -0,0 +1,125 @@
+'''
+Pipeline worker: `python worker.py` (PIPELINE_QUEUE=sqlite)
+Claims jobs enqueued by /generate and runs them with WORKER_CONCURRENCY
+slots; stage concurrency is capped by services.concurrency. A heartbeat
+keeps the job's lease while it runs; a job out of attempts gets its record
+marked failed and its credit refunded.
+On SIGTERM/SIGINT it stops claiming and lets running jobs finish.
+'''
+import asyncio
+import signal
+
+from core.config import settings
+from core.supabase_client import close_async_supabase
+from services.image_fetcher import close_http_client
+from services.concurrency import shutdown_executors
+from services.jobs import get_job_queue
+from services.pipeline import fail_pipeline, resume_pipeline
+from services.warmup import start_warmup
+from prometheus_client import start_http_server
+
+IDLE_POLL_SEC = 1.0
+
+
+async def _heartbeat(queue, job: dict, pipeline: asyncio.Task) -> None:
+    """Renews the lease while the pipeline runs; stops the run if the job was taken over."""
+    while True:
+        await asyncio.sleep(queue.lease_sec / 3)
+        try:
+            owned = await asyncio.to_thread(queue.heartbeat, job["job_id"], job["token"])
+        except Exception as e:
+            print(f"[Worker] heartbeat for job {job['job_id']} failed: {e}")
+            continue
+        if not owned:
+            print(f"[Worker] lost the lease on job {job['job_id']}, stopping this run")
+            pipeline.cancel()
+            return
+
+
+async def _give_up(queue, job: dict, error: str) -> None:
+    """Last attempt used up: clean up the record, then mark the job failed."""
+    payload = job["payload"]
+    try:
+        await fail_pipeline(job["record_id"], payload["user_id"], payload.get("reservation_id"), error)
+    except Exception as e:
+        # lease runs out and the job comes back as exhausted: cleanup is retried then
+        print(f"[Worker] cleanup of job {job['job_id']} failed: {e}")
+        return
+    await asyncio.to_thread(queue.fail, job["job_id"], job["token"], error)
+
+
+async def _slot(queue, stop: asyncio.Event, slot_id: int) -> None:
+    while not stop.is_set():
+        job = await asyncio.to_thread(queue.claim)
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=IDLE_POLL_SEC)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        payload = job["payload"]
+        if job["exhausted"]:
+            # out of attempts (the last run died without failing the job)
+            print(f"[Worker {slot_id}] job {job['job_id']} record {job['record_id']} out of attempts")
+            await _give_up(queue, job, "max_attempts_exceeded")
+            continue
+
+        print(f"[Worker {slot_id}] job {job['job_id']} record {job['record_id']} (attempt {job['attempts']})")
+        pipeline = asyncio.create_task(resume_pipeline(
+            job["record_id"],
+            payload["input_image_keys"],
+            payload.get("keyword"),
+            payload["user_id"],
+            payload.get("reservation_id"),
+            # attempts left: the retry (or _give_up) settles a reservation without images
+            retry_on_error=job["attempts"] < queue.max_attempts,
+        ))
+        heartbeat = asyncio.create_task(_heartbeat(queue, job, pipeline))
+        try:
+            await pipeline
+            await asyncio.to_thread(queue.complete, job["job_id"], job["token"])
+        except asyncio.CancelledError:
+            if not pipeline.cancelled():
+                raise
+            # lease lost: the job belongs to another claim now
+        except Exception as e:
+            print(f"[Worker {slot_id}] job {job['job_id']} failed: {e}")
+            error = f"{type(e).__name__}: {e}"
+            if job["attempts"] >= queue.max_attempts:
+                await _give_up(queue, job, error)
+            else:
+                await asyncio.to_thread(queue.fail, job["job_id"], job["token"], error)
+        finally:
+            heartbeat.cancel()
+
+
+async def main() -> None:
+    queue = get_job_queue()
+    if queue is None:
+        raise SystemExit("worker.py requires PIPELINE_QUEUE=sqlite")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    if settings.WORKER_METRICS_PORT:
+        start_http_server(settings.WORKER_METRICS_PORT)
+
+    if settings.WARMUP_ON_STARTUP:
+        start_warmup()  # jobs claimed meanwhile just load lazily
+
+    print(f"[Worker] started with {settings.WORKER_CONCURRENCY} slots ({queue.path})")
+    try:
+        await asyncio.gather(*[
+            _slot(queue, stop, i) for i in range(max(1, settings.WORKER_CONCURRENCY))
+        ])
+    finally:
+        await close_http_client()
+        await close_async_supabase()
+        shutdown_executors()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())